@@ -0,0 +1,137 @@
+# Клиентская агрегация результатов отчетов: перегруппировка, сводные таблицы,
+# промежуточные итоги и сортировка без повторных запросов GROUP BY к серверу
+from decimal import Decimal
+
+from resultstore import ColumnStore
+
+
+def decade_label(year):
+    # Десятилетие постройки: 1987 -> "1980-е"
+    if year is None:
+        return "Не указан"
+    return f"{year // 10 * 10}-е"
+
+
+def _round(value):
+    if isinstance(value, Decimal):
+        return round(value, 2)
+    if isinstance(value, float):
+        return round(value, 2)
+    return value
+
+
+class AggregationEngine:
+    # Агрегация детальных строк (ColumnStore) в памяти
+    #
+    # Ключ группировки - имя колонки или (имя результата, колонка, функция от значения).
+    # Показатель - (имя результата, вид, колонка), вид: count, sum, min, max, avg,
+    # ratio (колонка - пара (числитель, знаменатель): сумма / сумма).
+
+    def __init__(self, store):
+        self.store = store
+        self.index = {name: i for i, name in enumerate(store.names)}
+
+    def _key_getter(self, key):
+        if isinstance(key, str):
+            return key, self.store.columns[self.index[key]], None
+        name, column, func = key
+        return name, self.store.columns[self.index[column]], func
+
+    def _group_keys(self, keys, indices):
+        # Значения ключа группы для каждой строки
+        getters = [self._key_getter(k) for k in keys]
+        result = []
+        for i in indices:
+            result.append(tuple(func(col[i]) if func else col[i] for _, col, func in getters))
+        return [name for name, _, _ in getters], result
+
+    def _accumulate(self, measures, group_rows):
+        # Значения показателей по группам: {ключ: [значения]}
+        results = {}
+        for key, rows in group_rows.items():
+            values = []
+            for _, kind, column in measures:
+                if kind == 'count':
+                    values.append(len(rows))
+                    continue
+                if kind == 'ratio':
+                    num = self.store.columns[self.index[column[0]]]
+                    den = self.store.columns[self.index[column[1]]]
+                    num_sum = sum(num[i] for i in rows if num[i] is not None)
+                    den_sum = sum(den[i] for i in rows if den[i] is not None)
+                    values.append(_round(num_sum / den_sum) if den_sum else 0)
+                    continue
+                col = self.store.columns[self.index[column]]
+                present = [col[i] for i in rows if col[i] is not None]
+                if kind == 'sum':
+                    values.append(_round(sum(present)) if present else 0)
+                elif kind == 'avg':
+                    values.append(_round(sum(present) / len(present)) if present else 0)
+                elif kind == 'min':
+                    values.append(min(present) if present else None)
+                elif kind == 'max':
+                    values.append(max(present) if present else None)
+                else:
+                    raise ValueError(f"Неизвестный вид показателя: {kind}")
+            results[key] = values
+        return results
+
+    def _groups(self, keys, indices=None):
+        indices = range(len(self.store)) if indices is None else indices
+        names, row_keys = self._group_keys(keys, indices)
+        groups = {}
+        for i, key in zip(indices, row_keys):
+            groups.setdefault(key, []).append(i)
+        return names, groups
+
+    def group(self, keys, measures, order_by=None, reverse=False, indices=None):
+        # Группировка: ColumnStore с колонками ключей и показателей
+        names, groups = self._groups(keys, indices)
+        aggregated = self._accumulate(measures, groups)
+        rows = [key + tuple(values) for key, values in aggregated.items()]
+        result = ColumnStore.from_rows(names + [m[0] for m in measures], rows)
+        if not rows:
+            return result
+        order = result.sort_order(result.names.index(order_by) if order_by else 0, reverse)
+        return ColumnStore.from_rows(result.names, [rows[i] for i in order])
+
+    def pivot(self, row_key, col_key, measure, total_label="Итого"):
+        # Сводная таблица: строки - row_key, столбцы - значения col_key, ячейки - measure
+        names, groups = self._groups([row_key, col_key])
+        aggregated = self._accumulate([measure], groups)
+        row_totals = self._accumulate([measure], self._groups([row_key])[1])
+        col_values = sorted({key[1] for key in aggregated}, key=lambda v: (v is None, v))
+        row_values = sorted({key[0] for key in row_totals}, key=lambda v: (v is None, v))
+        rows = []
+        for rv in row_values:
+            cells = [aggregated.get((rv, cv), [0])[0] or 0 for cv in col_values]
+            rows.append((rv,) + tuple(cells) + (row_totals[(rv,)][0],))
+        header = [names[0]] + [str(cv) for cv in col_values] + [total_label]
+        return ColumnStore.from_rows(header, rows)
+
+
+def with_subtotals(store, key_index, sum_indices, label="Итого"):
+    # Вставка строк промежуточных итогов после каждой группы (строки store должны быть упорядочены по ключу)
+    result = []
+    current = None
+    sums = None
+
+    def flush():
+        if sums is not None:
+            row = [None] * len(store.names)
+            row[key_index] = f"{label}: {current}"
+            for i in sum_indices:
+                row[i] = _round(sums[i])
+            result.append(tuple(row))
+
+    for row in zip(*store.columns):
+        if sums is None or row[key_index] != current:
+            flush()
+            current = row[key_index]
+            sums = dict.fromkeys(sum_indices, 0)
+        for i in sum_indices:
+            if row[i] is not None:
+                sums[i] += row[i]
+        result.append(row)
+    flush()
+    return ColumnStore.from_rows(store.names, result)
@@ -1,10 +1,44 @@
-import tkinter as tk
-from tkinter import ttk, messagebox
-import psycopg2
-from datetime import date, datetime
-from config import DB_CONFIG
+import time
+
+_START_TIME = time.perf_counter()
 
-# Словарь таблиц с их русскими названиями и полями
+import json
+import locale
+import queue
+import threading
+import tkinter as tk
+from collections import OrderedDict
+from contextlib import contextmanager
+from tkinter import ttk, messagebox, filedialog
+from datetime import date
+from config import (DB_CONFIG, PROFILE_LOG_PATH, QUERY_LOG_PATH, STATE_PATH, STARTUP_TARGET_MS, REPORT_LOCAL_MAX_ROWS,
+                    OFFLINE_QUEUE_PATH, RECONNECT_INTERVAL_MS, REPLAY_BATCH_SIZE, SNAPSHOT_PATH, REPORT_CHUNK_ROWS,
+                    ASYNC_POOL_SIZE, FK_SEARCH_LIMIT, FK_SEARCH_DELAY_MS, FK_CACHE_SIZE, PREFLIGHT_WARN_ROWS,
+                    PREFLIGHT_PAGE_ROWS, REPORT_CACHE_PATH, REPORT_CACHE_MAX_MB, REPORT_CACHE_MAX_ROWS, CATALOG_PATH,
+                    READ_DB_CONFIG, READ_MAX_LAG_S, READ_LAG_CHECK_S, GLOBAL_SEARCH_LIMIT)
+from profiling import STATS, timed_cursor
+from statements import StatementRegistry
+from resultstore import ColumnStore, BOOL_LABELS, PG_KINDS, natural_key
+from aggregate import AggregationEngine, decade_label, with_subtotals
+from offline_queue import OfflineQueue
+from report_cache import ReportCache
+from routing import ReadRouter
+import resettlement
+from validation import ConstraintValidator, Pending, format_violations
+import catalog
+import snapshot
+from dal import AsyncDataLayer
+import preflight
+import queries
+
+# Сколько строк последней таблицы сохранять для мгновенного показа при запуске
+CACHED_PAGE_ROWS = 200
+
+# Сколько строк добавлять в Treeview за раз при прокрутке
+PAGE_ROWS = 500
+
+# Словарь таблиц с их русскими названиями и полями; при подключении уточняется по каталогу БД
+# (catalog.apply_to_tables: порядок колонок, подписи из комментариев, ключи, типы и ссылки)
 TABLES = {
     'services': {
         'name': 'Службы',
@@ -89,6 +123,214 @@ FILTER_OPERATORS = [
 ]
 
 
+# Признаки колонок-флагов (редактируются флажком)
+FLAG_COLUMN_PARTS = ('privatized', 'water', 'elevator', 'garbage', 'responsible', 'has_service')
+
+
+def is_flag_column(col, table=None):
+    # По типу из каталога; пока каталог не прочитан - по имени колонки
+    types = TABLES[table].get('types') if table else None
+    if types and col in types:
+        return types[col] == 'boolean'
+    return any(part in col.lower() for part in FLAG_COLUMN_PARTS)
+
+
+def is_reference_column(table, col):
+    # Ссылочное поле с подсказкой: внешний ключ по каталогу (или по списку подсказок, пока каталог не прочитан)
+    info = TABLES[table]
+    if col not in queries.FK_LOOKUPS or col == info['pk']:
+        return False
+    return 'foreign' not in info or col in info['foreign']
+
+
+def column_kinds(table):
+    # Типы колонок хранилища по каталогу; None - тип определяется по значениям
+    types = TABLES[table].get('types', {})
+    return [PG_KINDS.get(types.get(col)) for col in TABLES[table]['columns']]
+
+
+def entry_value(entry):
+    # Значение поля диалога: bool для флажка, строка или None для поля ввода
+    if hasattr(entry, 'var'):
+        return entry.var.get()
+    val = entry.get().strip()
+    return val if val != "" else None
+
+
+def edit_value(col, text, table=None):
+    # Значение из отформатированной строки таблицы в том же виде, что entry_value
+    if is_flag_column(col, table):
+        return text == "Да"
+    return text if text != "" else None
+
+
+class LazyRows:
+    # Постраничное заполнение Treeview из колоночного хранилища по мере прокрутки
+
+    def __init__(self, tree, scrollbar):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.store = None
+        self.view = None
+        self.shown = 0
+        self.phase = "tk_insert"
+        self.pending = False
+        tree.configure(yscrollcommand=self.on_scroll)
+
+    def set_data(self, store, view=None, phase=None):
+        # Показать новые данные: очистка и первая страница
+        self.store = store
+        self.view = view
+        self.phase = phase or self.phase
+        self.tree.delete(*self.tree.get_children())
+        self.shown = 0
+        self.render_more()
+
+    def total(self):
+        if self.store is None:
+            return 0
+        return len(self.view) if self.view is not None else len(self.store)
+
+    def render_more(self):
+        # Добавить следующую страницу строк (форматируются только они)
+        self.pending = False
+        stop = min(self.shown + PAGE_ROWS, self.total())
+        if stop <= self.shown:
+            return
+        with STATS.phase(self.phase, stop - self.shown):
+            for values in self.store.format_rows(self.shown, stop, self.view):
+                self.tree.insert("", tk.END, values=values)
+        self.shown = stop
+
+    def on_scroll(self, first, last):
+        # Догрузка следующей страницы при прокрутке к концу
+        self.scrollbar.set(first, last)
+        if float(last) >= 0.95 and not self.pending and self.shown < self.total():
+            self.pending = True
+            self.tree.after_idle(self.render_more)
+
+    def grow(self):
+        # В хранилище дописаны строки: дорисовать первую страницу или продолжить, если список прокручен до конца
+        if self.shown < PAGE_ROWS or self.tree.yview()[1] >= 0.95:
+            self.render_more()
+
+
+class ForeignKeyPicker(ttk.Combobox):
+    # Поле ссылки на запись другой таблицы: подсказки запрашиваются по мере ввода (не больше FK_SEARCH_LIMIT),
+    # в поле показывается "id: подпись", значение поля - id записи
+
+    def __init__(self, master, app, column, **kwargs):
+        super().__init__(master, postcommand=self.on_post, **kwargs)
+        self.app = app
+        self.column = column
+        self.after_id = None
+        self.last_text = None
+        self.bind('<KeyRelease>', self.on_key)
+
+    def text(self):
+        return ttk.Combobox.get(self).strip()
+
+    def get(self):
+        # Значение поля - id записи (текст до двоеточия) или введенный текст как есть
+        text = self.text()
+        head = text.split(':', 1)[0].strip()
+        return head if head.isdigit() else text
+
+    def set_id(self, value):
+        # Показать запись по id; подпись - если уже известна
+        self.delete(0, tk.END)
+        if value in (None, ""):
+            return
+        label = self.app.fk_labels.get((self.column, int(value)))
+        self.insert(0, f"{value}: {label}" if label else str(value))
+
+    def on_key(self, event):
+        # Поиск после паузы во вводе, а не на каждую клавишу
+        if event.keysym in ('Up', 'Down', 'Left', 'Right', 'Return', 'Escape', 'Tab'):
+            return
+        if self.after_id:
+            self.after_cancel(self.after_id)
+        self.after_id = self.after(FK_SEARCH_DELAY_MS, self.lookup)
+
+    def on_post(self):
+        # Открытие списка: подсказки для текущего текста, если их еще не запрашивали
+        if self.text() != self.last_text:
+            self.lookup()
+
+    def lookup(self):
+        self.after_id = None
+        text = self.text()
+        self.last_text = text
+        self.app.fk_search(self.column, text, lambda items: self.show_items(text, items))
+
+    def show_items(self, text, items):
+        # Ответ на устаревший ввод не показывается
+        if not self.winfo_exists() or self.text() != text:
+            return
+        self['values'] = [f"{key}: {label}" for key, label in items]
+
+
+class ReportStream:
+    # Строки отчета частями: запрос выполняется в фоновом потоке на отдельном соединении через
+    # именованный (серверный) курсор, части передаются в поток Tk через очередь
+
+    def __init__(self, sql, params=None, expected=None, profile='report', config=None):
+        self.sql = sql
+        self.params = params
+        # config - сервер, с которого читать (реплика или основной)
+        self.config = config or DB_CONFIG
+        # expected - ожидаемое число строк по оценке планировщика (для счетчика)
+        self.expected = expected
+        self.profile = profile
+        self.chunks = queue.Queue()
+        self.cancelled = False
+        # on_done(store) - вызывается в потоке Tk, когда получены все строки
+        self.on_done = None
+        self.conn = None
+        threading.Thread(target=self.worker, daemon=True).start()
+
+    def worker(self):
+        try:
+            import psycopg2
+            self.conn = psycopg2.connect(cursor_factory=timed_cursor(), **self.config)
+            self.conn.set_session(readonly=True)
+            cursor = self.conn.cursor()
+            preflight.apply_profile(cursor, self.profile, local=False)
+            cursor.close()
+            # Для курсора планировщик выбирает план, быстро отдающий первые строки
+            cursor = self.conn.cursor(name='report_stream')
+            cursor.execute(self.sql, self.params or None)
+            while not self.cancelled:
+                rows = cursor.fetchmany(REPORT_CHUNK_ROWS)
+                if not rows:
+                    break
+                self.chunks.put(('rows', rows))
+            cursor.close()
+            self.chunks.put(('done', None))
+        except Exception as e:
+            if not self.cancelled:
+                self.chunks.put(('error', e))
+        finally:
+            if self.conn is not None:
+                self.conn.close()
+
+    def cancel(self):
+        # Окно отчета закрыто: прервать запрос на сервере и не читать дальше
+        self.cancelled = True
+        try:
+            if self.conn is not None and not self.conn.closed:
+                self.conn.cancel()
+        except Exception:
+            pass
+
+
+def stream_progress(stream, loaded):
+    # Счетчик получения строк: сколько загружено и сколько ожидается по оценке
+    if stream.expected:
+        return f"Загружено строк: {loaded} из ≈{stream.expected}..."
+    return f"Загружено строк: {loaded}..."
+
+
 class DatabaseApp:
     def __init__(self, root):
         self.root = root
@@ -101,11 +343,56 @@ class DatabaseApp:
         self.sort_column = None
         self.sort_reverse = False
         self.current_filter = None
+        self.as_of_date = None
+        self.include_archive = False
         self.toast_window = None
+        self.last_view_query = None
+        self.connecting = False
+        self.pending_table = None
+        self.report_dialogs = {}
+        self.db_events = queue.Queue()
+        self.statements = StatementRegistry(TABLES)
+        # Ограничения схемы для проверки строк до отправки (читаются из каталога при первой проверке)
+        self.validator = ConstraintValidator(TABLES)
+        # Метаданные таблиц из каталога: сохраненные в файле применяются сразу, при подключении сверяется отпечаток схемы
+        self.schema_catalog = catalog.SchemaCatalog(
+            CATALOG_PATH, TABLES, f"{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}")
+        self.table_buttons = {}
+        if self.schema_catalog.load_cached():
+            self.apply_catalog()
+        self.grid_store = None
+        self.grid_store_query = None
+        self.offline = False
+        self.offline_queue = OfflineQueue(OFFLINE_QUEUE_PATH)
+        self.snapshot_store = snapshot.SnapshotStore(SNAPSHOT_PATH, TABLES)
+        self.snapshot_active = False
+        self.report_cache = ReportCache(REPORT_CACHE_PATH, REPORT_CACHE_MAX_MB * 1024 * 1024)
+        # Чтение отчетов и таблиц с реплики (если задан READ_DB_CONFIG), запись - на основной сервер
+        self.router = ReadRouter(READ_DB_CONFIG, READ_MAX_LAG_S, READ_LAG_CHECK_S)
+        self.dal = AsyncDataLayer(READ_DB_CONFIG or DB_CONFIG, ASYNC_POOL_SIZE) if AsyncDataLayer.available() else None
+        self.dal_polling = False
+        # Подсказки ссылочных полей: последние поиски и известные подписи записей
+        self.fk_cache = OrderedDict()
+        self.fk_labels = {}
+        # Загрузка большой таблицы частями (ReportStream), пока она идет
+        self.grid_stream = None
+        STATS.log_path = PROFILE_LOG_PATH
 
         self.create_widgets()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.show_cached_page()
+        # Окно показывается сразу, подключение идет в фоне
+        self.root.after_idle(self.mark_interactive)
         self.connect_db()
 
+    def mark_interactive(self):
+        # Замер времени до готовности окна к работе
+        elapsed = time.perf_counter() - _START_TIME
+        STATS.record_phase("startup:interactive", elapsed)
+        if elapsed * 1000 > STARTUP_TARGET_MS:
+            self.show_toast(f"Медленный запуск: {elapsed * 1000:.0f} мс (цель {STARTUP_TARGET_MS} мс)",
+                            toast_type="warning")
+
     def show_toast(self, message, duration=2500, toast_type="info"):
         # Показать всплывающее уведомление
         if self.toast_window:
@@ -162,13 +449,499 @@ class DatabaseApp:
             self.toast_window = None
 
     def connect_db(self):
-        # Подключение к базе данных
+        # Подключение к базе данных в фоновом потоке, чтобы не блокировать окно
+        if self.connecting:
+            return
+        self.connecting = True
+
+        def worker():
+            try:
+                import psycopg2
+                conn = psycopg2.connect(cursor_factory=timed_cursor(), **DB_CONFIG)
+                self.router.connect(lambda config: psycopg2.connect(cursor_factory=timed_cursor(), **config))
+                try:
+                    catalog_changed = self.schema_catalog.refresh(conn)
+                except Exception:
+                    # Без каталога работа продолжается по прежним метаданным
+                    conn.rollback()
+                    catalog_changed = False
+                self.db_events.put(('connected', (conn, catalog_changed)))
+            except Exception as e:
+                self.db_events.put(('error', e))
+
+        threading.Thread(target=worker, daemon=True).start()
+        self.root.after(50, self.poll_db_events)
+
+    def poll_db_events(self):
+        # Обработка результата фонового подключения в потоке Tk
+        try:
+            kind, payload = self.db_events.get_nowait()
+        except queue.Empty:
+            self.root.after(50, self.poll_db_events)
+            return
+        self.connecting = False
+        if kind == 'connected':
+            self.conn, catalog_changed = payload
+            if catalog_changed:
+                self.apply_catalog()
+            STATS.record_phase("startup:connected", time.perf_counter() - _START_TIME)
+            if self.router.configured() and self.router.reader() is None:
+                self.show_toast(f"Подключено к базе данных\n{self.router.status()}", toast_type="warning")
+            else:
+                self.show_toast("Подключено к базе данных", toast_type="success")
+            self.offline = False
+            # Сначала отправляются изменения, накопленные без связи
+            self.replay_offline_queue()
+            table = self.pending_table or self.current_table
+            self.pending_table = None
+            if table and self.conn:
+                self.load_table(table)
+        else:
+            if not self.offline:
+                messagebox.showerror("Ошибка подключения", f"Не удалось подключиться к БД:\n{payload}")
+                self.show_toast("Ошибка подключения к БД", toast_type="error")
+                self.offline = True
+            self.update_offline_label()
+            # Без связи изменения копятся локально, подключение повторяется в фоне
+            self.root.after(RECONNECT_INTERVAL_MS, self.connect_db)
+
+    def apply_catalog(self):
+        # Метаданные каталога в TABLES, проверку ограничений и формы запросов
+        meta = self.schema_catalog.meta
+        catalog.apply_to_tables(TABLES, meta)
+        self.validator.apply(meta)
+        self.statements.reset()
+        self.grid_store_query = None
+        for table, button in self.table_buttons.items():
+            button.config(text=TABLES[table]['name'])
+
+    @contextmanager
+    def reading(self):
+        # Соединение для отчетов, выгрузок и загрузки таблиц: реплика, если она годится, иначе основное.
+        # Реплика удерживается до конца блока (фоновое переподключение не закроет ее посреди запроса),
+        # по выходе транзакция чтения завершается
+        with self.router.reading() as replica:
+            conn = replica or self.conn
+            try:
+                yield conn
+            finally:
+                self.finish_read(conn)
+
+    def read_config(self):
+        # Параметры подключения для отдельного соединения чтения (потоковая загрузка)
+        return self.router.config if self.router.reader() is not None else DB_CONFIG
+
+    def finish_read(self, conn):
+        # Транзакция чтения завершается сразу: параметры профиля (set_config ... local) не должны действовать
+        # на следующие операции на основном сервере, а открытая транзакция на реплике задерживает применение WAL
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+
+    def commit_write(self):
+        # Фиксация на основном сервере; чтение идет с основного, пока реплика не применит эту запись
+        self.conn.commit()
+        self.router.note_write(self.conn)
+
+    def can_read(self):
+        # Есть откуда читать: подключение к серверу или включенный локальный снимок
+        return self.conn is not None or self.snapshot_active
+
+    def report_source(self, sql, params=None):
+        # Строки отчета: со снимка - сразу списком, с сервера - потоком частей
+        # Очень большой отчет формируется только после подтверждения; None - пользователь отказался
+        if self.snapshot_active:
+            return self.run_read(sql, params)
+        expected = None
+        try:
+            with self.reading() as conn:
+                cursor = conn.cursor()
+                expected = preflight.explain_estimate(cursor, sql, params).rows
+                cursor.close()
+        except Exception:
+            pass
+        if expected and expected > PREFLIGHT_WARN_ROWS and not messagebox.askyesno(
+                "Большой отчет", f"Отчет будет содержать примерно {expected} строк. Сформировать?"):
+            return None
+        return ReportStream(sql, params, expected, config=self.read_config())
+
+    def cached_report(self, report, tables, *params):
+        # Результат отчета из кэша: (ключ, версии данных, строки или None, если в кэше нет или данные менялись)
+        # Версии читаются до запроса отчета, чтобы изменения, сделанные во время его выполнения, не попали
+        # в кэш под новой отметкой. В режиме снимка и без data_versions на сервере кэш не используется
+        if self.snapshot_active:
+            return None, None, None
+        try:
+            versions = dict(self.run_read(queries.DATA_VERSIONS_SQL, (tables,)))
+        except Exception:
+            self.conn.rollback()
+            return None, None, None
+        key = ReportCache.make_key(DB_CONFIG['host'], DB_CONFIG['port'], DB_CONFIG['database'], report, *params)
+        try:
+            return key, versions, self.report_cache.get(key, versions)
+        except Exception:
+            return key, versions, None
+
+    def store_report(self, key, versions, rows):
+        # Сохранить результат отчета (список строк или ColumnStore) в кэш; слишком длинные не сохраняются,
+        # ошибка кэша отчет не прерывает
+        if key is None or len(rows) > REPORT_CACHE_MAX_ROWS:
+            return
+        if isinstance(rows, ColumnStore):
+            rows = list(zip(*rows.columns))
+        try:
+            self.report_cache.put(key, versions, rows)
+        except Exception:
+            pass
+
+    def read_async(self, requests, callback, errback=None, profile=None):
+        # Независимые запросы [(sql, params)] одновременно через асинхронный слой; callback(results) - в потоке Tk
+        # Без psycopg 3 и в режиме снимка запросы выполняются по очереди здесь же
+        # profile - профиль параметров сервера из QUERY_PROFILES
+        # Асинхронный слой читает с реплики; пока она отстает - запросы идут на основной здесь же
+        if self.dal is None or not self.dal.usable() or self.snapshot_active \
+                or (self.router.configured() and self.router.reader() is None):
+            try:
+                results = [self.run_read(sql, params, profile) for sql, params in requests]
+            except Exception as e:
+                if self.conn and not self.snapshot_active:
+                    self.conn.rollback()
+                if errback:
+                    errback(e)
+                return
+            callback(results)
+            return
+        def failed(e):
+            # Асинхронное соединение не открылось - те же запросы через psycopg2
+            if not self.dal.usable():
+                self.read_async(requests, callback, errback, profile)
+            elif errback:
+                errback(e)
+
+        self.dal.submit(requests, callback, failed, profile)
+        if not self.dal_polling:
+            self.dal_polling = True
+            self.root.after(20, self.poll_dal)
+
+    def poll_dal(self):
+        # Разбор готовых результатов асинхронного слоя, пока есть незавершенные операции
+        if self.dal.dispatch():
+            self.root.after(20, self.poll_dal)
+        else:
+            self.dal_polling = False
+
+    def fk_search(self, column, text, callback):
+        # Подсказки для ссылочного поля [(id, подпись)]: из кэша последних поисков или запросом с LIMIT
+        key = (column, text.lower())
+        items = self.fk_cache.get(key)
+        if items is not None:
+            self.fk_cache.move_to_end(key)
+            callback(items)
+            return
+        if not self.can_read():
+            return
+
+        def found(results):
+            self.fk_cache[key] = results[0]
+            while len(self.fk_cache) > FK_CACHE_SIZE:
+                self.fk_cache.popitem(last=False)
+            for record_id, label in results[0]:
+                self.fk_labels[(column, record_id)] = label
+            callback(results[0])
+
+        self.read_async([queries.build_fk_search(column, text, FK_SEARCH_LIMIT)], found, profile='lookup')
+
+    def resolve_fk_labels(self, values, callback):
+        # Подписи записей для {колонка: id} одним пакетом запросов (по запросу на колонку), затем callback()
+        missing = {col: int(value) for col, value in values.items()
+                   if str(value).isdigit() and (col, int(value)) not in self.fk_labels}
+        if not missing or not self.can_read():
+            callback()
+            return
+
+        def resolved(results):
+            for col, rows in zip(missing, results):
+                for record_id, label in rows:
+                    self.fk_labels[(col, record_id)] = label
+            callback()
+
+        self.read_async([queries.build_fk_labels(col, [value]) for col, value in missing.items()], resolved,
+                        profile='lookup')
+
+    def clear_fk_cache(self):
+        # Данные изменились или сменился источник: подсказки запрашиваются заново
+        self.fk_cache.clear()
+        self.fk_labels.clear()
+
+    def run_read(self, sql, params=None, profile=None):
+        # Чтение для отчетов и списков выбора: из снимка в режиме снимка, иначе с сервера
+        if self.snapshot_active:
+            return self.snapshot_store.query(sql, params)
+        with self.reading() as conn:
+            cursor = conn.cursor()
+            if profile:
+                preflight.apply_profile(cursor, profile)
+            self.statements.execute_sql(cursor, sql, params)
+            rows = cursor.fetchall()
+            cursor.close()
+        return rows
+
+    def connection_lost(self):
+        # Соединение потеряно: psycopg2 помечает его закрытым после сетевой ошибки
+        return self.conn is None or bool(self.conn.closed)
+
+    def go_offline(self):
+        # Перейти в автономный режим после обрыва связи
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+        self.conn = None
+        self.router.close()
+        if not self.offline:
+            self.offline = True
+            self.show_toast("Нет связи с БД: изменения сохраняются локально", toast_type="warning")
+            self.root.after(RECONNECT_INTERVAL_MS, self.connect_db)
+        self.update_offline_label()
+
+    def update_offline_label(self):
+        # Состояние автономного режима и очереди изменений
+        try:
+            queued = self.offline_queue.count()
+        except Exception:
+            queued = 0
+        if self.offline:
+            self.offline_label_var.set(f"Нет связи с БД | изменений в очереди: {queued}")
+        elif queued:
+            self.offline_label_var.set(f"Изменений в очереди: {queued}")
+        else:
+            self.offline_label_var.set("")
+
+    def queue_write(self, kind, payload):
+        # Сохранить изменение в локальной очереди до восстановления связи
+        try:
+            self.offline_queue.put(kind, payload)
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить изменение локально:\n{e}")
+            return
+        self.update_offline_label()
+        self.show_toast("Нет связи с БД: изменение поставлено в очередь", toast_type="warning")
+
+    def replay_offline_queue(self):
+        # Отправить изменения, накопленные без связи: по порядку, пачками по REPLAY_BATCH_SIZE в одной транзакции
+        try:
+            if not self.offline_queue.count():
+                self.update_offline_label()
+                return
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Ошибка чтения очереди изменений:\n{e}")
+            return
+
+        applied_total = 0
+        rejected_total = {}
+        while self.conn is not None:
+            entries = self.offline_queue.pending(REPLAY_BATCH_SIZE)
+            if not entries:
+                break
+            applied = []
+            rejected = {}
+            try:
+                cursor = self.conn.cursor()
+                i = 0
+                while i < len(entries):
+                    # Подряд идущие вставки в одну таблицу с одинаковыми колонками - один многострочный INSERT
+                    group = [entries[i]]
+                    if entries[i][1] == 'insert':
+                        shape = (entries[i][2]['table'], tuple(entries[i][2]['values']))
+                        while i + len(group) < len(entries):
+                            _, kind, payload = entries[i + len(group)]
+                            if kind != 'insert' or (payload['table'], tuple(payload['values'])) != shape:
+                                break
+                            group.append(entries[i + len(group)])
+                    self.replay_group(cursor, group, applied, rejected)
+                    i += len(group)
+                self.commit_write()
+                cursor.close()
+            except Exception as e:
+                if self.connection_lost():
+                    self.go_offline()
+                    break
+                self.conn.rollback()
+                messagebox.showerror("Ошибка", f"Ошибка отправки отложенных изменений:\n{e}")
+                break
+            self.offline_queue.done(applied, rejected)
+            applied_total += len(applied)
+            rejected_total.update(rejected)
+
+        self.update_offline_label()
+        if rejected_total:
+            messagebox.showwarning("Очередь изменений",
+                                   f"Отправлено изменений: {applied_total}\n"
+                                   f"Отклонено (конфликт или ошибка): {len(rejected_total)}\n"
+                                   f"Подробности: Сервис -> Очередь изменений")
+        elif applied_total:
+            self.show_toast(f"Отправлено отложенных изменений: {applied_total}", toast_type="success")
+
+    def replay_group(self, cursor, group, applied, rejected):
+        # Применить группу записей очереди под точкой сохранения; при ошибке пачки - по одной записи
+        # Вставки, нарушающие ограничения схемы, отклоняются до отправки, остальные вставляются одной пачкой
+        if group[0][1] == 'insert' and group[0][2]['table'] in TABLES:
+            if not self.validator.loaded():
+                self.validator.load(cursor)
+            violations = self.validator.check(group[0][2]['table'], [payload['values'] for _, _, payload in group],
+                                              cursor)
+            for v in violations:
+                rejected.setdefault(group[v.row][0], v.message)
+            group = [entry for entry in group if entry[0] not in rejected]
+            if not group:
+                return
+        cursor.execute("SAVEPOINT replay")
         try:
-            self.conn = psycopg2.connect(**DB_CONFIG)
-            self.show_toast("Подключено к базе данных", toast_type="success")
+            kind = group[0][1]
+            if kind == 'insert':
+                self.replay_inserts(cursor, [payload for _, _, payload in group])
+            elif kind == 'update':
+                reason = self.replay_update(cursor, group[0][2])
+                if reason:
+                    cursor.execute("ROLLBACK TO SAVEPOINT replay")
+                    rejected[group[0][0]] = reason
+                    return
+            elif kind == 'apartment_tenants':
+                self.insert_apartment_with_tenants(cursor, group[0][2]['apartment'], group[0][2]['tenants'])
+            else:
+                raise ValueError(f"Неизвестный вид изменения: {kind}")
+            cursor.execute("RELEASE SAVEPOINT replay")
+            applied.extend(entry_id for entry_id, _, _ in group)
         except Exception as e:
-            messagebox.showerror("Ошибка подключения", f"Не удалось подключиться к БД:\n{e}")
-            self.show_toast("Ошибка подключения к БД", toast_type="error")
+            if self.connection_lost():
+                raise
+            cursor.execute("ROLLBACK TO SAVEPOINT replay")
+            if len(group) > 1:
+                for entry in group:
+                    self.replay_group(cursor, [entry], applied, rejected)
+            else:
+                rejected[group[0][0]] = str(e).strip()
+
+    def replay_inserts(self, cursor, payloads):
+        # Вставка записей очереди одной таблицы одним многострочным INSERT
+        table = payloads[0]['table']
+        columns = list(payloads[0]['values'])
+        if table not in TABLES or not set(columns) <= set(TABLES[table]['editable']):
+            raise ValueError(f"Недопустимая вставка в {table}")
+        from psycopg2.extras import execute_values
+        execute_values(cursor, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s",
+                       [tuple(p['values'][col] for col in columns) for p in payloads], page_size=len(payloads))
+
+    def replay_update(self, cursor, payload):
+        # Изменение из очереди с проверкой конфликтов; возвращает причину отказа или None
+        table = payload['table']
+        if table not in TABLES or not set(payload['changes']) <= set(TABLES[table]['editable']):
+            return f"Недопустимое изменение {table}"
+        if self.execute_versioned_update(cursor, table, payload['pk'], payload['version'], payload['changes']):
+            return None
+        current = self.fetch_row_version(cursor, table, payload['pk'])
+        if current is None:
+            return "Запись удалена другим пользователем"
+        version, texts = current
+        _, conflicts, merged = self.merge_changes(table, texts, payload['changes'], payload['original'])
+        if conflicts:
+            names = dict(zip(TABLES[table]['columns'], TABLES[table]['column_names']))
+            return "Поля изменены другим пользователем: " + ", ".join(names[col] for col in conflicts)
+        if merged and not self.execute_versioned_update(cursor, table, payload['pk'], version, merged):
+            return "Запись изменена во время отправки"
+        return None
+
+    def open_offline_queue_panel(self):
+        # Изменения в очереди и отклоненные при отправке
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Очередь изменений")
+        dialog.geometry("1000x500")
+
+        columns = [('id', '№', 50), ('created_at', 'Время', 140), ('kind', 'Вид', 120),
+                   ('state', 'Состояние', 280), ('payload', 'Данные', 400)]
+        tree = ttk.Treeview(dialog, columns=[c[0] for c in columns], show='headings')
+        for col, text, width in columns:
+            tree.heading(col, text=text)
+            tree.column(col, width=width, minwidth=40)
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        kinds = {'insert': "Добавление", 'update': "Изменение", 'apartment_tenants': "Квартира + жильцы"}
+
+        def refresh():
+            tree.delete(*tree.get_children())
+            try:
+                for entry_id, kind, payload in self.offline_queue.pending():
+                    tree.insert("", tk.END, values=(entry_id, "", kinds.get(kind, kind), "Ждет отправки",
+                                                    json.dumps(payload, ensure_ascii=False, default=str)))
+                for entry_id, created_at, kind, payload, reason in self.offline_queue.rejected():
+                    tree.insert("", tk.END, values=(entry_id, created_at, kinds.get(kind, kind),
+                                                    f"Отклонено: {reason}",
+                                                    json.dumps(payload, ensure_ascii=False, default=str)))
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Ошибка чтения очереди изменений:\n{e}")
+            self.update_offline_label()
+
+        def send():
+            if not self.conn:
+                self.show_toast("Нет подключения к БД", toast_type="warning")
+                return
+            self.replay_offline_queue()
+            refresh()
+
+        def clear_rejected():
+            if not messagebox.askyesno("Подтверждение", "Удалить отклоненные изменения из списка?"):
+                return
+            self.offline_queue.clear_rejected()
+            refresh()
+
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        ttk.Button(btn_frame, text="Отправить", command=send).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Обновить", command=refresh).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Очистить отклоненные", command=clear_rejected).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Закрыть", command=dialog.destroy).pack(side=tk.RIGHT, padx=5)
+        refresh()
+
+    def show_cached_page(self):
+        # Показать первую страницу последней открытой таблицы из кэша до подключения к БД
+        try:
+            with open(STATE_PATH, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        table = state.get('table')
+        if table not in TABLES:
+            return
+        self.setup_table_view(table)
+        for row in state.get('rows', []):
+            self.tree.insert("", tk.END, values=row)
+        self.filter_label_var.set("Данные из кэша, идет подключение к БД...")
+
+    def save_state(self):
+        # Сохранить последнюю таблицу и ее первую страницу
+        if not self.current_table:
+            return
+        rows = [self.tree.item(item)['values'] for item in self.tree.get_children()[:CACHED_PAGE_ROWS]]
+        if self.as_of_date:
+            # Срез на прошлую дату не подходит для быстрого показа при следующем запуске
+            rows = []
+        try:
+            with open(STATE_PATH, 'w', encoding='utf-8') as f:
+                json.dump({'table': self.current_table, 'rows': rows}, f, ensure_ascii=False, default=str)
+        except OSError:
+            pass
+
+    def on_close(self):
+        # Закрытие приложения
+        self.save_state()
+        if self.conn:
+            self.conn.close()
+        self.router.close()
+        if self.dal:
+            self.dal.close()
+        self.root.destroy()
 
     def create_widgets(self):
         # Создание виджетов интерфейса
@@ -180,10 +953,15 @@ class DatabaseApp:
             btn = ttk.Button(tables_frame, text=table_info['name'], width=20,
                              command=lambda t=table_key: self.load_table(t))
             btn.pack(pady=2)
+            self.table_buttons[table_key] = btn
         forms_frame = ttk.LabelFrame(left_frame, text="Формы", padding=5)
         forms_frame.pack(fill=tk.X, pady=(0, 10))
         ttk.Button(forms_frame, text="Квартира + Жильцы", width=20,
                    command=self.open_apartment_tenants_form).pack(pady=2)
+        ttk.Button(forms_frame, text="Дом + квартиры + жильцы", width=20,
+                   command=self.open_house_bulk_form).pack(pady=2)
+        ttk.Button(forms_frame, text="Переселение жильцов", width=20,
+                   command=self.open_resettlement_dialog).pack(pady=2)
         reports_frame = ttk.LabelFrame(left_frame, text="Отчеты", padding=5)
         reports_frame.pack(fill=tk.X)
         ttk.Button(reports_frame, text="Квартплата", width=20,
@@ -192,6 +970,16 @@ class DatabaseApp:
                    command=self.report_tenants_by_section).pack(pady=2)
         ttk.Button(reports_frame, text="Статистика жилфонда", width=20,
                    command=self.report_housing_stats).pack(pady=2)
+        service_frame = ttk.LabelFrame(left_frame, text="Сервис", padding=5)
+        service_frame.pack(fill=tk.X, pady=(10, 0))
+        ttk.Button(service_frame, text="Диагностика", width=20,
+                   command=self.open_diagnostics_panel).pack(pady=2)
+        ttk.Button(service_frame, text="Архив жильцов", width=20,
+                   command=self.open_archive_dialog).pack(pady=2)
+        ttk.Button(service_frame, text="Очередь изменений", width=20,
+                   command=self.open_offline_queue_panel).pack(pady=2)
+        ttk.Button(service_frame, text="Снимок участка", width=20,
+                   command=self.open_snapshot_dialog).pack(pady=2)
         main_frame = ttk.Frame(self.root)
         main_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5, pady=5)
         search_frame = ttk.LabelFrame(main_frame, text="Поиск (по подстроке)", padding=5)
@@ -204,6 +992,11 @@ class DatabaseApp:
         self.search_entry.pack(side=tk.LEFT, padx=2)
         self.search_entry.bind('<Return>', lambda e: self.search_records())
         ttk.Button(search_frame, text="Найти", command=self.search_records).pack(side=tk.LEFT, padx=2)
+        ttk.Button(search_frame, text="Найти везде", command=self.global_search).pack(side=tk.RIGHT, padx=2)
+        self.global_search_entry = ttk.Entry(search_frame, width=30)
+        self.global_search_entry.pack(side=tk.RIGHT, padx=2)
+        self.global_search_entry.bind('<Return>', lambda e: self.global_search())
+        ttk.Label(search_frame, text="По всей базе:").pack(side=tk.RIGHT, padx=2)
         filter_frame = ttk.LabelFrame(main_frame, text="Фильтр", padding=5)
         filter_frame.pack(fill=tk.X, pady=(0, 5))
         ttk.Label(filter_frame, text="Поле:").pack(side=tk.LEFT, padx=2)
@@ -220,6 +1013,15 @@ class DatabaseApp:
         self.filter_entry.pack(side=tk.LEFT, padx=2)
         ttk.Button(filter_frame, text="Применить", command=self.apply_filter).pack(side=tk.LEFT, padx=2)
         ttk.Button(filter_frame, text="Сброс фильтра", command=self.reset_filter).pack(side=tk.LEFT, padx=2)
+        ttk.Label(filter_frame, text="Жильцы на дату:").pack(side=tk.LEFT, padx=(15, 2))
+        self.as_of_entry = ttk.Entry(filter_frame, width=12)
+        self.as_of_entry.pack(side=tk.LEFT, padx=2)
+        self.as_of_entry.bind('<Return>', lambda e: self.apply_as_of())
+        ttk.Button(filter_frame, text="Показать", command=self.apply_as_of).pack(side=tk.LEFT, padx=2)
+        ttk.Button(filter_frame, text="Текущие", command=self.reset_as_of).pack(side=tk.LEFT, padx=2)
+        self.include_archive_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(filter_frame, text="С архивом", variable=self.include_archive_var,
+                        command=self.toggle_archive).pack(side=tk.LEFT, padx=(10, 2))
         sort_frame = ttk.LabelFrame(main_frame, text="Сортировка", padding=5)
         sort_frame.pack(fill=tk.X, pady=(0, 5))
         ttk.Label(sort_frame, text="Поле:").pack(side=tk.LEFT, padx=2)
@@ -239,7 +1041,8 @@ class DatabaseApp:
         self.tree = ttk.Treeview(data_frame, show="headings")
         vsb = ttk.Scrollbar(data_frame, orient="vertical", command=self.tree.yview)
         hsb = ttk.Scrollbar(data_frame, orient="horizontal", command=self.tree.xview)
-        self.tree.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
+        self.tree.configure(xscrollcommand=hsb.set)
+        self.grid_rows = LazyRows(self.tree, vsb)
         self.tree.grid(row=0, column=0, sticky="nsew")
         vsb.grid(row=0, column=1, sticky="ns")
         hsb.grid(row=1, column=0, sticky="ew")
@@ -252,9 +1055,18 @@ class DatabaseApp:
         ttk.Button(actions_frame, text="Добавить", command=self.add_record).pack(side=tk.LEFT, padx=2)
         ttk.Button(actions_frame, text="Редактировать", command=self.edit_record).pack(side=tk.LEFT, padx=2)
         ttk.Button(actions_frame, text="Удалить", command=self.delete_record).pack(side=tk.LEFT, padx=2)
-        ttk.Button(actions_frame, text="Обновить", command=self.load_data()).pack(side=tk.LEFT, padx=2)
+        ttk.Button(actions_frame, text="Обновить", command=self.load_data).pack(side=tk.LEFT, padx=2)
+        ttk.Button(actions_frame, text="Экспорт CSV", command=self.export_grid).pack(side=tk.LEFT, padx=2)
         self.filter_label_var = tk.StringVar(value="")
         ttk.Label(actions_frame, textvariable=self.filter_label_var, foreground="green").pack(side=tk.LEFT, padx=20)
+        self.estimate_label_var = tk.StringVar(value="")
+        ttk.Label(actions_frame, textvariable=self.estimate_label_var, foreground="gray").pack(side=tk.LEFT, padx=10)
+        self.as_of_label_var = tk.StringVar(value="")
+        ttk.Label(actions_frame, textvariable=self.as_of_label_var, foreground="#cc6600").pack(side=tk.LEFT, padx=10)
+        self.offline_label_var = tk.StringVar(value="")
+        ttk.Label(actions_frame, textvariable=self.offline_label_var, foreground="red").pack(side=tk.RIGHT, padx=10)
+        self.snapshot_label_var = tk.StringVar(value="")
+        ttk.Label(actions_frame, textvariable=self.snapshot_label_var, foreground="blue").pack(side=tk.RIGHT, padx=10)
 
     def on_operator_change(self, event=None):
         # Обработка изменения оператора фильтра
@@ -269,9 +1081,19 @@ class DatabaseApp:
 
     def load_table(self, table_name):
         # Загрузка данных таблицы
-        if not self.conn:
-            self.show_toast("Нет подключения к БД", toast_type="warning")
+        if not self.can_read():
+            if self.connecting:
+                # Таблица откроется сразу после подключения
+                self.pending_table = table_name
+                self.show_toast("Идет подключение к БД...", toast_type="info")
+            else:
+                self.show_toast("Нет подключения к БД", toast_type="warning")
             return
+        self.setup_table_view(table_name)
+        self.load_data()
+
+    def setup_table_view(self, table_name):
+        # Настройка Treeview и комбобоксов под таблицу
         self.current_table = table_name
         table_info = TABLES[table_name]
         # Сброс фильтра и сортировки при смене таблицы
@@ -294,60 +1116,170 @@ class DatabaseApp:
             self.search_field.current(0)
             self.filter_field.current(0)
             self.sort_field.current(0)
-        self.load_data()
 
     def load_data(self):
         # Загрузка данных из текущей таблицы
-        if not self.current_table or not self.conn:
+        if not self.current_table or not self.can_read():
             return
-        try:
-            cursor = self.conn.cursor()
-            query = f"SELECT * FROM {self.current_table}"
-            params = []
-
-            # Применение фильтра
-            if self.current_filter:
-                field, operator, value = self.current_filter
-                if operator in ('IS NULL', 'IS NOT NULL'):
-                    query += f" WHERE {field} {operator}"
-                elif operator in ('LIKE', 'NOT LIKE'):
-                    query += f" WHERE CAST({field} AS TEXT) {operator} %s"
-                    params.append(f"%{value}%")
-                else:
-                    query += f" WHERE {field} {operator} %s"
-                    params.append(value)
+        # Таблица-источник подсказок перечитывается (в том числе после записи) - подсказки тоже
+        if self.current_table in queries.FK_SOURCE_TABLES:
+            self.clear_fk_cache()
+        if self.grid_stream is not None:
+            self.grid_stream.cancel()
+            self.grid_stream = None
+        self.estimate_label_var.set("")
+        if self.snapshot_active:
+            self.load_snapshot_data()
+            return
+        with self.reading() as conn:
+            try:
+                cursor = conn.cursor()
+                statement, params = self.statements.table_statement(
+                    self.current_table, self.current_filter, self.sort_column, self.sort_reverse, self.as_of_date,
+                    self.include_archive)
+
+                self.last_view_query = (statement.sql, params if params else None)
+                preflight.apply_profile(cursor, 'grid')
+
+                # Оценка размера до выполнения: приблизительное число строк показывается сразу
+                whole_table = not self.current_filter and not params and not self.include_archive
+                estimate = preflight.table_estimate(cursor, self.current_table, statement.sql, params, whole_table)
+                self.estimate_label_var.set(f"≈ {estimate.rows} записей")
+                strategy = preflight.choose_strategy(estimate.rows)
+                if strategy == preflight.ASK:
+                    load_all = messagebox.askyesno(
+                        "Большой результат",
+                        f"Запрос вернет примерно {estimate.rows} строк.\n"
+                        f"Загрузить все? (Нет - показать первые {PREFLIGHT_PAGE_ROWS}, уточните фильтр)")
+                    strategy = preflight.STREAM if load_all else preflight.PAGED
+
+                if strategy == preflight.STREAM:
+                    cursor.close()
+                    self.stream_grid(statement.sql, params, estimate.rows)
+                    return
+
+                table_name = TABLES[self.current_table]['name']
+                if strategy == preflight.PAGED:
+                    # Только первая страница: локальные фильтр и сортировка по неполным данным невозможны
+                    cursor.execute(statement.sql + f" LIMIT {PREFLIGHT_PAGE_ROWS}", params or None)
+                    self.grid_store = ColumnStore.from_cursor(TABLES[self.current_table]['columns'], cursor,
+                                                              column_kinds(self.current_table))
+                    self.grid_store_query = None
+                    cursor.close()
+                    self.grid_rows.set_data(self.grid_store, phase=f"tk_insert:{self.current_table}")
+                    self.show_toast(f"{table_name}: показаны первые {len(self.grid_store)} из ≈{estimate.rows} записей",
+                                    toast_type="warning")
+                    return
+
+                self.statements.execute(cursor, statement, params)
+                # Результат хранится по колонкам, строки для показа форматируются постранично
+                self.grid_store = ColumnStore.from_cursor(TABLES[self.current_table]['columns'], cursor,
+                                                          column_kinds(self.current_table))
+                self.grid_store_query = (self.current_filter, self.sort_column, self.sort_reverse, self.as_of_date,
+                                         self.include_archive)
+                cursor.close()
 
-            # Применение сортировки
-            if self.sort_column:
-                order = "DESC" if self.sort_reverse else "ASC"
-                query += f" ORDER BY {self.sort_column} {order}"
+                self.estimate_label_var.set("")
+                self.grid_rows.set_data(self.grid_store, phase=f"tk_insert:{self.current_table}")
+                self.show_toast(f"{table_name}: загружено {len(self.grid_store)} записей", toast_type="success")
+            except Exception as e:
+                if self.connection_lost():
+                    self.go_offline()
+                    return
+                self.conn.rollback()
+                messagebox.showerror("Ошибка", f"Ошибка загрузки данных:\n{e}")
+
+    def stream_grid(self, sql, params, expected):
+        # Большая таблица: строки приходят частями с отдельного соединения, первая страница видна сразу
+        table = self.current_table
+        query_key = (self.current_filter, self.sort_column, self.sort_reverse, self.as_of_date, self.include_archive)
+        stream = self.grid_stream = ReportStream(sql, params, expected, profile='grid', config=self.read_config())
+        self.grid_store = store = ColumnStore.empty(TABLES[table]['columns'], column_kinds(table))
+        self.grid_store_query = None
+        self.grid_rows.set_data(store, phase=f"tk_insert:{table}")
+
+        def poll():
+            # Загрузка заменена новой (другая таблица, фильтр, обновление) - эту больше не читаем
+            if stream is not self.grid_stream:
+                return
+            try:
+                while True:
+                    kind, payload = stream.chunks.get_nowait()
+                    if kind == 'rows':
+                        store.extend(payload)
+                        self.estimate_label_var.set(stream_progress(stream, len(store)))
+                    elif kind == 'error':
+                        self.grid_stream = None
+                        messagebox.showerror("Ошибка", f"Ошибка загрузки данных:\n{payload}")
+                        return
+                    else:
+                        self.grid_stream = None
+                        # Загружено все - фильтр и сортировка снова могут применяться локально
+                        self.grid_store_query = query_key
+                        self.estimate_label_var.set("")
+                        self.grid_rows.grow()
+                        self.show_toast(f"{TABLES[table]['name']}: загружено {len(store)} записей",
+                                        toast_type="success")
+                        return
+            except queue.Empty:
+                pass
+            self.grid_rows.grow()
+            self.root.after(50, poll)
 
-            cursor.execute(query, params if params else None)
-            rows = cursor.fetchall()
+        poll()
 
-            # Очистка таблицы
-            self.tree.delete(*self.tree.get_children())
-
-            # Добавление данных
-            for row in rows:
-                # Преобразование данных для отображения
-                display_row = []
-                for val in row:
-                    if val is None:
-                        display_row.append("")
-                    elif isinstance(val, bool):
-                        display_row.append("Да" if val else "Нет")
-                    elif isinstance(val, (date, datetime)):
-                        display_row.append(str(val))
-                    else:
-                        display_row.append(val)
-                self.tree.insert("", tk.END, values=display_row)
-            cursor.close()
-            table_name = TABLES[self.current_table]['name']
-            self.show_toast(f"{table_name}: загружено {len(rows)} записей", toast_type="success")
+    def load_snapshot_data(self):
+        # Загрузка таблицы из локального снимка теми же запросами, что и с сервера
+        try:
+            rows = self.snapshot_store.table_rows(self.current_table, self.current_filter, self.sort_column,
+                                                  self.sort_reverse, self.as_of_date)
         except Exception as e:
-            self.conn.rollback()
-            messagebox.showerror("Ошибка", f"Ошибка загрузки данных:\n{e}")
+            messagebox.showerror("Ошибка", f"Ошибка чтения снимка:\n{e}")
+            return
+        self.grid_store = ColumnStore.from_rows(TABLES[self.current_table]['columns'], rows)
+        self.grid_store_query = (self.current_filter, self.sort_column, self.sort_reverse, self.as_of_date,
+                                 self.include_archive)
+        self.grid_rows.set_data(self.grid_store, phase=f"tk_insert:{self.current_table}")
+        table_name = TABLES[self.current_table]['name']
+        self.show_toast(f"{table_name} (снимок): загружено {len(self.grid_store)} записей", toast_type="success")
+
+    def apply_view_locally(self):
+        # Применить текущие фильтр и сортировку к уже загруженной таблице без запроса к БД
+        # Возможно, только если загружена вся таблица и фильтр вычисляется так же, как на сервере
+        store = self.grid_store
+        if store is None or self.grid_store_query is None:
+            return False
+        loaded_filter, loaded_sort, _, loaded_as_of, loaded_archive = self.grid_store_query
+        if loaded_filter is not None or (self.sort_column is None and loaded_sort is not None):
+            return False
+        if loaded_as_of != self.as_of_date and self.current_table in queries.AS_OF_COLUMNS:
+            return False
+        if loaded_archive != self.include_archive and self.current_table in queries.ARCHIVE_SOURCES:
+            return False
+        columns = TABLES[self.current_table]['columns']
+        view = None
+        if self.sort_column:
+            # Текст сервер сортирует по правилам сортировки базы, которые в клиенте повторить точно нельзя,
+            # поэтому такая сортировка выполняется запросом; номера домов и квартир - в естественном порядке
+            natural = self.sort_column in queries.NATURAL_KEYS
+            if store.kinds[columns.index(self.sort_column)] == 'text' and not natural:
+                return False
+            key = natural_key if natural else None
+            view = store.sort_order(columns.index(self.sort_column), self.sort_reverse, key=key)
+        if self.current_filter:
+            field, operator, value = self.current_filter
+            view = store.filter_indices(columns.index(field), operator, value, view)
+            if view is None:
+                return False
+        self.grid_rows.set_data(store, view, phase=f"tk_insert:{self.current_table}")
+        shown = len(view) if view is not None else len(store)
+        self.show_toast(f"{TABLES[self.current_table]['name']}: показано {shown} записей", toast_type="success")
+        return True
+
+    def refresh_view(self):
+        # Обновить отображение после смены фильтра или сортировки
+        if not self.apply_view_locally():
+            self.load_data()
 
     def on_header_click(self, event):
         # Обработка клика по заголовку для быстрой сортировки
@@ -372,7 +1304,7 @@ class DatabaseApp:
                 direction = "убыв." if self.sort_reverse else "возр."
                 self.sort_label_var.set(f"Сортировка: {col_display} ({direction})")
 
-                self.load_data()
+                self.refresh_view()
 
     def search_records(self):
         # Поиск записей
@@ -396,7 +1328,89 @@ class DatabaseApp:
             self.current_filter = (field_name, 'LIKE', search_value)
             self.filter_label_var.set(f"Поиск: {field_display} содержит '{search_value}'")
 
+        self.refresh_view()
+
+    def global_search(self):
+        # Поиск по всей базе (search_index): результаты по группам, двойной щелчок открывает запись
+        text = self.global_search_entry.get()
+        request = queries.build_search_query(text, GLOBAL_SEARCH_LIMIT)
+        if request is None:
+            self.show_toast("Введите слова для поиска", toast_type="warning")
+            return
+        if self.snapshot_active or not self.conn:
+            self.show_toast("Поиск по всей базе доступен только при подключении к серверу", toast_type="warning")
+            return
+        try:
+            with STATS.phase("global_search"):
+                rows = self.run_read(*request, profile='lookup')
+        except Exception as e:
+            self.conn.rollback()
+            messagebox.showerror("Ошибка", f"Ошибка поиска:\n{e}")
+            return
+        if not rows:
+            self.show_toast(f"Ничего не найдено: {text}", toast_type="info")
+            return
+
+        win = tk.Toplevel(self.root)
+        win.title(f"Поиск: {text}")
+        win.geometry("700x450")
+        tree = ttk.Treeview(win, columns=('detail',), show='tree headings', selectmode='browse')
+        tree.heading('#0', text="Запись")
+        tree.heading('detail', text="Подробности")
+        tree.column('#0', width=300)
+        tree.column('detail', width=380)
+        vsb = ttk.Scrollbar(win, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=vsb.set)
+        vsb.pack(side=tk.RIGHT, fill=tk.Y)
+        tree.pack(fill=tk.BOTH, expand=True)
+
+        found = {}
+        for entity, entity_id, title, detail in rows:
+            found.setdefault(entity, []).append((entity_id, title, detail))
+        targets = {}
+        for entity, label in queries.SEARCH_ENTITIES:
+            items = found.get(entity)
+            if not items:
+                continue
+            more = "+" if len(items) >= GLOBAL_SEARCH_LIMIT else ""
+            group = tree.insert('', tk.END, text=f"{label} ({len(items)}{more})", open=True)
+            for entity_id, title, detail in items:
+                item = tree.insert(group, tk.END, text=title, values=(detail or "",))
+                targets[item] = (entity, entity_id, title)
+
+        def open_selected(event=None):
+            selected = tree.selection()
+            if selected and selected[0] in targets:
+                self.open_search_result(*targets[selected[0]])
+
+        tree.bind('<Double-1>', open_selected)
+        tree.bind('<Return>', open_selected)
+
+    def open_search_result(self, table, record_id, title):
+        # Открыть найденную запись: таблица с отбором по ключу, строка выделена
+        if not self.can_read():
+            return
+        self.setup_table_view(table)
+        # Срез на дату и просмотр с архивом сбрасываются: иначе они могут скрыть найденную запись
+        self.as_of_entry.delete(0, tk.END)
+        self.as_of_date = None
+        self.as_of_label_var.set("")
+        self.include_archive = False
+        self.include_archive_var.set(False)
+        self.current_filter = (TABLES[table]['pk'], '=', str(record_id))
+        self.filter_label_var.set(f"Найдено: {title}")
         self.load_data()
+        children = self.tree.get_children()
+        if not children and table in queries.ARCHIVE_SOURCES:
+            # Запись уже перенесена в архив выселенных: показывается вместе с архивом
+            self.include_archive = True
+            self.include_archive_var.set(True)
+            self.load_data()
+            children = self.tree.get_children()
+        if children:
+            self.tree.selection_set(children[0])
+            self.tree.focus(children[0])
+            self.tree.see(children[0])
 
     def apply_filter(self):
         # Применение фильтра
@@ -429,7 +1443,7 @@ class DatabaseApp:
         else:
             self.filter_label_var.set(f"Фильтр: {field_display} {operator_display} '{filter_value}'")
 
-        self.load_data()
+        self.refresh_view()
 
     def reset_filter(self):
         # Сброс фильтра
@@ -438,8 +1452,48 @@ class DatabaseApp:
         self.current_filter = None
         self.filter_label_var.set("")
         if self.current_table:
+            self.refresh_view()
+
+    def apply_as_of(self):
+        # Показать жильцов, проживавших на указанную дату (индекс по периоду проживания)
+        value = self.as_of_entry.get().strip()
+        if not value:
+            self.reset_as_of()
+            return
+        try:
+            self.as_of_date = date.fromisoformat(value)
+        except ValueError:
+            self.show_toast("Введите дату в формате ГГГГ-ММ-ДД", toast_type="warning")
+            return
+        self.as_of_label_var.set(f"Жильцы на {self.as_of_date}")
+        if self.current_table in queries.AS_OF_COLUMNS:
+            self.load_data()
+
+    def reset_as_of(self):
+        # Вернуться к текущему состоянию (все записи таблицы жильцов)
+        self.as_of_entry.delete(0, tk.END)
+        was_set = self.as_of_date is not None
+        self.as_of_date = None
+        self.as_of_label_var.set("")
+        if was_set and self.current_table in queries.AS_OF_COLUMNS:
+            self.load_data()
+
+    def toggle_archive(self):
+        # Показ жильцов вместе с архивом выселенных (только просмотр)
+        self.include_archive = self.include_archive_var.get()
+        if self.current_table in queries.ARCHIVE_SOURCES:
             self.load_data()
 
+    def read_only_view(self):
+        # Просмотр только на чтение: локальный снимок или таблица вместе с архивом
+        if self.snapshot_active:
+            self.show_toast("Режим снимка - только чтение", toast_type="warning")
+            return True
+        if self.include_archive and self.current_table in queries.ARCHIVE_SOURCES:
+            self.show_toast("Просмотр с архивом - только чтение", toast_type="warning")
+            return True
+        return False
+
     def apply_sort(self):
         # Применение сортировки
         if not self.current_table:
@@ -458,7 +1512,7 @@ class DatabaseApp:
         direction = "убыв." if self.sort_reverse else "возр."
         self.sort_label_var.set(f"Сортировка: {col_display} ({direction})")
 
-        self.load_data()
+        self.refresh_view()
 
     def reset_sort(self):
         # Сброс сортировки
@@ -466,7 +1520,7 @@ class DatabaseApp:
         self.sort_reverse = False
         self.sort_label_var.set("")
         if self.current_table:
-            self.load_data()
+            self.refresh_view()
 
     def add_record(self):
         # Добавление новой записи
@@ -474,6 +1528,9 @@ class DatabaseApp:
             self.show_toast("Сначала выберите таблицу", toast_type="warning")
             return
 
+        if self.snapshot_active and self.read_only_view():
+            return
+
         self.open_edit_dialog(None)
 
     def edit_record(self):
@@ -487,6 +1544,9 @@ class DatabaseApp:
             self.show_toast("Выберите запись для редактирования", toast_type="warning")
             return
 
+        if self.read_only_view():
+            return
+
         values = self.tree.item(selected[0])['values']
         self.open_edit_dialog(values)
 
@@ -503,6 +1563,36 @@ class DatabaseApp:
 
         table_info = TABLES[self.current_table]
         is_new = values is None
+        version = None
+        original = None
+
+        if not is_new:
+            # Свежая строка и ее версия: сохранение пройдет, только если строку никто не изменил
+            pk_index = table_info['columns'].index(table_info['pk'])
+            fresh = None
+            if self.conn is not None:
+                try:
+                    cursor = self.conn.cursor()
+                    fresh = self.fetch_row_version(cursor, self.current_table, values[pk_index])
+                    cursor.close()
+                    # Версия читается с основного сервера; транзакция не остается открытой, пока открыт диалог
+                    self.finish_read(self.conn)
+                    if fresh is None:
+                        self.show_toast("Запись уже удалена другим пользователем", toast_type="warning")
+                        self.load_data()
+                        return
+                except Exception as e:
+                    if not self.connection_lost():
+                        self.conn.rollback()
+                        messagebox.showerror("Ошибка", f"Ошибка загрузки записи:\n{e}")
+                        return
+                    self.go_offline()
+            if fresh is not None:
+                version, values = fresh
+            else:
+                # Без связи исходные значения берутся из таблицы, конфликты проверяются при отправке
+                values = tuple("" if v is None else str(v) for v in values)
+            original = {col: edit_value(col, values[i], self.current_table) for i, col in enumerate(table_info['columns'])}
 
         dialog = tk.Toplevel(self.root)
         dialog.title("Добавить запись" if is_new else "Редактировать запись")
@@ -522,6 +1612,7 @@ class DatabaseApp:
         canvas.configure(yscrollcommand=scrollbar.set)
 
         entries = {}
+        pickers = {}
 
         for i, col in enumerate(table_info['columns']):
             if col == table_info['pk'] and is_new:
@@ -536,15 +1627,18 @@ class DatabaseApp:
             label.pack(side=tk.LEFT)
 
             # Определяем тип виджета
-            col_lower = col.lower()
-            if 'privatized' in col_lower or 'water' in col_lower or 'elevator' in col_lower or \
-                    'garbage' in col_lower or 'responsible' in col_lower or 'has_service' in col_lower:
+            if is_flag_column(col, self.current_table):
                 var = tk.BooleanVar()
                 entry = ttk.Checkbutton(frame, variable=var)
                 entry.var = var
                 if values and i < len(values):
                     val = values[i]
                     var.set(val == "Да" or val is True or val == "true")
+            elif is_reference_column(self.current_table, col):
+                entry = ForeignKeyPicker(frame, self, col, width=28)
+                if values and i < len(values) and values[i] not in [None, ""]:
+                    entry.set_id(values[i])
+                    pickers[col] = values[i]
             else:
                 entry = ttk.Entry(frame, width=30)
                 if values and i < len(values):
@@ -560,11 +1654,22 @@ class DatabaseApp:
                     except:
                         pass
 
+        def show_labels():
+            # Подписи ссылок подставляются, если поле еще не меняли
+            for col, value in pickers.items():
+                if entries[col].text() == str(value):
+                    entries[col].set_id(value)
+
+        if pickers:
+            self.resolve_fk_labels(pickers, show_labels)
+
         btn_frame = ttk.Frame(dialog)
         btn_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=10)
 
         def save():
-            self.save_record(entries, values, is_new)
+            # Строки с нарушением ограничений не отправляются, диалог остается открытым для исправления
+            if self.save_record(entries, values, is_new, version, original) is False:
+                return
             dialog.destroy()
 
         ttk.Button(btn_frame, text="Сохранить", command=save).pack(side=tk.LEFT, padx=10)
@@ -572,67 +1677,227 @@ class DatabaseApp:
         canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
-    def save_record(self, entries, old_values, is_new):
-        # Сохранение записи в БД
-        if not self.conn or not self.current_table:
+    def save_record(self, entries, old_values, is_new, version=None, original=None):
+        # Сохранение записи в БД; False - запись не прошла проверку ограничений и не отправлялась
+        if not self.current_table or not (self.conn or self.offline):
             return
         table_info = TABLES[self.current_table]
+
+        if not is_new:
+            # UPDATE только измененных полей с проверкой версии строки
+            pk_index = table_info['columns'].index(table_info['pk'])
+            changes = {}
+            for col in table_info['editable']:
+                if col in entries:
+                    val = entry_value(entries[col])
+                    if val != original.get(col):
+                        changes[col] = val
+            if not changes:
+                self.show_toast("Изменений нет", toast_type="info")
+                return
+            row = {col: original.get(col) for col in table_info['editable']}
+            row.update(changes)
+            if not self.validate_rows([(self.current_table, [row], [old_values[pk_index]], None)]):
+                return False
+            self.update_with_version(self.current_table, old_values[pk_index], version, changes, original)
+            return
+
+        # INSERT
+        columns = []
+        values = []
+        placeholders = []
+
+        for col in table_info['editable']:
+            if col in entries:
+                columns.append(col)
+                values.append(entry_value(entries[col]))
+                placeholders.append("%s")
+
+        if not self.validate_rows([(self.current_table, [dict(zip(columns, values))], None, None)]):
+            return False
+
+        payload = {'table': self.current_table, 'values': dict(zip(columns, values))}
+        if self.conn is None:
+            self.queue_write('insert', payload)
+            return
+
         try:
             cursor = self.conn.cursor()
-            if is_new:
-                # INSERT
-                columns = []
-                values = []
-                placeholders = []
-
-                for col in table_info['editable']:
-                    if col in entries:
-                        entry = entries[col]
-                        if hasattr(entry, 'var'):
-                            val = entry.var.get()
-                        else:
-                            val = entry.get().strip()
-                            if val == "":
-                                val = None
-                        columns.append(col)
-                        values.append(val)
-                        placeholders.append("%s")
-
-                query = f"INSERT INTO {self.current_table} ({', '.join(columns)}) VALUES ({', '.join(placeholders)})"
-                cursor.execute(query, values)
-            else:
-                # UPDATE
-                pk_col = table_info['pk']
-                pk_index = table_info['columns'].index(pk_col)
-                pk_value = old_values[pk_index]
-
-                set_parts = []
-                values = []
-
-                for col in table_info['editable']:
-                    if col in entries:
-                        entry = entries[col]
-                        if hasattr(entry, 'var'):
-                            val = entry.var.get()
-                        else:
-                            val = entry.get().strip()
-                            if val == "":
-                                val = None
-                        set_parts.append(f"{col} = %s")
-                        values.append(val)
-
-                values.append(pk_value)
-                query = f"UPDATE {self.current_table} SET {', '.join(set_parts)} WHERE {pk_col} = %s"
-                cursor.execute(query, values)
-
-            self.conn.commit()
+            query = f"INSERT INTO {self.current_table} ({', '.join(columns)}) VALUES ({', '.join(placeholders)})"
+            cursor.execute(query, values)
+
+            self.commit_write()
             cursor.close()
             self.load_data()
             messagebox.showinfo("Успех", "Запись сохранена")
 
         except Exception as e:
+            if self.connection_lost():
+                self.go_offline()
+                self.queue_write('insert', payload)
+                return
+            self.conn.rollback()
+            messagebox.showerror("Ошибка", f"Ошибка сохранения:\n{e}")
+
+    def validate_rows(self, batches):
+        # Проверка строк по ограничениям схемы до отправки: batches - [(таблица, строки, ключи строк, подписи строк)]
+        # Без связи проверяются только типы, обязательность и CHECK (если ограничения уже прочитаны)
+        # True - можно отправлять; иначе показывается список нарушений
+        cursor = None
+        messages = []
+        try:
+            if self.conn is not None:
+                cursor = self.conn.cursor()
+                if not self.validator.loaded():
+                    self.validator.load(cursor)
+            if not self.validator.loaded():
+                return True
+            for table, rows, pks, names in batches:
+                violations = self.validator.check(table, rows, cursor, pks)
+                if violations:
+                    messages.append(format_violations(violations, names))
+        except Exception:
+            # Проверка вспомогательная: если прочитать каталог не удалось, ограничения проверит сервер
+            messages = []
+        finally:
+            if cursor is not None and not self.connection_lost():
+                cursor.close()
+                self.conn.rollback()
+        if not messages:
+            return True
+        messagebox.showwarning("Проверка данных", "Данные не сохранены:\n\n" + "\n\n".join(messages))
+        return False
+
+    def fetch_row_version(self, cursor, table, pk_value):
+        # Текущая строка и ее версия (xmin): (версия, значения в виде строк таблицы) или None, если строки нет
+        table_info = TABLES[table]
+        cursor.execute(f"SELECT xmin::text, {', '.join(table_info['columns'])} FROM {table} "
+                       f"WHERE {table_info['pk']} = %s", (pk_value,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return row[0], ColumnStore.from_rows(table_info['columns'], [row[1:]]).format_rows(0, 1)[0]
+
+    def execute_versioned_update(self, cursor, table, pk_value, version, changes):
+        # UPDATE только переданных колонок, если версия строки (xmin) не изменилась; True - строка обновлена
+        pk_col = TABLES[table]['pk']
+        set_parts = [f"{col} = %s" for col in changes]
+        query = f"UPDATE {table} SET {', '.join(set_parts)} WHERE {pk_col} = %s AND xmin = %s::xid"
+        cursor.execute(query, list(changes.values()) + [pk_value, version])
+        return cursor.rowcount == 1
+
+    def merge_changes(self, table, texts, changes, original):
+        # Сравнение с текущей строкой: (значения в БД, конфликтующие поля, изменения для наложения на версию в БД)
+        theirs = {col: edit_value(col, texts[i], table) for i, col in enumerate(TABLES[table]['columns'])}
+        # Конфликт - поле изменено и нами, и другим пользователем, причем по-разному
+        conflicts = [col for col in changes if theirs[col] != original.get(col) and theirs[col] != changes[col]]
+        merged = {col: val for col, val in changes.items() if col not in conflicts and theirs[col] != val}
+        return theirs, conflicts, merged
+
+    def update_with_version(self, table, pk_value, version, changes, original):
+        # UPDATE ... WHERE pk AND xmin: без блокировок на время диалога; если строку успели изменить - объединение
+        payload = {'table': table, 'pk': pk_value, 'version': version, 'changes': changes, 'original': original}
+        if self.conn is None:
+            self.queue_write('update', payload)
+            return
+        try:
+            cursor = self.conn.cursor()
+            if self.execute_versioned_update(cursor, table, pk_value, version, changes):
+                self.commit_write()
+                cursor.close()
+                if self.current_table == table:
+                    self.load_data()
+                messagebox.showinfo("Успех", "Запись сохранена")
+                return
+
+            current = self.fetch_row_version(cursor, table, pk_value)
+            self.conn.rollback()
+            cursor.close()
+        except Exception as e:
+            if self.connection_lost():
+                self.go_offline()
+                self.queue_write('update', payload)
+                return
             self.conn.rollback()
             messagebox.showerror("Ошибка", f"Ошибка сохранения:\n{e}")
+            return
+
+        if current is None:
+            messagebox.showerror("Конфликт", "Запись удалена другим пользователем")
+            self.load_data()
+            return
+
+        new_version, texts = current
+        theirs, conflicts, merged = self.merge_changes(table, texts, changes, original)
+        if conflicts:
+            self.open_conflict_dialog(table, pk_value, new_version, changes, original, theirs, conflicts)
+            return
+
+        # Другой пользователь менял другие поля - наши изменения накладываются на его версию
+        if not merged:
+            self.show_toast("Такие же изменения уже сохранены другим пользователем", toast_type="info")
+            self.load_data()
+            return
+        self.show_toast("Запись изменена другим пользователем, изменения объединены", toast_type="info")
+        self.update_with_version(table, pk_value, new_version, merged, theirs)
+
+    def open_conflict_dialog(self, table, pk_value, version, changes, original, theirs, conflicts):
+        # Диалог конфликта: для полей, измененных обоими, выбирается значение; остальное объединяется
+        table_info = TABLES[table]
+        names = dict(zip(table_info['columns'], table_info['column_names']))
+
+        def shown(value):
+            return BOOL_LABELS[value] if value is None or isinstance(value, bool) else value
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Конфликт изменений")
+        dialog.geometry("700x350")
+        dialog.transient(self.root)
+        dialog.grab_set()
+
+        ttk.Label(dialog, text="Запись изменена другим пользователем после открытия диалога.\n"
+                               "Выберите значения полей, измененных обоими:").pack(padx=10, pady=10, anchor=tk.W)
+
+        grid = ttk.Frame(dialog)
+        grid.pack(fill=tk.X, padx=10)
+        for column, text in enumerate(['Поле', 'Было', 'Сейчас в БД', 'Ваше значение', 'Сохранить']):
+            ttk.Label(grid, text=text, font=('Segoe UI', 9, 'bold')).grid(row=0, column=column, sticky=tk.W, padx=5)
+
+        choices = {}
+        for row, col in enumerate(conflicts, start=1):
+            ttk.Label(grid, text=names[col]).grid(row=row, column=0, sticky=tk.W, padx=5)
+            ttk.Label(grid, text=shown(original.get(col))).grid(row=row, column=1, sticky=tk.W, padx=5)
+            ttk.Label(grid, text=shown(theirs[col])).grid(row=row, column=2, sticky=tk.W, padx=5)
+            ttk.Label(grid, text=shown(changes[col])).grid(row=row, column=3, sticky=tk.W, padx=5)
+            choice = tk.StringVar(value='mine')
+            choice_frame = ttk.Frame(grid)
+            choice_frame.grid(row=row, column=4, sticky=tk.W, padx=5)
+            ttk.Radiobutton(choice_frame, text="Ваше", variable=choice, value='mine').pack(side=tk.LEFT)
+            ttk.Radiobutton(choice_frame, text="Из БД", variable=choice, value='theirs').pack(side=tk.LEFT)
+            choices[col] = choice
+
+        merged_cols = [names[col] for col in changes if col not in conflicts]
+        if merged_cols:
+            ttk.Label(dialog, text="Ваши изменения без конфликта: " + ", ".join(merged_cols),
+                      foreground='green').pack(padx=10, pady=(10, 0), anchor=tk.W)
+
+        def apply():
+            merged = {col: val for col, val in changes.items()
+                      if (col not in choices or choices[col].get() == 'mine') and theirs[col] != val}
+            dialog.destroy()
+            if not merged:
+                self.load_data()
+                return
+            self.update_with_version(table, pk_value, version, merged, theirs)
+
+        def cancel():
+            dialog.destroy()
+            self.load_data()
+
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=10)
+        ttk.Button(btn_frame, text="Сохранить", command=apply).pack(side=tk.LEFT, padx=10)
+        ttk.Button(btn_frame, text="Отмена", command=cancel).pack(side=tk.LEFT)
 
     def delete_record(self):
         # Удаление выбранной записи
@@ -645,6 +1910,9 @@ class DatabaseApp:
             self.show_toast("Выберите запись для удаления", toast_type="warning")
             return
 
+        if self.read_only_view():
+            return
+
         if not messagebox.askyesno("Подтверждение", "Удалить выбранную запись?"):
             return
 
@@ -659,7 +1927,7 @@ class DatabaseApp:
             cursor = self.conn.cursor()
             query = f"DELETE FROM {self.current_table} WHERE {pk_col} = %s"
             cursor.execute(query, (pk_value,))
-            self.conn.commit()
+            self.commit_write()
             cursor.close()
 
             self.load_data()
@@ -670,8 +1938,8 @@ class DatabaseApp:
             messagebox.showerror("Ошибка", f"Ошибка удаления:\n{e}")
 
     def open_apartment_tenants_form(self):
-        # Открытие формы для добавления квартиры с жильцами
-        if not self.conn:
+        # Открытие формы для добавления квартиры с жильцами (без связи - с сохранением в очередь)
+        if not self.conn and not self.offline:
             self.show_toast("Нет подключения к БД", toast_type="warning")
             return
 
@@ -695,12 +1963,10 @@ class DatabaseApp:
         row = ttk.Frame(apt_frame)
         row.pack(fill=tk.X, pady=2)
         ttk.Label(row, text="Дом:", width=15).pack(side=tk.LEFT)
-        houses = self.get_houses_list()
-        house_combo = ttk.Combobox(row, state="readonly", width=50)
-        house_combo['values'] = [f"{h[0]}: {h[1]} {h[2]}{' корп.' + h[3] if h[3] else ''}" for h in houses]
-        house_combo.pack(side=tk.LEFT, fill=tk.X, expand=True)
-        apt_entries['house_combo'] = house_combo
-        apt_entries['houses_data'] = houses
+        # Дом ищется по адресу по мере ввода, весь список домов не загружается
+        house_picker = ForeignKeyPicker(row, self, 'house_id', width=50)
+        house_picker.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        apt_entries['house'] = house_picker
 
         row = ttk.Frame(apt_frame)
         row.pack(fill=tk.X, pady=2)
@@ -888,12 +2154,12 @@ class DatabaseApp:
         def save_apartment_with_tenants():
             # Сохранить квартиру и всех жильцов
             # Проверка данных квартиры
-            house_idx = apt_entries['house_combo'].current()
-            if house_idx < 0:
+            house_id = apt_entries['house'].get()
+            if not house_id.isdigit():
                 self.show_toast("Выберите дом", toast_type="warning")
                 return
 
-            house_id = apt_entries['houses_data'][house_idx][0]
+            house_id = int(house_id)
             apt_number = apt_entries['apt_number'].get().strip()
 
             if not apt_number:
@@ -907,45 +2173,36 @@ class DatabaseApp:
                 self.show_toast("Введите площадь квартиры", toast_type="warning")
                 return
 
+            apartment = {
+                'house_id': house_id,
+                'apt_number': apt_number,
+                'floor': apt_entries['floor'].get().strip() or None,
+                'living_area': living_area,
+                'total_area': total_area,
+                'privatized': apt_entries['privatized'].get(),
+                'cold_water': apt_entries['cold_water'].get(),
+                'hot_water': apt_entries['hot_water'].get(),
+                'garbage_chute': apt_entries['garbage_chute'].get(),
+                'elevator': apt_entries['elevator'].get()
+            }
+            tenant_rows = [dict(tenant, apartment_id=Pending('apartment')) for tenant in tenants_list]
+            if not self.validate_rows([('apartments', [apartment], None, None),
+                                       ('tenants', tenant_rows, None,
+                                        [f"Жилец {tenant['full_name']}" for tenant in tenants_list])]):
+                return
+
+            payload = {'apartment': apartment, 'tenants': tenants_list}
+            if self.conn is None:
+                self.queue_write('apartment_tenants', payload)
+                dialog.destroy()
+                return
+
             try:
                 cursor = self.conn.cursor()
 
-                # Вставляем квартиру
-                cursor.execute("""
-                    INSERT INTO apartments (house_id, apt_number, floor, living_area, total_area, 
-                                          privatized, cold_water, hot_water, garbage_chute, elevator)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING apartment_id
-                """, (
-                    house_id,
-                    apt_number,
-                    apt_entries['floor'].get().strip() or None,
-                    living_area,
-                    total_area,
-                    apt_entries['privatized'].get(),
-                    apt_entries['cold_water'].get(),
-                    apt_entries['hot_water'].get(),
-                    apt_entries['garbage_chute'].get(),
-                    apt_entries['elevator'].get()
-                ))
-
-                apartment_id = cursor.fetchone()[0]
-
-                # Вставляем жильцов
-                for tenant in tenants_list:
-                    cursor.execute("""
-                        INSERT INTO tenants (apartment_id, full_name, passport, birth_date, is_responsible, moved_in)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    """, (
-                        apartment_id,
-                        tenant['full_name'],
-                        tenant['passport'],
-                        tenant['birth_date'],
-                        tenant['is_responsible'],
-                        tenant['moved_in']
-                    ))
-
-                self.conn.commit()
+                apartment_id = self.insert_apartment_with_tenants(cursor, apartment, tenants_list)
+
+                self.commit_write()
                 cursor.close()
 
                 messagebox.showinfo("Успех",
@@ -959,6 +2216,11 @@ class DatabaseApp:
                     self.load_data()
 
             except Exception as e:
+                if self.connection_lost():
+                    self.go_offline()
+                    self.queue_write('apartment_tenants', payload)
+                    dialog.destroy()
+                    return
                 self.conn.rollback()
                 messagebox.showerror("Ошибка", f"Ошибка сохранения:\n{e}")
 
@@ -966,29 +2228,349 @@ class DatabaseApp:
                    command=save_apartment_with_tenants).pack(side=tk.LEFT, padx=20)
         ttk.Button(buttons_frame, text="Отмена", command=dialog.destroy).pack(side=tk.LEFT)
 
-    def get_houses_list(self):
-        # Получить список домов для выбора
+    def get_sections_list(self):
+        # Получить список участков с отделом и службой для выбора
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT house_id, street, house_number, building FROM houses ORDER BY street, house_number")
-            houses = cursor.fetchall()
-            cursor.close()
-            return houses
+            with self.reading() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT s.section_id, s.name, d.department_id, d.name, d.service_id
+                    FROM sections s
+                    JOIN departments d ON s.department_id = d.department_id
+                    ORDER BY d.name, s.name
+                """)
+                sections = cursor.fetchall()
+                cursor.close()
+            return sections
         except:
             return []
 
-    def report_rent(self):
-        # Отчет: Квартплата по домам
+    def insert_apartment_with_tenants(self, cursor, apartment, tenants):
+        # Вставка квартиры и ее жильцов (форма "Квартира + Жильцы" и отправка очереди), возвращает apartment_id
+        cursor.execute("""
+            INSERT INTO apartments (house_id, apt_number, floor, living_area, total_area,
+                                    privatized, cold_water, hot_water, garbage_chute, elevator)
+            VALUES (%(house_id)s, %(apt_number)s, %(floor)s, %(living_area)s, %(total_area)s,
+                    %(privatized)s, %(cold_water)s, %(hot_water)s, %(garbage_chute)s, %(elevator)s)
+            RETURNING apartment_id
+        """, apartment)
+        apartment_id = cursor.fetchone()[0]
+
+        # Вставляем всех жильцов одним многострочным INSERT
+        self.insert_tenants_batch(cursor, [
+            (apartment_id, tenant['full_name'], tenant['passport'], tenant['birth_date'],
+             tenant['is_responsible'], tenant['moved_in'])
+            for tenant in tenants
+        ])
+        return apartment_id
+
+    def insert_tenants_batch(self, cursor, tenant_rows):
+        # Вставка жильцов одним многострочным INSERT
+        # tenant_rows: (apartment_id, full_name, passport, birth_date, is_responsible, moved_in)
+        if not tenant_rows:
+            return
+        from psycopg2.extras import execute_values
+        execute_values(cursor, queries.INSERT_TENANTS_SQL, tenant_rows,
+                       template=queries.INSERT_TENANTS_TEMPLATE, page_size=len(tenant_rows))
+
+    def insert_apartments_batch(self, cursor, house_id, apartments, flags):
+        # Вставка квартир дома одним INSERT ... SELECT FROM unnest, возвращает {номер квартиры: apartment_id}
+        # apartments: список (apt_number, floor, living_area, total_area)
+        if not apartments:
+            return {}
+        numbers, floors, living, total = (list(col) for col in zip(*apartments))
+        cursor.execute("""
+            INSERT INTO apartments (house_id, apt_number, floor, living_area, total_area,
+                                    privatized, cold_water, hot_water, garbage_chute, elevator)
+            SELECT %s, u.apt_number, u.floor, u.living_area, u.total_area, %s, %s, %s, %s, %s
+            FROM unnest(%s::text[], %s::int[], %s::numeric[], %s::numeric[])
+                 AS u(apt_number, floor, living_area, total_area)
+            RETURNING apartment_id, apt_number
+        """, (house_id, flags['privatized'], flags['cold_water'], flags['hot_water'],
+              flags['garbage_chute'], flags['elevator'], numbers, floors, living, total))
+        return {apt_number: apartment_id for apartment_id, apt_number in cursor.fetchall()}
+
+    def open_house_bulk_form(self):
+        # Форма регистрации нового дома со всеми квартирами и жильцами за одну транзакцию
         if not self.conn:
             self.show_toast("Нет подключения к БД", toast_type="warning")
             return
 
         dialog = tk.Toplevel(self.root)
-        dialog.title("Отчет: Квартплата")
-        dialog.geometry("650x400")
+        dialog.title("Добавить дом с квартирами и жильцами")
+        dialog.geometry("1100x700")
         dialog.transient(self.root)
         dialog.grab_set()
 
+        # Данные дома
+        house_frame = ttk.LabelFrame(dialog, text="Данные дома", padding=10)
+        house_frame.pack(fill=tk.X, padx=10, pady=5)
+
+        row = ttk.Frame(house_frame)
+        row.pack(fill=tk.X, pady=2)
+        ttk.Label(row, text="Участок:", width=15).pack(side=tk.LEFT)
+        sections = self.get_sections_list()
+        section_combo = ttk.Combobox(row, state="readonly", width=50)
+        section_combo['values'] = [f"{s[0]}: {s[1]} ({s[3]})" for s in sections]
+        section_combo.pack(side=tk.LEFT)
+
+        row = ttk.Frame(house_frame)
+        row.pack(fill=tk.X, pady=2)
+        ttk.Label(row, text="Улица:", width=15).pack(side=tk.LEFT)
+        street_entry = ttk.Entry(row, width=30)
+        street_entry.pack(side=tk.LEFT)
+        ttk.Label(row, text="Дом:").pack(side=tk.LEFT, padx=5)
+        number_entry = ttk.Entry(row, width=8)
+        number_entry.pack(side=tk.LEFT)
+        ttk.Label(row, text="Корпус:").pack(side=tk.LEFT, padx=5)
+        building_entry = ttk.Entry(row, width=8)
+        building_entry.pack(side=tk.LEFT)
+        ttk.Label(row, text="Год постройки:").pack(side=tk.LEFT, padx=5)
+        year_entry = ttk.Entry(row, width=8)
+        year_entry.pack(side=tk.LEFT)
+
+        # Генерация квартир
+        apts_frame = ttk.LabelFrame(dialog, text="Квартиры", padding=10)
+        apts_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+
+        row = ttk.Frame(apts_frame)
+        row.pack(fill=tk.X, pady=2)
+        ttk.Label(row, text="Номера с:").pack(side=tk.LEFT)
+        num_from_entry = ttk.Entry(row, width=6)
+        num_from_entry.insert(0, "1")
+        num_from_entry.pack(side=tk.LEFT, padx=2)
+        ttk.Label(row, text="по:").pack(side=tk.LEFT)
+        num_to_entry = ttk.Entry(row, width=6)
+        num_to_entry.pack(side=tk.LEFT, padx=2)
+        ttk.Label(row, text="Этажей:").pack(side=tk.LEFT, padx=5)
+        floors_entry = ttk.Entry(row, width=6)
+        floors_entry.insert(0, "1")
+        floors_entry.pack(side=tk.LEFT)
+        ttk.Label(row, text="Жилая пл.:").pack(side=tk.LEFT, padx=5)
+        living_entry = ttk.Entry(row, width=8)
+        living_entry.pack(side=tk.LEFT)
+        ttk.Label(row, text="Общая пл.:").pack(side=tk.LEFT, padx=5)
+        total_entry = ttk.Entry(row, width=8)
+        total_entry.pack(side=tk.LEFT)
+
+        checkboxes_frame = ttk.Frame(apts_frame)
+        checkboxes_frame.pack(fill=tk.X, pady=5)
+        flags = {
+            'privatized': tk.BooleanVar(),
+            'cold_water': tk.BooleanVar(value=True),
+            'hot_water': tk.BooleanVar(value=True),
+            'garbage_chute': tk.BooleanVar(),
+            'elevator': tk.BooleanVar()
+        }
+        for key, text in [('privatized', "Приватизированы"), ('cold_water', "Хол. вода"),
+                          ('hot_water', "Гор. вода"), ('garbage_chute', "Мусоропровод"), ('elevator', "Лифт")]:
+            ttk.Checkbutton(checkboxes_frame, text=text, variable=flags[key]).pack(side=tk.LEFT, padx=5)
+
+        apartments_list = []
+        apts_tree = ttk.Treeview(apts_frame, columns=('apt_number', 'floor', 'living_area', 'total_area'),
+                                 show='headings', height=6)
+        for col, text in [('apt_number', 'Номер кв.'), ('floor', 'Этаж'),
+                          ('living_area', 'Жилая пл.'), ('total_area', 'Общая пл.')]:
+            apts_tree.heading(col, text=text)
+            apts_tree.column(col, width=120)
+
+        def generate_apartments():
+            # Сформировать список квартир по диапазону номеров
+            try:
+                num_from = int(num_from_entry.get().strip())
+                num_to = int(num_to_entry.get().strip())
+                floors = max(int(floors_entry.get().strip() or 1), 1)
+            except ValueError:
+                self.show_toast("Номера квартир и этажность должны быть числами", toast_type="warning")
+                return
+            living_area = living_entry.get().strip()
+            total_area = total_entry.get().strip()
+            if num_to < num_from or not living_area or not total_area:
+                self.show_toast("Укажите диапазон номеров и площадь квартир", toast_type="warning")
+                return
+            count = num_to - num_from + 1
+            per_floor = -(-count // floors)
+            apartments_list.clear()
+            apts_tree.delete(*apts_tree.get_children())
+            for i in range(count):
+                apt = (str(num_from + i), i // per_floor + 1, living_area, total_area)
+                apartments_list.append(apt)
+                apts_tree.insert('', tk.END, values=apt)
+
+        def remove_selected_apartment():
+            # Удалить выбранную квартиру из списка
+            selected = apts_tree.selection()
+            if selected:
+                idx = apts_tree.index(selected[0])
+                apts_tree.delete(selected[0])
+                if idx < len(apartments_list):
+                    apartments_list.pop(idx)
+
+        btn_row = ttk.Frame(apts_frame)
+        btn_row.pack(fill=tk.X, pady=2)
+        ttk.Button(btn_row, text="Сформировать список", command=generate_apartments).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_row, text="Удалить выбранную", command=remove_selected_apartment).pack(side=tk.LEFT, padx=5)
+        apts_tree.pack(fill=tk.BOTH, expand=True, pady=5)
+
+        # Жильцы
+        tenants_frame = ttk.LabelFrame(dialog, text="Жильцы (по номеру квартиры)", padding=10)
+        tenants_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+
+        tenants_list = []
+        tenants_tree = ttk.Treeview(tenants_frame,
+                                    columns=('apt_number', 'name', 'passport', 'birth_date', 'responsible', 'moved_in'),
+                                    show='headings', height=5)
+        for col, text, width in [('apt_number', 'Кв.', 60), ('name', 'ФИО', 200), ('passport', 'Паспорт', 120),
+                                 ('birth_date', 'Дата рожд.', 100), ('responsible', 'Ответственный', 100),
+                                 ('moved_in', 'Дата вселения', 100)]:
+            tenants_tree.heading(col, text=text)
+            tenants_tree.column(col, width=width)
+
+        row = ttk.Frame(tenants_frame)
+        row.pack(fill=tk.X, pady=2)
+        ttk.Label(row, text="Кв.:").pack(side=tk.LEFT)
+        tenant_apt = ttk.Entry(row, width=6)
+        tenant_apt.pack(side=tk.LEFT, padx=2)
+        ttk.Label(row, text="ФИО:").pack(side=tk.LEFT, padx=2)
+        tenant_name = ttk.Entry(row, width=30)
+        tenant_name.pack(side=tk.LEFT, padx=2)
+        ttk.Label(row, text="Паспорт:").pack(side=tk.LEFT, padx=2)
+        tenant_passport = ttk.Entry(row, width=12)
+        tenant_passport.pack(side=tk.LEFT, padx=2)
+        ttk.Label(row, text="Дата рожд.:").pack(side=tk.LEFT, padx=2)
+        tenant_birth = ttk.Entry(row, width=11)
+        tenant_birth.pack(side=tk.LEFT, padx=2)
+        ttk.Label(row, text="Вселение:").pack(side=tk.LEFT, padx=2)
+        tenant_moved = ttk.Entry(row, width=11)
+        tenant_moved.insert(0, str(date.today()))
+        tenant_moved.pack(side=tk.LEFT, padx=2)
+        tenant_responsible_var = tk.BooleanVar()
+        ttk.Checkbutton(row, text="Ответственный", variable=tenant_responsible_var).pack(side=tk.LEFT, padx=5)
+
+        def add_tenant_to_list():
+            # Добавить жильца в список
+            apt_number = tenant_apt.get().strip()
+            name = tenant_name.get().strip()
+            if not apt_number or not name:
+                self.show_toast("Введите номер квартиры и ФИО жильца", toast_type="warning")
+                return
+            tenant_data = (apt_number, name, tenant_passport.get().strip() or None,
+                           tenant_birth.get().strip() or None, tenant_responsible_var.get(),
+                           tenant_moved.get().strip() or str(date.today()))
+            tenants_list.append(tenant_data)
+            tenants_tree.insert('', tk.END, values=(
+                apt_number, name, tenant_data[2] or '', tenant_data[3] or '',
+                'Да' if tenant_data[4] else 'Нет', tenant_data[5]
+            ))
+            tenant_name.delete(0, tk.END)
+            tenant_passport.delete(0, tk.END)
+            tenant_birth.delete(0, tk.END)
+            tenant_responsible_var.set(False)
+
+        def remove_selected_tenant():
+            # Удалить выбранного жильца из списка
+            selected = tenants_tree.selection()
+            if selected:
+                idx = tenants_tree.index(selected[0])
+                tenants_tree.delete(selected[0])
+                if idx < len(tenants_list):
+                    tenants_list.pop(idx)
+
+        btn_row = ttk.Frame(tenants_frame)
+        btn_row.pack(fill=tk.X, pady=2)
+        ttk.Button(btn_row, text="Добавить жильца в список", command=add_tenant_to_list).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_row, text="Удалить выбранного", command=remove_selected_tenant).pack(side=tk.LEFT, padx=5)
+        tenants_tree.pack(fill=tk.BOTH, expand=True, pady=5)
+
+        buttons_frame = ttk.Frame(dialog)
+        buttons_frame.pack(fill=tk.X, pady=10)
+
+        def save_house_bulk():
+            # Сохранить дом, квартиры и жильцов одной транзакцией
+            section_idx = section_combo.current()
+            if section_idx < 0:
+                self.show_toast("Выберите участок", toast_type="warning")
+                return
+            street = street_entry.get().strip()
+            house_number = number_entry.get().strip()
+            if not street or not house_number:
+                self.show_toast("Введите улицу и номер дома", toast_type="warning")
+                return
+            if not apartments_list:
+                self.show_toast("Сформируйте список квартир", toast_type="warning")
+                return
+            apt_numbers = {apt[0] for apt in apartments_list}
+            unknown = sorted({t[0] for t in tenants_list if t[0] not in apt_numbers})
+            if unknown:
+                self.show_toast(f"Нет квартир с номерами: {', '.join(unknown)}", toast_type="warning")
+                return
+
+            section_id, _, department_id, _, service_id = sections[section_idx]
+
+            # Все строки проверяются до начала транзакции: одна ошибочная строка не откатывает весь дом
+            flag_values = {key: var.get() for key, var in flags.items()}
+            house = {'service_id': service_id, 'department_id': department_id, 'section_id': section_id,
+                     'street': street, 'house_number': house_number,
+                     'building': building_entry.get().strip() or None, 'year_built': year_entry.get().strip() or None}
+            apartment_rows = [dict(flag_values, house_id=Pending('house'), apt_number=apt[0], floor=apt[1],
+                                   living_area=apt[2], total_area=apt[3]) for apt in apartments_list]
+            tenant_rows = [{'apartment_id': Pending(t[0]), 'full_name': t[1], 'passport': t[2], 'birth_date': t[3],
+                            'is_responsible': t[4], 'moved_in': t[5]} for t in tenants_list]
+            if not self.validate_rows([('houses', [house], None, None),
+                                       ('apartments', apartment_rows, None,
+                                        [f"Кв. {apt[0]}" for apt in apartments_list]),
+                                       ('tenants', tenant_rows, None,
+                                        [f"Кв. {t[0]}, {t[1]}" for t in tenants_list])]):
+                return
+
+            try:
+                cursor = self.conn.cursor()
+
+                cursor.execute("""
+                    INSERT INTO houses (service_id, department_id, section_id, street, house_number, building, year_built)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    RETURNING house_id
+                """, (service_id, department_id, section_id, street, house_number,
+                      house['building'], house['year_built']))
+                house_id = cursor.fetchone()[0]
+
+                apartment_ids = self.insert_apartments_batch(cursor, house_id, apartments_list, flag_values)
+
+                self.insert_tenants_batch(cursor, [
+                    (apartment_ids[t[0]],) + t[1:] for t in tenants_list
+                ])
+
+                self.commit_write()
+                cursor.close()
+
+                messagebox.showinfo("Успех",
+                                    f"Дом {street} {house_number} создан (ID: {house_id})\n"
+                                    f"Добавлено квартир: {len(apartment_ids)}\n"
+                                    f"Добавлено жильцов: {len(tenants_list)}")
+
+                dialog.destroy()
+
+                if self.current_table in ('houses', 'apartments', 'tenants'):
+                    self.load_data()
+
+            except Exception as e:
+                self.conn.rollback()
+                messagebox.showerror("Ошибка", f"Ошибка сохранения:\n{e}")
+
+        ttk.Button(buttons_frame, text="Сохранить дом с квартирами и жильцами",
+                   command=save_house_bulk).pack(side=tk.LEFT, padx=20)
+        ttk.Button(buttons_frame, text="Отмена", command=dialog.destroy).pack(side=tk.LEFT)
+
+    def report_rent(self):
+        # Отчет: Квартплата по домам
+        if not self.can_read():
+            self.show_toast("Нет подключения к БД", toast_type="warning")
+            return
+
+        self.show_report_dialog('rent', "Отчет: Квартплата", "650x400", self.build_rent_dialog)
+
+    def build_rent_dialog(self, dialog):
+        # Построение диалога параметров отчета "Квартплата" (один раз, при первом открытии)
         params_frame = ttk.LabelFrame(dialog, text="Параметры отчета", padding=10)
         params_frame.pack(fill=tk.X, padx=10, pady=10)
 
@@ -996,12 +2578,13 @@ class DatabaseApp:
         row.pack(fill=tk.X, pady=5)
         ttk.Label(row, text="Дом:", width=20).pack(side=tk.LEFT)
 
-        houses = self.get_houses_list()
-        house_combo = ttk.Combobox(row, state="readonly", width=45)
-        house_combo['values'] = ['Все дома'] + [f"{h[0]}: {h[1]} {h[2]}{' корп.' + h[3] if h[3] else ''}" for h in
-                                                houses]
-        house_combo.current(0)
-        house_combo.pack(side=tk.LEFT)
+        house_picker = ForeignKeyPicker(row, self, 'house_id', width=45)
+        house_picker.pack(side=tk.LEFT)
+        ttk.Label(row, text="(пусто - все дома)").pack(side=tk.LEFT, padx=5)
+
+        def refresh():
+            # При каждом открытии диалога - все дома
+            house_picker.set_id(None)
 
         row2 = ttk.Frame(params_frame)
         row2.pack(fill=tk.X, pady=5)
@@ -1027,86 +2610,45 @@ class DatabaseApp:
         sort_dir.pack(side=tk.LEFT, padx=5)
 
         def generate_report():
-            house_idx = house_combo.current()
-            house_id = None if house_idx == 0 else houses[house_idx - 1][0]
+            house_id = house_picker.get() or None
+            if house_id is not None and not house_id.isdigit():
+                self.show_toast("Выберите дом из списка", toast_type="warning")
+                return
             street_filter = street_entry.get().strip()
             sort_idx = sort_field.current()
             sort_order = "ASC" if sort_dir.current() == 0 else "DESC"
 
-            sort_columns = ['h.street, h.house_number, a.apt_number', 'a.apt_number', 'a.total_area', 'total_rent']
-            order_by = sort_columns[sort_idx]
-
             try:
-                cursor = self.conn.cursor()
-
-                query = """
-                    SELECT 
-                        h.street || ' ' || h.house_number || COALESCE(' корп.' || h.building, '') AS address,
-                        a.apt_number,
-                        a.total_area,
-                        a.current_residents,
-                        CASE WHEN a.cold_water THEN 'Да' ELSE 'Нет' END AS cold_water,
-                        CASE WHEN a.hot_water THEN 'Да' ELSE 'Нет' END AS hot_water,
-                        CASE WHEN a.elevator THEN 'Да' ELSE 'Нет' END AS elevator,
-                        ROUND(a.total_area * 25.50, 2) AS rent_base,
-                        ROUND(CASE WHEN a.cold_water THEN a.current_residents * 150.00 ELSE 0 END, 2) AS cold_water_cost,
-                        ROUND(CASE WHEN a.hot_water THEN a.current_residents * 200.00 ELSE 0 END, 2) AS hot_water_cost,
-                        ROUND(CASE WHEN a.elevator THEN a.total_area * 5.00 ELSE 0 END, 2) AS elevator_cost,
-                        ROUND(
-                            a.total_area * 25.50 + 
-                            CASE WHEN a.cold_water THEN a.current_residents * 150.00 ELSE 0 END +
-                            CASE WHEN a.hot_water THEN a.current_residents * 200.00 ELSE 0 END +
-                            CASE WHEN a.elevator THEN a.total_area * 5.00 ELSE 0 END
-                        , 2) AS total_rent
-                    FROM apartments a
-                    JOIN houses h ON a.house_id = h.house_id
-                """
-
-                params = []
-                where_conditions = []
-
-                if house_id:
-                    where_conditions.append("h.house_id = %s")
-                    params.append(house_id)
-                elif street_filter:
-                    where_conditions.append("h.street ILIKE %s")
-                    params.append(f"%{street_filter}%")
-
-                if where_conditions:
-                    query += " WHERE " + " AND ".join(where_conditions)
-
-                query += f" ORDER BY {order_by} {sort_order}"
-
-                cursor.execute(query, params if params else None)
-                rows = cursor.fetchall()
-
-                # Итоги
-                totals_query = """
-                    SELECT 
-                        COUNT(*) as cnt,
-                        COALESCE(SUM(a.total_area), 0) as total_area,
-                        COALESCE(SUM(
-                            a.total_area * 25.50 + 
-                            CASE WHEN a.cold_water THEN a.current_residents * 150.00 ELSE 0 END +
-                            CASE WHEN a.hot_water THEN a.current_residents * 200.00 ELSE 0 END +
-                            CASE WHEN a.elevator THEN a.total_area * 5.00 ELSE 0 END
-                        ), 0) AS total_sum
-                    FROM apartments a
-                    JOIN houses h ON a.house_id = h.house_id
-                """
-                if where_conditions:
-                    totals_query += " WHERE " + " AND ".join(where_conditions)
-
-                cursor.execute(totals_query, params if params else None)
-                totals = cursor.fetchone()
-                cursor.close()
-
-                dialog.destroy()
+                query, _, params = queries.build_rent_report(house_id, street_filter, sort_idx, sort_order)
+                key, versions, data = self.cached_report('rent', queries.REPORT_TABLES['rent'], query, params)
+                cached = data is not None
+                if not cached:
+                    data = self.report_source(query, params)
+                    if data is None:
+                        return
+                    if isinstance(data, ReportStream):
+                        data.on_done = lambda store: self.store_report(key, versions, store)
+
+                # Итоги накапливаются по мере получения строк: квартир, площадь, к оплате
+                totals = [0, 0, 0]
+
+                def running_totals(rows):
+                    totals[0] += len(rows)
+                    totals[1] += sum(r[2] or 0 for r in rows)
+                    totals[2] += sum(r[11] or 0 for r in rows)
+                    return (f"Всего квартир: {totals[0]} | Общая площадь: {totals[1]:.2f} м² | "
+                            f"ИТОГО К ОПЛАТЕ: {totals[2]:.2f} руб.")
+
+                self.hide_dialog(dialog)
                 self.show_report_window("Отчет: Квартплата",
                                         ['Адрес', 'Кв.', 'Площадь', 'Жильцов', 'Хол.вода', 'Гор.вода', 'Лифт',
                                          'Содерж.', 'Хол.вода₽', 'Гор.вода₽', 'Лифт₽', 'ИТОГО'],
-                                        rows,
-                                        f"Всего квартир: {totals[0]} | Общая площадь: {totals[1]:.2f} м² | ИТОГО К ОПЛАТЕ: {totals[2]:.2f} руб.")
+                                        data,
+                                        running_totals,
+                                        subtotals=(0, [2, 3, 7, 8, 9, 10, 11]))
+                if cached:
+                    self.show_toast(f"Отчет из кэша (данные не изменялись): {len(data)} записей",
+                                    toast_type="success")
 
             except Exception as e:
                 messagebox.showerror("Ошибка", f"Ошибка формирования отчета:\n{e}")
@@ -1114,20 +2656,19 @@ class DatabaseApp:
         btn_frame = ttk.Frame(dialog)
         btn_frame.pack(fill=tk.X, pady=20)
         ttk.Button(btn_frame, text="Сформировать отчет", command=generate_report).pack(side=tk.LEFT, padx=20)
-        ttk.Button(btn_frame, text="Отмена", command=dialog.destroy).pack(side=tk.LEFT)
+        ttk.Button(btn_frame, text="Отмена", command=lambda: self.hide_dialog(dialog)).pack(side=tk.LEFT)
+        return refresh
 
     def report_tenants_by_section(self):
         # Отчет: Жильцы по участкам (для избирательных списков)
-        if not self.conn:
+        if not self.can_read():
             self.show_toast("Нет подключения к БД", toast_type="warning")
             return
 
-        dialog = tk.Toplevel(self.root)
-        dialog.title("Отчет: Жильцы по участкам")
-        dialog.geometry("650x400")
-        dialog.transient(self.root)
-        dialog.grab_set()
+        self.show_report_dialog('tenants', "Отчет: Жильцы по участкам", "650x480", self.build_tenants_dialog)
 
+    def build_tenants_dialog(self, dialog):
+        # Построение диалога параметров отчета "Жильцы по участкам" (один раз, при первом открытии)
         params_frame = ttk.LabelFrame(dialog, text="Параметры отчета", padding=10)
         params_frame.pack(fill=tk.X, padx=10, pady=10)
 
@@ -1135,19 +2676,19 @@ class DatabaseApp:
         row.pack(fill=tk.X, pady=5)
         ttk.Label(row, text="Участок:", width=20).pack(side=tk.LEFT)
 
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT section_id, name FROM sections ORDER BY name")
-            sections = cursor.fetchall()
-            cursor.close()
-        except:
-            sections = []
-
+        sections = []
         section_combo = ttk.Combobox(row, state="readonly", width=30)
-        section_combo['values'] = ['Все участки'] + [f"{s[0]}: {s[1]}" for s in sections]
-        section_combo.current(0)
         section_combo.pack(side=tk.LEFT)
 
+        def refresh():
+            # Обновить список участков при каждом открытии диалога
+            try:
+                sections[:] = self.run_read(queries.SECTIONS_LIST_SQL)
+            except:
+                sections[:] = []
+            section_combo['values'] = ['Все участки'] + [f"{s[0]}: {s[1]}" for s in sections]
+            section_combo.current(0)
+
         adults_var = tk.BooleanVar(value=True)
         ttk.Checkbutton(params_frame, text="Только совершеннолетние (18+)", variable=adults_var).pack(anchor=tk.W,
                                                                                                       pady=5)
@@ -1156,6 +2697,16 @@ class DatabaseApp:
         ttk.Checkbutton(params_frame, text="Только проживающие (не выселенные)", variable=active_var).pack(anchor=tk.W,
                                                                                                            pady=5)
 
+        archive_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(params_frame, text="Включая архив выселенных", variable=archive_var).pack(anchor=tk.W, pady=5)
+
+        row = ttk.Frame(params_frame)
+        row.pack(fill=tk.X, pady=5)
+        ttk.Label(row, text="На дату:", width=20).pack(side=tk.LEFT)
+        as_of_entry = ttk.Entry(row, width=12)
+        as_of_entry.pack(side=tk.LEFT)
+        ttk.Label(row, text="(ГГГГ-ММ-ДД, пусто - на сегодня)").pack(side=tk.LEFT, padx=5)
+
         sort_frame = ttk.LabelFrame(dialog, text="Сортировка", padding=10)
         sort_frame.pack(fill=tk.X, padx=10, pady=5)
 
@@ -1179,70 +2730,38 @@ class DatabaseApp:
             only_active = active_var.get()
             sort_idx = sort_field.current()
             sort_order = "ASC" if sort_dir.current() == 0 else "DESC"
-
-            sort_columns = ['t.full_name', 'h.street, h.house_number', 't.birth_date', 'age']
-            order_by = sort_columns[sort_idx]
-
+            as_of_value = as_of_entry.get().strip()
             try:
-                cursor = self.conn.cursor()
-
-                query = """
-                    SELECT 
-                        s.name AS section_name,
-                        t.full_name,
-                        h.street || ' ' || h.house_number || COALESCE(' корп.' || h.building, '') || ', кв.' || a.apt_number AS address,
-                        t.birth_date,
-                        CASE WHEN t.birth_date IS NOT NULL 
-                             THEN EXTRACT(YEAR FROM AGE(t.birth_date))::int 
-                             ELSE NULL END AS age,
-                        t.passport
-                    FROM tenants t
-                    JOIN apartments a ON t.apartment_id = a.apartment_id
-                    JOIN houses h ON a.house_id = h.house_id
-                    JOIN sections s ON h.section_id = s.section_id
-                    WHERE 1=1
-                """
-
-                params = []
-                if section_id:
-                    query += " AND s.section_id = %s"
-                    params.append(section_id)
-                if only_adults:
-                    query += " AND t.birth_date IS NOT NULL AND t.birth_date <= CURRENT_DATE - INTERVAL '18 years'"
-                if only_active:
-                    query += " AND t.moved_out IS NULL"
-
-                query += f" ORDER BY s.name, {order_by} {sort_order}"
-
-                cursor.execute(query, params if params else None)
-                rows = cursor.fetchall()
-
-                # Итоги по участкам
-                cursor.execute("""
-                    SELECT s.name, COUNT(*) 
-                    FROM tenants t
-                    JOIN apartments a ON t.apartment_id = a.apartment_id
-                    JOIN houses h ON a.house_id = h.house_id
-                    JOIN sections s ON h.section_id = s.section_id
-                    WHERE 1=1
-                """ + (" AND s.section_id = %s" if section_id else "") +
-                               (
-                                   " AND t.birth_date IS NOT NULL AND t.birth_date <= CURRENT_DATE - INTERVAL '18 years'" if only_adults else "") +
-                               (" AND t.moved_out IS NULL" if only_active else "") +
-                               " GROUP BY s.name ORDER BY s.name",
-                               params if params else None)
-                group_totals = cursor.fetchall()
-                cursor.close()
-
-                dialog.destroy()
-
-                totals_str = " | ".join([f"{g[0]}: {g[1]} чел." for g in group_totals])
-                total_count = sum(g[1] for g in group_totals)
+                as_of = date.fromisoformat(as_of_value) if as_of_value else None
+            except ValueError:
+                self.show_toast("Введите дату в формате ГГГГ-ММ-ДД", toast_type="warning")
+                return
 
-                self.show_report_window("Отчет: Жильцы по участкам",
+            try:
+                # Над снимком - вариант запроса для SQLite
+                builder = snapshot.build_tenants_report if self.snapshot_active else queries.build_tenants_report
+                query, _, params = builder(section_id, only_adults, only_active, sort_idx, sort_order,
+                                           as_of, archive_var.get())
+                data = self.report_source(query, params)
+                if data is None:
+                    return
+
+                # Итоги по участкам накапливаются по мере получения строк
+                group_totals = {}
+
+                def running_totals(rows):
+                    for r in rows:
+                        group_totals[r[0]] = group_totals.get(r[0], 0) + 1
+                    totals_str = " | ".join(f"{name}: {count} чел." for name, count in group_totals.items())
+                    return f"ИТОГО: {sum(group_totals.values())} чел. | {totals_str}"
+
+                self.hide_dialog(dialog)
+
+                title = f"Отчет: Жильцы по участкам на {as_of}" if as_of else "Отчет: Жильцы по участкам"
+                self.show_report_window(title,
                                         ['Участок', 'ФИО', 'Адрес', 'Дата рожд.', 'Возраст', 'Паспорт'],
-                                        rows,
-                                        f"ИТОГО: {total_count} чел. | {totals_str}")
+                                        data,
+                                        running_totals)
 
             except Exception as e:
                 messagebox.showerror("Ошибка", f"Ошибка формирования отчета:\n{e}")
@@ -1250,20 +2769,19 @@ class DatabaseApp:
         btn_frame = ttk.Frame(dialog)
         btn_frame.pack(fill=tk.X, pady=20)
         ttk.Button(btn_frame, text="Сформировать отчет", command=generate_report).pack(side=tk.LEFT, padx=20)
-        ttk.Button(btn_frame, text="Отмена", command=dialog.destroy).pack(side=tk.LEFT)
+        ttk.Button(btn_frame, text="Отмена", command=lambda: self.hide_dialog(dialog)).pack(side=tk.LEFT)
+        return refresh
 
     def report_housing_stats(self):
         # Отчет: Статистика по жилфонду
-        if not self.conn:
+        if not self.can_read():
             self.show_toast("Нет подключения к БД", toast_type="warning")
             return
 
-        dialog = tk.Toplevel(self.root)
-        dialog.title("Отчет: Статистика жилфонда")
-        dialog.geometry("650x380")
-        dialog.transient(self.root)
-        dialog.grab_set()
+        self.show_report_dialog('housing', "Отчет: Статистика жилфонда", "650x380", self.build_housing_dialog)
 
+    def build_housing_dialog(self, dialog):
+        # Построение диалога параметров отчета "Статистика жилфонда" (один раз, при первом открытии)
         params_frame = ttk.LabelFrame(dialog, text="Параметры отчета", padding=10)
         params_frame.pack(fill=tk.X, padx=10, pady=10)
 
@@ -1307,87 +2825,174 @@ class DatabaseApp:
             sort_idx = sort_field.current()
             sort_order = "ASC" if sort_dir.current() == 0 else "DESC"
 
-            group_tables = [
-                ('sv.name', 'services sv', 'h.service_id = sv.service_id'),
-                ('d.name', 'departments d', 'h.department_id = d.department_id'),
-                ('sec.name', 'sections sec', 'h.section_id = sec.section_id')
-            ]
-            group_col, group_table, group_join = group_tables[group_idx]
-
-            sort_columns = [group_col, 'houses_count', 'apartments_count', 'residents_count']
-            order_by = sort_columns[sort_idx]
+            def report_error(e):
+                messagebox.showerror("Ошибка", f"Ошибка формирования отчета:\n{e}")
 
             try:
-                cursor = self.conn.cursor()
-
-                where_conditions = []
-                params = []
-
-                if year_from_val:
-                    where_conditions.append("h.year_built >= %s")
-                    params.append(int(year_from_val))
-                if year_to_val:
-                    where_conditions.append("h.year_built <= %s")
-                    params.append(int(year_to_val))
-
-                where_clause = (" WHERE " + " AND ".join(where_conditions)) if where_conditions else ""
-
-                query = f"""
-                    SELECT 
-                        {group_col} AS group_name,
-                        COUNT(DISTINCT h.house_id) AS houses_count,
-                        COUNT(DISTINCT a.apartment_id) AS apartments_count,
-                        COALESCE(SUM(a.current_residents), 0)::int AS residents_count,
-                        COALESCE(ROUND(AVG(a.total_area), 2), 0) AS avg_area,
-                        COALESCE(ROUND(SUM(a.total_area), 2), 0) AS total_area
-                    FROM houses h
-                    JOIN {group_table} ON {group_join}
-                    LEFT JOIN apartments a ON h.house_id = a.house_id
-                    {where_clause}
-                    GROUP BY {group_col} 
-                    ORDER BY {order_by} {sort_order}
-                """
-
-                cursor.execute(query, params if params else None)
-                rows = cursor.fetchall()
-
-                # Общие итоги
-                totals_query = f"""
-                    SELECT 
-                        COUNT(DISTINCT h.house_id),
-                        COUNT(DISTINCT a.apartment_id),
-                        COALESCE(SUM(a.current_residents), 0)::int,
-                        COALESCE(ROUND(SUM(a.total_area), 2), 0)
-                    FROM houses h
-                    LEFT JOIN apartments a ON h.house_id = a.house_id
-                    {where_clause}
-                """
-
-                cursor.execute(totals_query, params if params else None)
-                totals = cursor.fetchone()
-                cursor.close()
-
-                group_names = ['Служба', 'Отдел', 'Участок']
-                group_text = group_combo.get().lower()
-
-                dialog.destroy()
-
-                self.show_report_window(f"Отчет: Статистика жилфонда (по {group_text})",
-                                        [group_names[group_idx], 'Домов', 'Квартир', 'Жильцов', 'Ср. площадь',
-                                         'Общ. площадь'],
-                                        rows,
-                                        f"ИТОГО: домов: {totals[0]} | квартир: {totals[1]} | жильцов: {totals[2]} | площадь: {totals[3]} м²")
+                # Небольшой жилфонд загружается по домам один раз, дальше группировка и сводные - в клиенте
+                # Снимок участка всегда невелик, оценка нужна только для сервера
+                estimate = None if self.snapshot_active else self.run_read(queries.TABLE_ESTIMATE_SQL, ('houses',))
+                if estimate and estimate[0][0] is not None and estimate[0][0] > REPORT_LOCAL_MAX_ROWS:
+                    query, totals_query, params = queries.build_housing_stats_report(
+                        group_idx, year_from_val, year_to_val, sort_idx, sort_order)
+
+                    group_names = ['Служба', 'Отдел', 'Участок']
+                    group_text = group_combo.get().lower()
+
+                    def show_grouped(results):
+                        rows, totals = results[0], results[1][0]
+                        self.hide_dialog(dialog)
+
+                        self.show_report_window(f"Отчет: Статистика жилфонда (по {group_text})",
+                                                [group_names[group_idx], 'Домов', 'Квартир', 'Жильцов', 'Ср. площадь',
+                                                 'Общ. площадь'],
+                                                rows,
+                                                f"ИТОГО: домов: {totals[0]} | квартир: {totals[1]} | жильцов: {totals[2]} | площадь: {totals[3]} м²")
+
+                    key, versions, cached = self.cached_report('housing', queries.REPORT_TABLES['housing'],
+                                                               query, params)
+                    if cached is not None:
+                        show_grouped(cached)
+                        self.show_toast("Отчет из кэша (данные не изменялись)", toast_type="success")
+                        return
+
+                    def fetched_grouped(results):
+                        self.store_report(key, versions, results)
+                        show_grouped(results)
+
+                    # Строки и общие итоги - независимые запросы, выполняются одновременно
+                    self.read_async([(query, params), (totals_query, params)], fetched_grouped, report_error,
+                                    profile='report')
+                    return
+
+                def show_local(results):
+                    rows = results[0]
+                    with STATS.phase("aggregate:housing_detail", len(rows)):
+                        store = ColumnStore.from_rows(['Служба', 'Отдел', 'Участок', 'Год постройки', 'Квартир',
+                                                       'Жильцов', 'Площадь'], rows)
+                        engine = AggregationEngine(store)
+                        totals = store.totals()
+
+                    self.hide_dialog(dialog)
+
+                    self.show_report_window("Отчет: Статистика жилфонда",
+                                            [], [],
+                                            f"ИТОГО: домов: {len(store)} | квартир: {totals.get('Квартир', 0)} | "
+                                            f"жильцов: {totals.get('Жильцов', 0)} | площадь: {totals.get('Площадь', 0):.2f} м²",
+                                            sort=(sort_idx, sort_order == "DESC"),
+                                            controls=lambda frame, show: self.build_housing_controls(
+                                                frame, show, engine, group_idx))
+
+                detail = queries.build_housing_detail_report(year_from_val, year_to_val)
+                key, versions, cached = self.cached_report('housing_detail', queries.REPORT_TABLES['housing'], *detail)
+                if cached is not None:
+                    show_local([cached])
+                    self.show_toast("Отчет из кэша (данные не изменялись)", toast_type="success")
+                    return
+
+                def fetched_local(results):
+                    self.store_report(key, versions, results[0])
+                    show_local(results)
+
+                self.read_async([detail], fetched_local, report_error, profile='report')
 
             except Exception as e:
-                messagebox.showerror("Ошибка", f"Ошибка формирования отчета:\n{e}")
+                report_error(e)
 
         btn_frame = ttk.Frame(dialog)
         btn_frame.pack(fill=tk.X, pady=20)
         ttk.Button(btn_frame, text="Сформировать отчет", command=generate_report).pack(side=tk.LEFT, padx=20)
-        ttk.Button(btn_frame, text="Отмена", command=dialog.destroy).pack(side=tk.LEFT)
+        ttk.Button(btn_frame, text="Отмена", command=lambda: self.hide_dialog(dialog)).pack(side=tk.LEFT)
+        return None
+
+    def build_housing_controls(self, frame, show, engine, group_idx):
+        # Панель перегруппировки "Статистики жилфонда": все изменения считаются по загруженным строкам
+        dimensions = [
+            ('Служба', 'Служба', None),
+            ('Отдел', 'Отдел', None),
+            ('Участок', 'Участок', None),
+            ('Десятилетие', 'Год постройки', decade_label)
+        ]
+        measures = [
+            ('Домов', 'count', None),
+            ('Квартир', 'sum', 'Квартир'),
+            ('Жильцов', 'sum', 'Жильцов'),
+            ('Ср. площадь', 'ratio', ('Площадь', 'Квартир')),
+            ('Общ. площадь', 'sum', 'Площадь')
+        ]
+
+        ttk.Label(frame, text="Группировать по:").pack(side=tk.LEFT)
+        group_combo = ttk.Combobox(frame, state="readonly", width=16)
+        group_combo['values'] = ['Службам', 'Отделам', 'Участкам', 'Десятилетиям']
+        group_combo.current(group_idx)
+        group_combo.pack(side=tk.LEFT, padx=5)
+
+        ttk.Label(frame, text="Подгруппа:").pack(side=tk.LEFT, padx=(10, 0))
+        subgroup_combo = ttk.Combobox(frame, state="readonly", width=14)
+        subgroup_combo['values'] = ['Нет', 'Служба', 'Отдел', 'Участок', 'Десятилетие']
+        subgroup_combo.current(0)
+        subgroup_combo.pack(side=tk.LEFT, padx=5)
+
+        ttk.Label(frame, text="Сводная, столбцы:").pack(side=tk.LEFT, padx=(10, 0))
+        pivot_combo = ttk.Combobox(frame, state="readonly", width=14)
+        pivot_combo['values'] = ['Нет', 'Служба', 'Отдел', 'Участок', 'Десятилетие']
+        pivot_combo.current(0)
+        pivot_combo.pack(side=tk.LEFT, padx=5)
+
+        measure_combo = ttk.Combobox(frame, state="readonly", width=14)
+        measure_combo['values'] = ['Домов', 'Квартир', 'Жильцов', 'Общ. площадь']
+        measure_combo.current(2)
+        measure_combo.pack(side=tk.LEFT, padx=5)
+
+        def regroup(event=None):
+            key = dimensions[group_combo.current()]
+            pivot_idx = pivot_combo.current()
+            subgroup_idx = subgroup_combo.current()
+            with STATS.phase("aggregate:housing_regroup"):
+                if pivot_idx > 0 and pivot_idx - 1 != group_combo.current():
+                    measure = [m for m in measures if m[0] == measure_combo.get()][0]
+                    show(engine.pivot(key, dimensions[pivot_idx - 1], measure))
+                elif subgroup_idx > 0 and subgroup_idx - 1 != group_combo.current():
+                    store = engine.group([key, dimensions[subgroup_idx - 1]], measures)
+                    show(store, subtotals=(0, [2, 3, 4, 6]))
+                else:
+                    show(engine.group([key], measures))
+
+        for combo in (group_combo, subgroup_combo, pivot_combo, measure_combo):
+            combo.bind("<<ComboboxSelected>>", regroup)
+        regroup()
+
+    def show_report_dialog(self, key, title, geometry, builder):
+        # Показать диалог параметров отчета: строится при первом использовании, затем переиспользуется
+        entry = self.report_dialogs.get(key)
+        if entry is None or not entry[0].winfo_exists():
+            dialog = tk.Toplevel(self.root)
+            dialog.title(title)
+            dialog.geometry(geometry)
+            dialog.transient(self.root)
+            dialog.protocol("WM_DELETE_WINDOW", lambda: self.hide_dialog(dialog))
+            entry = (dialog, builder(dialog))
+            self.report_dialogs[key] = entry
+        else:
+            entry[0].deiconify()
+        dialog, refresh = entry
+        if refresh:
+            refresh()
+        dialog.grab_set()
+        dialog.lift()
 
-    def show_report_window(self, title, columns, data, totals_text):
+    def hide_dialog(self, dialog):
+        # Скрыть диалог без уничтожения, чтобы повторно открыть его мгновенно
+        dialog.grab_release()
+        dialog.withdraw()
+
+    def show_report_window(self, title, columns, data, totals_text, subtotals=None, sort=None, controls=None):
         # Показать окно с отчетом
+        # Сортировка по заголовку и промежуточные итоги считаются локально, без повторного запроса
+        # subtotals - (индекс колонки группы, индексы суммируемых колонок)
+        # controls - построитель панели перегруппировки: controls(frame, show), show(store, subtotals=None)
+        # data - список строк или ReportStream: окно открывается сразу, строки дописываются по мере получения
+        # totals_text - строка итогов или функция totals_text(rows) -> строка, накапливающая итоги по частям
         report_win = tk.Toplevel(self.root)
         report_win.title(title)
         report_win.geometry("1000x600")
@@ -1396,18 +3001,18 @@ class DatabaseApp:
         header = ttk.Label(report_win, text=title, font=('Segoe UI', 14, 'bold'))
         header.pack(pady=10)
 
+        controls_frame = ttk.Frame(report_win)
+        controls_frame.pack(fill=tk.X, padx=10)
+
         tree_frame = ttk.Frame(report_win)
         tree_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
 
-        tree = ttk.Treeview(tree_frame, columns=columns, show='headings')
-
-        for col in columns:
-            tree.heading(col, text=col)
-            tree.column(col, width=100, minwidth=50)
+        tree = ttk.Treeview(tree_frame, show='headings')
 
         vsb = ttk.Scrollbar(tree_frame, orient="vertical", command=tree.yview)
         hsb = ttk.Scrollbar(tree_frame, orient="horizontal", command=tree.xview)
-        tree.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
+        tree.configure(xscrollcommand=hsb.set)
+        report_win.lazy_rows = LazyRows(tree, vsb)
 
         tree.grid(row=0, column=0, sticky="nsew")
         vsb.grid(row=0, column=1, sticky="ns")
@@ -1416,23 +3021,587 @@ class DatabaseApp:
         tree_frame.grid_rowconfigure(0, weight=1)
         tree_frame.grid_columnconfigure(0, weight=1)
 
-        for row in data:
-            display_row = [str(v) if v is not None else '' for v in row]
-            tree.insert('', tk.END, values=display_row)
+        stream = data if isinstance(data, ReportStream) else None
+        state = {'store': None, 'subtotals': subtotals, 'sort': sort or (None, False), 'streaming': bool(stream)}
+        subtotals_var = tk.BooleanVar(value=False)
+
+        def render():
+            store = state['store']
+            index, reverse = state['sort']
+            order = None
+            if index is not None and index < len(store.names) and len(store):
+                order = store.sort_order(index, reverse)
+            if state['subtotals'] and (controls or subtotals_var.get()) and len(store):
+                # Группы идут подряд по ключу, внутри группы - выбранная сортировка
+                key_index, sum_indices = state['subtotals']
+                order = store.sort_order(key_index, False, order if order is not None else range(len(store)))
+                ordered = ColumnStore.from_rows(store.names, [tuple(col[i] for col in store.columns) for i in order])
+                store, order = with_subtotals(ordered, key_index, sum_indices), None
+            report_win.lazy_rows.set_data(store, order, phase="tk_insert:report")
+
+        def sort_by(index):
+            if state['streaming']:
+                self.show_toast("Отчет еще загружается", toast_type="warning")
+                return
+            current, reverse = state['sort']
+            state['sort'] = (index, not reverse if current == index else False)
+            render()
+
+        def show(store, subtotals=None):
+            if controls:
+                state['subtotals'] = subtotals
+            if store.names != list(tree['columns']):
+                tree['columns'] = store.names
+                for i, col in enumerate(store.names):
+                    tree.heading(col, text=col, command=lambda i=i: sort_by(i))
+                    tree.column(col, width=100, minwidth=50)
+            state['store'] = store
+            render()
+
+        subtotals_check = None
+        if controls:
+            controls(controls_frame, show)
+        else:
+            if subtotals:
+                subtotals_check = ttk.Checkbutton(controls_frame, text="Промежуточные итоги",
+                                                  variable=subtotals_var, command=render)
+                subtotals_check.pack(side=tk.LEFT)
+            show(ColumnStore.empty(columns) if stream else ColumnStore.from_rows(columns, data))
 
         # Итоги
         totals_frame = ttk.Frame(report_win)
         totals_frame.pack(fill=tk.X, padx=10, pady=10)
 
-        ttk.Label(totals_frame, text=totals_text, font=('Segoe UI', 11, 'bold'),
+        if callable(totals_text):
+            totals_var = tk.StringVar(value=totals_text([] if stream else data))
+        else:
+            totals_var = tk.StringVar(value=totals_text)
+        ttk.Label(totals_frame, textvariable=totals_var, font=('Segoe UI', 11, 'bold'),
                   foreground='#0066cc').pack(side=tk.LEFT)
 
-        ttk.Button(totals_frame, text="Закрыть", command=report_win.destroy).pack(side=tk.RIGHT, padx=10)
+        def close():
+            if stream:
+                stream.cancel()
+            report_win.destroy()
+
+        report_win.protocol("WM_DELETE_WINDOW", close)
+        ttk.Button(totals_frame, text="Закрыть", command=close).pack(side=tk.RIGHT, padx=10)
+        ttk.Button(totals_frame, text="Экспорт CSV",
+                   command=lambda: self.export_rows(report_win.lazy_rows, None, title)).pack(side=tk.RIGHT)
+
+        if not stream:
+            self.show_toast(f"Отчет сформирован: {len(state['store'])} записей", toast_type="success")
+            return
+
+        # Потоковое получение: части из фонового потока дописываются в хранилище, итоги и счетчик обновляются
+        counter_var = tk.StringVar(value="Загрузка...")
+        ttk.Label(totals_frame, textvariable=counter_var, foreground='gray').pack(side=tk.RIGHT, padx=10)
+        if subtotals_check is not None:
+            subtotals_check.state(['disabled'])
+        started = time.perf_counter()
+
+        def poll_stream():
+            if not report_win.winfo_exists():
+                stream.cancel()
+                return
+            store = state['store']
+            try:
+                while True:
+                    kind, payload = stream.chunks.get_nowait()
+                    if kind == 'rows':
+                        if not len(store):
+                            STATS.record_phase("report:first_rows", time.perf_counter() - started, len(payload))
+                        store.extend(payload)
+                        if callable(totals_text):
+                            totals_var.set(totals_text(payload))
+                        counter_var.set(stream_progress(stream, len(store)))
+                    elif kind == 'error':
+                        state['streaming'] = False
+                        counter_var.set(f"Прервано, строк: {len(store)}")
+                        messagebox.showerror("Ошибка", f"Ошибка формирования отчета:\n{payload}", parent=report_win)
+                        return
+                    else:
+                        state['streaming'] = False
+                        STATS.record_phase("report:all_rows", time.perf_counter() - started, len(store))
+                        counter_var.set(f"Строк: {len(store)}")
+                        if subtotals_check is not None:
+                            subtotals_check.state(['!disabled'])
+                        report_win.lazy_rows.grow()
+                        self.show_toast(f"Отчет сформирован: {len(store)} записей", toast_type="success")
+                        if stream.on_done:
+                            stream.on_done(store)
+                        return
+            except queue.Empty:
+                pass
+            report_win.lazy_rows.grow()
+            report_win.after(50, poll_stream)
+
+        poll_stream()
+
+    def export_grid(self):
+        # Выгрузка текущей таблицы (с локальными фильтром и сортировкой) в CSV
+        if not self.current_table or self.grid_store is None:
+            self.show_toast("Сначала выберите таблицу", toast_type="warning")
+            return
+        info = TABLES[self.current_table]
+        self.export_rows(self.grid_rows, info['column_names'], info['name'])
+
+    def export_rows(self, lazy_rows, headers, title):
+        # Выгрузка показываемых строк в CSV; строки читаются частями, в том числе из колонок во временных файлах
+        if lazy_rows.store is None:
+            return
+        path = filedialog.asksaveasfilename(title=f"Экспорт: {title}", defaultextension=".csv",
+                                            filetypes=[("CSV", "*.csv")])
+        if not path:
+            return
+        try:
+            with STATS.phase("export:csv", lazy_rows.total()), open(path, 'w', encoding='utf-8-sig', newline='') as f:
+                lazy_rows.store.write_csv(f, headers, lazy_rows.view)
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Ошибка записи файла:\n{e}")
+            return
+        self.show_toast(f"Выгружено строк: {lazy_rows.total()}", toast_type="success")
+
+    def open_archive_dialog(self):
+        # Перенос давно выселенных жильцов в архив
+        if not self.conn:
+            self.show_toast("Нет подключения к БД", toast_type="warning")
+            return
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Архив жильцов")
+        dialog.geometry("480x170")
+        dialog.transient(self.root)
+        dialog.grab_set()
+
+        ttk.Label(dialog, text="Жильцы, выселенные до указанной даты, переносятся в архив.\n"
+                               "Они остаются в отчетах и просмотре \"С архивом\".").pack(padx=10, pady=10)
+
+        row = ttk.Frame(dialog)
+        row.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Label(row, text="Выселенные до:", width=16).pack(side=tk.LEFT)
+        before_entry = ttk.Entry(row, width=12)
+        before_entry.insert(0, str(date(date.today().year - 3, 1, 1)))
+        before_entry.pack(side=tk.LEFT)
+
+        def archive():
+            try:
+                before = date.fromisoformat(before_entry.get().strip())
+            except ValueError:
+                self.show_toast("Введите дату в формате ГГГГ-ММ-ДД", toast_type="warning")
+                return
+            try:
+                cursor = self.conn.cursor()
+                cursor.execute(queries.ARCHIVE_TENANTS_SQL, (before,))
+                moved = cursor.fetchone()[0]
+                self.commit_write()
+                cursor.close()
+
+                dialog.destroy()
+                self.show_toast(f"Перенесено в архив: {moved} жильцов", toast_type="success")
+                if self.current_table == 'tenants':
+                    self.load_data()
+            except Exception as e:
+                self.conn.rollback()
+                messagebox.showerror("Ошибка", f"Ошибка архивации:\n{e}")
+
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(fill=tk.X, pady=10)
+        ttk.Button(btn_frame, text="Перенести", command=archive).pack(side=tk.LEFT, padx=20)
+        ttk.Button(btn_frame, text="Отмена", command=dialog.destroy).pack(side=tk.LEFT)
+
+    def open_resettlement_dialog(self):
+        # Переселение жильцов дома в квартиры другого дома: план с предпросмотром, затем одна операция на сервере
+        if not self.conn:
+            self.show_toast("Нет подключения к БД", toast_type="warning")
+            return
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Переселение жильцов")
+        dialog.geometry("900x560")
+        dialog.transient(self.root)
+        dialog.grab_set()
+
+        params_frame = ttk.Frame(dialog)
+        params_frame.pack(fill=tk.X, padx=10, pady=5)
+        row = ttk.Frame(params_frame)
+        row.pack(fill=tk.X, pady=2)
+        ttk.Label(row, text="Из дома:", width=15).pack(side=tk.LEFT)
+        source_picker = ForeignKeyPicker(row, self, 'house_id', width=50)
+        source_picker.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        row = ttk.Frame(params_frame)
+        row.pack(fill=tk.X, pady=2)
+        ttk.Label(row, text="В дом:", width=15).pack(side=tk.LEFT)
+        target_picker = ForeignKeyPicker(row, self, 'house_id', width=50)
+        target_picker.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        row = ttk.Frame(params_frame)
+        row.pack(fill=tk.X, pady=2)
+        ttk.Label(row, text="Дата переселения:", width=15).pack(side=tk.LEFT)
+        date_entry = ttk.Entry(row, width=12)
+        date_entry.insert(0, str(date.today()))
+        date_entry.pack(side=tk.LEFT)
+        ttk.Button(row, text="Подобрать по площади", command=lambda: build_plan()).pack(side=tk.LEFT, padx=10)
+
+        columns = ('from', 'from_area', 'residents', 'to', 'to_area', 'to_residents', 'note')
+        headings = ('Откуда (кв.)', 'Площадь', 'Жильцов', 'Куда (кв.)', 'Площадь', 'Живут там', 'Примечание')
+        widths = (90, 80, 70, 90, 80, 80, 330)
+        tree_frame = ttk.Frame(dialog)
+        tree_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        tree = ttk.Treeview(tree_frame, columns=columns, show='headings', selectmode='browse')
+        for col, heading, width in zip(columns, headings, widths):
+            tree.heading(col, text=heading)
+            tree.column(col, width=width, anchor=tk.W if col == 'note' else tk.CENTER)
+        vsb = ttk.Scrollbar(tree_frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=vsb.set)
+        vsb.pack(side=tk.RIGHT, fill=tk.Y)
+        tree.pack(fill=tk.BOTH, expand=True)
+
+        row = ttk.Frame(dialog)
+        row.pack(fill=tk.X, padx=10, pady=2)
+        ttk.Label(row, text="Куда для выбранной:", width=18).pack(side=tk.LEFT)
+        target_combo = ttk.Combobox(row, state="readonly", width=40)
+        target_combo.pack(side=tk.LEFT)
+        summary_var = tk.StringVar(value="Выберите дома и подберите квартиры")
+        ttk.Label(dialog, textvariable=summary_var).pack(fill=tk.X, padx=10, pady=5)
+
+        # Состояние плана: квартиры обоих домов и назначение {id источника: квартира или None}
+        state = {'sources': [], 'targets': [], 'plan': {}, 'date': None}
+
+        def read_apartments(house_id):
+            # Квартиры для плана читаются с основного сервера: план строится по данным, которые будут изменены
+            cursor = self.conn.cursor()
+            cursor.execute(queries.RESETTLEMENT_APARTMENTS_SQL, (house_id,))
+            apartments = [resettlement.Apartment(*r) for r in cursor.fetchall()]
+            cursor.close()
+            self.conn.rollback()
+            return apartments
+
+        def parse_date():
+            try:
+                return date.fromisoformat(date_entry.get().strip())
+            except ValueError:
+                self.show_toast("Введите дату в формате ГГГГ-ММ-ДД", toast_type="warning")
+                return None
+
+        def target_label(apt):
+            return f"кв. {apt.number} ({apt.area} м², жильцов: {apt.residents})"
+
+        def build_plan():
+            source_id, target_id = source_picker.get(), target_picker.get()
+            if not source_id.isdigit() or not target_id.isdigit():
+                self.show_toast("Выберите оба дома из подсказок", toast_type="warning")
+                return
+            on_date = parse_date()
+            if on_date is None:
+                return
+            try:
+                sources = read_apartments(int(source_id))
+                targets = read_apartments(int(target_id))
+            except Exception as e:
+                self.conn.rollback()
+                messagebox.showerror("Ошибка", f"Ошибка загрузки квартир:\n{e}")
+                return
+            state.update(sources=sources, targets=targets, plan=resettlement.auto_assign(sources, targets),
+                         date=on_date)
+            target_combo['values'] = ["— (не переселять)"] + [target_label(apt) for apt in targets]
+            show_plan()
+
+        def show_plan():
+            # Предпросмотр: строка на квартиру-источник, замечания и итог
+            by_id = {apt.apartment_id: apt for apt in state['sources']}
+            problems = resettlement.plan_problems(state['plan'], state['sources'], state['date'])
+            notes = {}
+            for problem in problems:
+                notes.setdefault(problem.source_id, []).append(problem.message)
+            selected = tree.selection()
+            tree.delete(*tree.get_children())
+            for source_id, target in state['plan'].items():
+                source = by_id[source_id]
+                tree.insert('', tk.END, iid=str(source_id), values=(
+                    source.number, source.area, source.residents,
+                    target.number if target else "—", target.area if target else "",
+                    target.residents if target else "", "; ".join(notes.get(source_id, []))))
+            if selected and tree.exists(selected[0]):
+                tree.selection_set(selected[0])
+            moving = [by_id[s] for s, target in state['plan'].items() if target is not None]
+            blocking = sum(1 for problem in problems if problem.blocking)
+            summary_var.set(f"Переселяется {sum(apt.residents for apt in moving)} жильцов из {len(moving)} квартир; "
+                            f"замечаний: {len(problems)}" + (f", из них мешают переселению: {blocking}" if blocking else ""))
+
+        def on_select(event=None):
+            selected = tree.selection()
+            if not selected:
+                return
+            target = state['plan'].get(int(selected[0]))
+            target_combo.current(state['targets'].index(target) + 1 if target else 0)
+
+        def on_target(event=None):
+            selected = tree.selection()
+            if not selected:
+                return
+            index = target_combo.current()
+            state['plan'][int(selected[0])] = state['targets'][index - 1] if index > 0 else None
+            show_plan()
+
+        tree.bind('<<TreeviewSelect>>', on_select)
+        target_combo.bind('<<ComboboxSelected>>', on_target)
+
+        def resettle():
+            on_date = parse_date()
+            if on_date is None or not state['plan']:
+                return
+            if on_date != state['date']:
+                # План проверялся на другую дату
+                state['date'] = on_date
+                show_plan()
+            if any(p.blocking for p in resettlement.plan_problems(state['plan'], state['sources'], on_date)):
+                self.show_toast("Исправьте замечания, отмеченные в плане", toast_type="warning")
+                return
+            from_ids, to_ids = resettlement.plan_arrays(state['plan'])
+            if not from_ids:
+                self.show_toast("Не выбрано ни одной квартиры назначения", toast_type="warning")
+                return
+            if not messagebox.askyesno("Переселение", f"{summary_var.get()}.\nВыполнить переселение?"):
+                return
+            try:
+                cursor = self.conn.cursor()
+                with STATS.phase("resettlement"):
+                    cursor.execute(queries.RESETTLE_TENANTS_SQL, (from_ids, to_ids, on_date))
+                    moved = cursor.fetchone()[0]
+                self.commit_write()
+                cursor.close()
+
+                dialog.destroy()
+                self.show_toast(f"Переселено жильцов: {moved}", toast_type="success")
+                if self.current_table in ('tenants', 'apartments', 'houses'):
+                    self.load_data()
+            except Exception as e:
+                self.conn.rollback()
+                messagebox.showerror("Ошибка", f"Ошибка переселения:\n{e}")
+
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(fill=tk.X, pady=10)
+        ttk.Button(btn_frame, text="Переселить", command=resettle).pack(side=tk.LEFT, padx=20)
+        ttk.Button(btn_frame, text="Отмена", command=dialog.destroy).pack(side=tk.LEFT)
+
+    def open_snapshot_dialog(self):
+        # Локальный снимок участка или отдела: синхронизация и переключение чтения на снимок
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Снимок участка")
+        dialog.geometry("520x300")
+        dialog.transient(self.root)
+        dialog.grab_set()
+
+        ttk.Label(dialog, text="В снимок попадают дома, квартиры и жильцы выбранной части и все справочники.\n"
+                               "Со снимком работают только на чтение: таблицы и отчеты без обращения к серверу.").pack(
+            padx=10, pady=10)
+
+        scope_kinds = [('section', 'Участок', queries.SECTIONS_LIST_SQL),
+                       ('department', 'Отдел', queries.DEPARTMENTS_LIST_SQL)]
+        scope_items = []
+
+        row = ttk.Frame(dialog)
+        row.pack(fill=tk.X, padx=10, pady=5)
+        kind_combo = ttk.Combobox(row, values=[name for _, name, _ in scope_kinds], state="readonly", width=12)
+        kind_combo.current(0)
+        kind_combo.pack(side=tk.LEFT)
+        scope_combo = ttk.Combobox(row, state="readonly", width=35)
+        scope_combo.pack(side=tk.LEFT, padx=5)
+
+        status_var = tk.StringVar()
+        ttk.Label(dialog, textvariable=status_var, foreground="gray").pack(padx=10, pady=5, anchor=tk.W)
+
+        def update_status():
+            meta = self.snapshot_store.meta()
+            if 'synced_at' in meta:
+                status_var.set(f"Снимок: {meta['scope_name']}, обновлен {meta['synced_at'].replace('T', ' ')}")
+            else:
+                status_var.set("Снимок еще не создан")
+            mode_btn.config(text="Вернуться к серверу" if self.snapshot_active else "Работать со снимком")
+
+        def load_scopes(event=None):
+            # Списки участков и отделов берутся с сервера
+            scope_items.clear()
+            scope_combo.set("")
+            if not self.conn:
+                scope_combo['values'] = []
+                return
+            try:
+                cursor = self.conn.cursor()
+                self.statements.execute_sql(cursor, scope_kinds[kind_combo.current()][2])
+                scope_items.extend(cursor.fetchall())
+                cursor.close()
+            except Exception as e:
+                self.conn.rollback()
+                messagebox.showerror("Ошибка", f"Ошибка загрузки списка:\n{e}")
+            scope_combo['values'] = [name for _, name in scope_items]
+            if scope_items:
+                scope_combo.current(0)
+
+        kind_combo.bind("<<ComboboxSelected>>", load_scopes)
+
+        def sync():
+            if not self.conn:
+                self.show_toast("Нет подключения к БД", toast_type="warning")
+                return
+            if scope_combo.current() < 0:
+                self.show_toast("Выберите участок или отдел", toast_type="warning")
+                return
+            scope_kind, kind_name, _ = scope_kinds[kind_combo.current()]
+            scope_id, scope_name = scope_items[scope_combo.current()]
+            try:
+                with STATS.phase("snapshot:sync"), self.reading() as conn:
+                    stats = self.snapshot_store.sync(conn, scope_kind, scope_id, f"{kind_name} {scope_name}")
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Ошибка синхронизации снимка:\n{e}")
+                return
+            changed = sum(c for c, _ in stats.values())
+            deleted = sum(d for _, d in stats.values())
+            update_status()
+            self.update_snapshot_label()
+            self.show_toast(f"Снимок обновлен: загружено {changed}, удалено {deleted} строк", toast_type="success")
+            self.clear_fk_cache()
+            if self.snapshot_active:
+                self.load_data()
+
+        def toggle_mode():
+            if not self.snapshot_active and not self.snapshot_store.exists():
+                self.show_toast("Сначала создайте снимок", toast_type="warning")
+                return
+            self.snapshot_active = not self.snapshot_active
+            self.clear_fk_cache()
+            update_status()
+            self.update_snapshot_label()
+            if self.current_table:
+                self.load_data()
+
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(fill=tk.X, pady=10)
+        ttk.Button(btn_frame, text="Синхронизировать", command=sync).pack(side=tk.LEFT, padx=20)
+        mode_btn = ttk.Button(btn_frame, command=toggle_mode)
+        mode_btn.pack(side=tk.LEFT)
+        ttk.Button(btn_frame, text="Закрыть", command=dialog.destroy).pack(side=tk.RIGHT, padx=20)
+
+        load_scopes()
+        update_status()
+
+    def update_snapshot_label(self):
+        # Подпись режима снимка в панели действий
+        if self.snapshot_active:
+            self.snapshot_label_var.set(f"Снимок: {self.snapshot_store.meta().get('scope_name', '')}")
+        else:
+            self.snapshot_label_var.set("")
+
+    def open_diagnostics_panel(self):
+        # Панель диагностики: статистика запросов, фаз интерфейса и ошибок
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Диагностика")
+        dialog.geometry("1100x650")
+
+        notebook = ttk.Notebook(dialog)
+        notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        def make_tree(parent, columns):
+            frame = ttk.Frame(parent)
+            tree = ttk.Treeview(frame, columns=[c[0] for c in columns], show='headings')
+            for col, text, width in columns:
+                tree.heading(col, text=text)
+                tree.column(col, width=width, minwidth=40)
+            vsb = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
+            tree.configure(yscrollcommand=vsb.set)
+            tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            vsb.pack(side=tk.RIGHT, fill=tk.Y)
+            return frame, tree
+
+        queries_frame, queries_tree = make_tree(notebook, [
+            ('fingerprint', 'Отпечаток', 100), ('calls', 'Вызовов', 70), ('total_ms', 'Всего, мс', 90),
+            ('avg_ms', 'Среднее, мс', 90), ('max_ms', 'Макс., мс', 90), ('rows', 'Строк', 80),
+            ('errors', 'Ошибок', 60), ('sql', 'Запрос', 500)
+        ])
+        phases_frame, phases_tree = make_tree(notebook, [
+            ('phase', 'Фаза', 250), ('calls', 'Вызовов', 80), ('total_ms', 'Всего, мс', 100),
+            ('avg_ms', 'Среднее, мс', 100), ('max_ms', 'Макс., мс', 100), ('rows', 'Строк', 100)
+        ])
+        errors_frame, errors_tree = make_tree(notebook, [
+            ('time', 'Время', 80), ('fingerprint', 'Отпечаток', 100), ('error', 'Ошибка', 800)
+        ])
+        notebook.add(queries_frame, text="Запросы к БД")
+        notebook.add(phases_frame, text="Интерфейс")
+        notebook.add(errors_frame, text="Ошибки")
+
+        def refresh():
+            # Обновить таблицы статистики
+            for tree in (queries_tree, phases_tree, errors_tree):
+                tree.delete(*tree.get_children())
+            for e in STATS.query_snapshot():
+                queries_tree.insert('', tk.END, values=(
+                    e['fingerprint'], e['calls'], f"{e['total_ms']:.1f}", f"{e['total_ms'] / e['calls']:.2f}",
+                    f"{e['max_ms']:.1f}", e['rows'], e['errors'], e['sql']))
+            for e in STATS.phase_snapshot():
+                phases_tree.insert('', tk.END, values=(
+                    e['phase'], e['calls'], f"{e['total_ms']:.1f}", f"{e['total_ms'] / e['calls']:.2f}",
+                    f"{e['max_ms']:.1f}", e['rows']))
+            for err in reversed(STATS.error_snapshot()):
+                errors_tree.insert('', tk.END, values=err)
+
+        def reset():
+            STATS.reset()
+            refresh()
+
+        log_var = tk.BooleanVar(value=bool(STATS.log_path))
+
+        def toggle_log():
+            # Включить/выключить запись структурированного журнала
+            STATS.log_path = (PROFILE_LOG_PATH or QUERY_LOG_PATH) if log_var.get() else None
+            if STATS.log_path:
+                self.show_toast(f"Журнал запросов: {STATS.log_path}", toast_type="info")
+
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        ttk.Button(btn_frame, text="Обновить", command=refresh).pack(side=tk.LEFT, padx=2)
+        ttk.Button(btn_frame, text="Сбросить", command=reset).pack(side=tk.LEFT, padx=2)
+        ttk.Button(btn_frame, text="EXPLAIN текущего запроса",
+                   command=self.explain_current_view).pack(side=tk.LEFT, padx=2)
+        ttk.Checkbutton(btn_frame, text="Писать журнал (JSON Lines)", variable=log_var,
+                        command=toggle_log).pack(side=tk.LEFT, padx=10)
+        ttk.Button(btn_frame, text="Закрыть", command=dialog.destroy).pack(side=tk.RIGHT, padx=2)
+        refresh()
+
+    def explain_current_view(self):
+        # Снять план EXPLAIN (ANALYZE, BUFFERS) для запроса текущей таблицы
+        if not self.conn or not self.last_view_query:
+            self.show_toast("Нет запроса для анализа: откройте таблицу", toast_type="warning")
+            return
+        query, params = self.last_view_query
+        # План снимается там же, где выполняется загрузка таблицы (на реплике, если чтение идет с нее)
+        try:
+            with self.reading() as conn:
+                cursor = conn.cursor()
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, params)
+                plan = "\n".join(r[0] for r in cursor.fetchall())
+                cursor.close()
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Ошибка получения плана:\n{e}")
+            return
 
-        self.show_toast(f"Отчет сформирован: {len(data)} записей", toast_type="success")
+        win = tk.Toplevel(self.root)
+        win.title("План запроса")
+        win.geometry("900x500")
+        text = tk.Text(win, wrap=tk.NONE, font=('Consolas', 10))
+        vsb = ttk.Scrollbar(win, orient="vertical", command=text.yview)
+        text.configure(yscrollcommand=vsb.set)
+        vsb.pack(side=tk.RIGHT, fill=tk.Y)
+        text.pack(fill=tk.BOTH, expand=True)
+        text.insert('1.0', f"{query}\n\n{plan}")
+        text.configure(state='disabled')
 
 
 if __name__ == "__main__":
+    # Правила сравнения текста пользователя (локальная сортировка отчетов и номеров, resultstore.text_key)
+    try:
+        locale.setlocale(locale.LC_COLLATE, '')
+    except locale.Error:
+        pass
     root = tk.Tk()
     app = DatabaseApp(root)
     root.mainloop()
@@ -0,0 +1,472 @@
+# Бенчмарк запросов приложения на синтетическом жилфонде
+#
+# Создает базу из "схема бд.sql", заполняет ее детерминированными данными
+# (службы -> отделы -> участки -> дома -> квартиры -> жильцы, тарифы, шифры)
+# и замеряет те же запросы, что выполняет интерфейс. Результат - JSON,
+# который можно сравнить с предыдущим прогоном (--compare).
+#
+# Пример:
+#   python benchmark.py --scale 100k --repeat 5 --output bench_100k.json
+#   python benchmark.py --scale 100k --reuse --compare bench_100k.json
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+import queries
+from app import TABLES
+from config import DB_CONFIG
+from statements import StatementRegistry
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'схема бд.sql')
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+STREETS = ['Ленина', 'Мира', 'Советская', 'Гагарина', 'Пушкина', 'Садовая', 'Лесная', 'Школьная',
+           'Молодежная', 'Центральная', 'Новая', 'Набережная', 'Заводская', 'Кирова', 'Октябрьская',
+           'Комсомольская', 'Строителей', 'Победы', 'Луговая', 'Полевая', 'Чехова', 'Горького',
+           'Зеленая', 'Речная', 'Парковая', 'Спортивная', 'Солнечная', 'Трудовая', 'Фрунзе', 'Калинина']
+LAST_NAMES = ['Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Соколов',
+              'Михайлов', 'Новиков', 'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семенов',
+              'Егоров', 'Павлов', 'Козлов', 'Степанов', 'Николаев', 'Орлов', 'Андреев', 'Макаров']
+MALE_NAMES = ['Иван', 'Петр', 'Алексей', 'Сергей', 'Андрей', 'Дмитрий', 'Николай', 'Михаил', 'Владимир', 'Павел']
+FEMALE_NAMES = ['Анна', 'Мария', 'Елена', 'Ольга', 'Наталья', 'Татьяна', 'Ирина', 'Светлана', 'Юлия', 'Екатерина']
+PATRONYMICS = [('Иванович', 'Ивановна'), ('Петрович', 'Петровна'), ('Сергеевич', 'Сергеевна'),
+               ('Андреевич', 'Андреевна'), ('Николаевич', 'Николаевна'), ('Михайлович', 'Михайловна')]
+SERVICE_TYPES = ['maintenance', 'cold_water', 'hot_water', 'elevator', 'garbage_chute']
+
+COPY_CHUNK = 50_000
+
+
+def parse_scale(value):
+    # Масштаб: 10k/100k/1m или число жильцов
+    key = value.lower()
+    if key in SCALES:
+        return SCALES[key]
+    return int(value)
+
+
+def connect(args, dbname=None, connection_factory=None):
+    return psycopg2.connect(host=args.host, port=args.port, user=args.user, password=args.password,
+                            dbname=dbname or args.dbname, connection_factory=connection_factory)
+
+
+def create_database(args):
+    # Пересоздать базу бенчмарка и загрузить схему
+    admin = connect(args, 'postgres')
+    admin.autocommit = True
+    cursor = admin.cursor()
+    cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(args.dbname)))
+    cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(args.dbname)))
+    cursor.close()
+    admin.close()
+
+    conn = connect(args)
+    with open(SCHEMA_PATH, encoding='utf-8') as f:
+        schema_sql = f.read()
+    cursor = conn.cursor()
+    cursor.execute(schema_sql)
+    conn.commit()
+    cursor.close()
+    return conn
+
+
+def copy_rows(cursor, table, columns, rows):
+    # Загрузка строк через COPY порциями
+    def flush(buf):
+        buf.seek(0)
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+    buf = io.StringIO()
+    count = 0
+    for row in rows:
+        buf.write('\t'.join('\\N' if v is None else str(v) for v in row))
+        buf.write('\n')
+        count += 1
+        if count % COPY_CHUNK == 0:
+            flush(buf)
+            buf = io.StringIO()
+    if count % COPY_CHUNK:
+        flush(buf)
+    return count
+
+
+class FundGenerator:
+    # Детерминированный генератор жилфонда: идентификаторы совпадают с identity свежей базы
+
+    def __init__(self, tenants, seed=42, tenants_per_apartment=2.5, apartments_per_house=60,
+                 houses_per_section=25, sections_per_department=4, departments_per_service=4,
+                 moved_out_share=0.15):
+        self.rng = random.Random(seed)
+        self.tenants = tenants
+        self.apartments = max(1, math.ceil(tenants / tenants_per_apartment))
+        self.houses = max(1, math.ceil(self.apartments / apartments_per_house))
+        self.sections = max(1, math.ceil(self.houses / houses_per_section))
+        self.departments = max(1, math.ceil(self.sections / sections_per_department))
+        self.services = max(1, math.ceil(self.departments / departments_per_service))
+        self.moved_out_share = moved_out_share
+        self.payer_codes = 8
+        self.current_year = date.today().year
+
+    def counts(self):
+        return {'services': self.services, 'departments': self.departments, 'sections': self.sections,
+                'houses': self.houses, 'apartments': self.apartments, 'tenants': self.tenants,
+                'payer_codes': self.payer_codes}
+
+    def load(self, conn):
+        cursor = conn.cursor()
+        copy_rows(cursor, 'services', ['name', 'phone'],
+                  ((f"Служба {i}", f"+7 (495) {i:03d}-00-00") for i in range(1, self.services + 1)))
+        dept_service = {d: (d - 1) % self.services + 1 for d in range(1, self.departments + 1)}
+        copy_rows(cursor, 'departments', ['service_id', 'name', 'address', 'phone'],
+                  ((dept_service[d], f"Отдел {d}", f"ул. {STREETS[d % len(STREETS)]}, {d}", None)
+                   for d in dept_service))
+        section_dept = {s: (s - 1) % self.departments + 1 for s in range(1, self.sections + 1)}
+        copy_rows(cursor, 'sections', ['department_id', 'name', 'manager'],
+                  ((section_dept[s], f"Участок {s}", self.person_name()) for s in section_dept))
+        copy_rows(cursor, 'payer_codes', ['code', 'name', 'percent_share'],
+                  ((f"P{i:02d}", f"Льгота {i}", [100, 50, 30, 25, 0, 100, 70, 10][i - 1])
+                   for i in range(1, self.payer_codes + 1)))
+        copy_rows(cursor, 'tariffs', ['service_type', 'has_service', 'tariff', 'valid_from', 'valid_to'],
+                  self.tariff_rows())
+        copy_rows(cursor, 'houses', ['service_id', 'department_id', 'section_id', 'street', 'house_number',
+                                     'building', 'year_built'],
+                  self.house_rows(section_dept, dept_service))
+        copy_rows(cursor, 'apartments', ['house_id', 'apt_number', 'floor', 'living_area', 'total_area',
+                                         'privatized', 'cold_water', 'hot_water', 'garbage_chute', 'elevator'],
+                  self.apartment_rows())
+        copy_rows(cursor, 'tenants', ['apartment_id', 'full_name', 'inn', 'passport', 'birth_date',
+                                      'is_responsible', 'payer_code_id', 'moved_in', 'moved_out'],
+                  self.tenant_rows())
+        conn.commit()
+        conn.autocommit = True
+        cursor.execute("ANALYZE")
+        conn.autocommit = False
+        cursor.close()
+
+    def person_name(self):
+        rng = self.rng
+        male, female = rng.choice(PATRONYMICS)
+        if rng.random() < 0.5:
+            return f"{rng.choice(LAST_NAMES)} {rng.choice(MALE_NAMES)} {male}"
+        return f"{rng.choice(LAST_NAMES)}а {rng.choice(FEMALE_NAMES)} {female}"
+
+    def tariff_rows(self):
+        for service_type in SERVICE_TYPES:
+            for year in range(2015, self.current_year + 1):
+                valid_to = date(year, 12, 31) if year < self.current_year else None
+                yield (service_type, 't', round(self.rng.uniform(5, 250), 4), date(year, 1, 1), valid_to)
+
+    def house_rows(self, section_dept, dept_service):
+        for h in range(self.houses):
+            section_id = h % self.sections + 1
+            department_id = section_dept[section_id]
+            number = h // len(STREETS) + 1
+            building = str(self.rng.randint(1, 3)) if self.rng.random() < 0.1 else None
+            yield (dept_service[department_id], department_id, section_id, STREETS[h % len(STREETS)],
+                   str(number), building, self.rng.randint(1900, self.current_year))
+
+    def apartment_rows(self):
+        per_house = math.ceil(self.apartments / self.houses)
+        for a in range(self.apartments):
+            house_id = a // per_house + 1
+            apt_number = a % per_house + 1
+            total_area = round(self.rng.uniform(28, 120), 2)
+            living_area = round(total_area * self.rng.uniform(0.55, 0.8), 2)
+            amenities = self.rng.random()
+            yield (house_id, str(apt_number), (apt_number - 1) // 4 + 1, living_area, total_area,
+                   't' if self.rng.random() < 0.6 else 'f', 't', 't' if amenities < 0.9 else 'f',
+                   't' if amenities < 0.5 else 'f', 't' if amenities < 0.7 else 'f')
+
+    def tenant_rows(self):
+        rng = self.rng
+        base = date(1995, 1, 1)
+        # Дата вселения уникальна внутри квартиры (шаг = число жильцов на квартиру + номер слота),
+        # поэтому UNIQUE (apartment_id, full_name, moved_in) не нарушается
+        step = math.ceil(self.tenants / self.apartments)
+        span = (date.today() - base).days // step
+        slots = {}
+        for t in range(self.tenants):
+            apartment_id = t % self.apartments + 1
+            slot = slots.get(apartment_id, 0)
+            slots[apartment_id] = slot + 1
+            moved_in = base + timedelta(days=rng.randint(0, span - 1) * step + slot)
+            moved_out = None
+            if rng.random() < self.moved_out_share:
+                moved_out = moved_in + timedelta(days=rng.randint(30, 3000))
+                if moved_out > date.today():
+                    moved_out = date.today()
+            birth_date = date(rng.randint(1935, 2020), rng.randint(1, 12), rng.randint(1, 28))
+            inn = f"{770000000000 + t:012d}" if rng.random() < 0.7 else None
+            passport = f"{rng.randint(1000, 9999)} {rng.randint(100000, 999999)}"
+            payer_code_id = rng.randint(1, self.payer_codes) if rng.random() < 0.2 else None
+            yield (apartment_id, self.person_name(), inn, passport, birth_date,
+                   't' if slot == 0 else 'f', payer_code_id, moved_in, moved_out)
+
+
+def run_query(cursor, query, params, registry):
+    # Выполнить запрос напрямую или через реестр подготовленных запросов (--prepared)
+    if registry:
+        registry.execute_sql(cursor, query, params)
+    else:
+        cursor.execute(query, params if params else None)
+
+
+def read_case(query, params=None, registry=None):
+    # Чтение так же, как в интерфейсе: execute + fetchall
+    def run(conn):
+        cursor = conn.cursor()
+        run_query(cursor, query, params, registry)
+        rows = cursor.fetchall()
+        cursor.close()
+        return len(rows)
+    return run
+
+
+def table_case(table, current_filter=None, sort_column=None, sort_reverse=False, registry=None, as_of=None,
+               include_archive=False):
+    # Загрузка таблицы, как load_data
+    if registry:
+        def run(conn):
+            cursor = conn.cursor()
+            statement, params = registry.table_statement(table, current_filter, sort_column, sort_reverse, as_of,
+                                                         include_archive)
+            registry.execute(cursor, statement, params)
+            rows = cursor.fetchall()
+            cursor.close()
+            return len(rows)
+        return run
+    return read_case(*queries.build_table_query(table, current_filter, sort_column, sort_reverse,
+                                                 TABLES[table]['columns'], as_of, include_archive))
+
+
+def report_case(builder, *args, registry=None):
+    # Отчет: запрос строк и запрос итогов, как в generate_report
+    query, totals_query, params = builder(*args)
+
+    def run(conn):
+        cursor = conn.cursor()
+        run_query(cursor, query, params, registry)
+        rows = cursor.fetchall()
+        run_query(cursor, totals_query, params, registry)
+        cursor.fetchall()
+        cursor.close()
+        return len(rows)
+    return run
+
+
+def write_case(func):
+    # Запись выполняется в транзакции и откатывается, чтобы данные не менялись между прогонами
+    def run(conn):
+        cursor = conn.cursor()
+        try:
+            return func(cursor)
+        finally:
+            cursor.close()
+    return run
+
+
+def build_workload(conn, gen, registry=None):
+    # Набор замеров: те же пути, что load_data/search_records/apply_filter/отчеты/запись
+    cases = {}
+    for table in ['services', 'departments', 'sections', 'houses', 'apartments', 'tenants', 'payer_codes', 'tariffs']:
+        cases[f'load_data:{table}'] = table_case(table, registry=registry)
+    cases['load_data:tenants:sort_full_name_desc'] = table_case('tenants', None, 'full_name', True, registry)
+    cases['search_records:tenants.full_name'] = table_case('tenants', ('full_name', 'LIKE', 'Иван'),
+                                                           registry=registry)
+    cases['search_records:houses.street'] = table_case('houses', ('street', 'LIKE', 'Ленин'), registry=registry)
+    cases['apply_filter:apartments.total_area>60'] = table_case('apartments', ('total_area', '>', '60'),
+                                                                registry=registry)
+    cases['apply_filter:tenants.moved_out_is_null'] = table_case('tenants', ('moved_out', 'IS NULL', ''),
+                                                                 registry=registry)
+    cases['apply_filter:houses.year_built>=1980'] = table_case('houses', ('year_built', '>=', '1980'),
+                                                               registry=registry)
+    cases['apply_filter:tenants.apartment_id='] = table_case(
+        'tenants', ('apartment_id', '=', str(gen.apartments // 2 or 1)), registry=registry)
+    # Срез внутри периода генерации истории проживания (с 1995 года)
+    as_of = date(2010, 6, 1)
+    cases['as_of:tenants'] = table_case('tenants', registry=registry, as_of=as_of)
+    cases['as_of:tenants:with_archive'] = table_case('tenants', registry=registry, as_of=as_of, include_archive=True)
+    cases['load_data:tenants:with_archive'] = table_case('tenants', registry=registry, include_archive=True)
+    cases['get_houses_list'] = read_case(queries.HOUSES_LIST_SQL, registry=registry)
+    cases['global_search:tenant_street'] = read_case(*queries.build_search_query('Иван Ленин', 50), registry=registry)
+    cases['global_search:street'] = read_case(*queries.build_search_query('Ленина', 50), registry=registry)
+
+    def report(builder, *args):
+        return report_case(builder, *args, registry=registry)
+
+    cases['report_rent:all'] = report(queries.build_rent_report, None, None, 0, 'ASC')
+    cases['report_rent:street'] = report(queries.build_rent_report, None, 'Ленин', 3, 'DESC')
+    cases['report_rent:house'] = report(queries.build_rent_report, gen.houses // 2 or 1, None, 0, 'ASC')
+    cases['report_tenants_by_section:all'] = report(queries.build_tenants_report, None, True, True, 0, 'ASC')
+    cases['report_tenants_by_section:one'] = report(queries.build_tenants_report, 1, True, True, 3, 'DESC')
+    cases['report_tenants_by_section:history'] = report(queries.build_tenants_report, None, False, False, 1, 'ASC')
+    cases['report_tenants_by_section:as_of'] = report(queries.build_tenants_report, None, True, True, 0, 'ASC',
+                                                      as_of)
+    for group_idx, group in enumerate(['services', 'departments', 'sections']):
+        cases[f'report_housing_stats:{group}'] = report(queries.build_housing_stats_report, group_idx,
+                                                        None, None, 0, 'ASC')
+    cases['report_housing_stats:sections_1960_1990'] = report(queries.build_housing_stats_report, 2,
+                                                              '1960', '1990', 3, 'DESC')
+    cases['report_housing_stats:local_detail'] = read_case(*queries.build_housing_detail_report(),
+                                                           registry=registry)
+
+    apartment_ids = list(range(1, min(gen.apartments, 100) + 1))
+
+    def insert_tenants(cursor):
+        rows = [(apartment_ids[i % len(apartment_ids)], f"Бенчмарк Жилец {i}", None, None, False, date.today())
+                for i in range(100)]
+        execute_values(cursor, queries.INSERT_TENANTS_SQL, rows,
+                       template=queries.INSERT_TENANTS_TEMPLATE, page_size=len(rows))
+        return len(rows)
+
+    def move_out_tenants(cursor):
+        # Как save_record: по одному UPDATE на жильца, каждый запускает триггеры счетчиков
+        cursor.execute("SELECT tenant_id FROM tenants WHERE moved_out IS NULL ORDER BY tenant_id LIMIT 100")
+        ids = [r[0] for r in cursor.fetchall()]
+        for tenant_id in ids:
+            cursor.execute("UPDATE tenants SET moved_out = %s WHERE tenant_id = %s", (date.today(), tenant_id))
+        return len(ids)
+
+    def delete_tenants(cursor):
+        # Как delete_record: по одному DELETE на жильца
+        cursor.execute("SELECT tenant_id FROM tenants WHERE moved_out IS NULL ORDER BY tenant_id DESC LIMIT 100")
+        ids = [r[0] for r in cursor.fetchall()]
+        for tenant_id in ids:
+            cursor.execute("DELETE FROM tenants WHERE tenant_id = %s", (tenant_id,))
+        return len(ids)
+
+    cases['write:insert_tenants_batch_100'] = write_case(insert_tenants)
+    cases['write:move_out_100'] = write_case(move_out_tenants)
+    cases['write:delete_100'] = write_case(delete_tenants)
+    return cases
+
+
+def run_case(conn, func, repeat, warmup):
+    # Замер одного сценария: прогрев + repeat повторов
+    timings = []
+    rows = 0
+    for i in range(warmup + repeat):
+        start = time.perf_counter()
+        rows = func(conn)
+        elapsed = (time.perf_counter() - start) * 1000
+        conn.rollback()
+        if i >= warmup:
+            timings.append(elapsed)
+    timings.sort()
+    p95_index = min(len(timings) - 1, math.ceil(len(timings) * 0.95) - 1)
+    return {
+        'rows': rows,
+        'runs': len(timings),
+        'min_ms': round(timings[0], 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p95_ms': round(timings[p95_index], 3),
+        'max_ms': round(timings[-1], 3)
+    }
+
+
+def compare(results, baseline_path):
+    # Сравнение медиан с предыдущим прогоном
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline['meta'].get('tenants') != results['meta']['tenants']:
+        print("Внимание: масштаб прогонов различается", file=sys.stderr)
+    print(f"{'Сценарий':55} {'было, мс':>12} {'стало, мс':>12} {'ускорение':>10}")
+    for name, current in results['results'].items():
+        old = baseline['results'].get(name)
+        if not old:
+            print(f"{name:55} {'-':>12} {current['median_ms']:>12.2f} {'-':>10}")
+            continue
+        speedup = old['median_ms'] / current['median_ms'] if current['median_ms'] else float('inf')
+        print(f"{name:55} {old['median_ms']:>12.2f} {current['median_ms']:>12.2f} {speedup:>9.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк запросов ГЖУ на синтетическом жилфонде")
+    parser.add_argument('--host', default=DB_CONFIG['host'])
+    parser.add_argument('--port', type=int, default=DB_CONFIG['port'])
+    parser.add_argument('--user', default=DB_CONFIG['user'])
+    parser.add_argument('--password', default=DB_CONFIG['password'])
+    parser.add_argument('--dbname', default='gomozov_bench', help="база бенчмарка (пересоздается)")
+    parser.add_argument('--scale', default='10k', help="10k, 100k, 1m или число жильцов")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--prepared', action='store_true', help="выполнять чтения через PREPARE/EXECUTE")
+    parser.add_argument('--only', default=None, help="выполнить только сценарии с этой подстрокой")
+    parser.add_argument('--reuse', action='store_true', help="не пересоздавать базу, использовать существующие данные")
+    parser.add_argument('--output', default=None, help="файл результатов JSON")
+    parser.add_argument('--compare', default=None, help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+
+    tenants = parse_scale(args.scale)
+    gen = FundGenerator(tenants, seed=args.seed)
+
+    load_seconds = None
+    if args.reuse:
+        conn = connect(args)
+    else:
+        start = time.perf_counter()
+        conn = create_database(args)
+        gen.load(conn)
+        load_seconds = round(time.perf_counter() - start, 2)
+        print(f"Данные сгенерированы за {load_seconds} с: {gen.counts()}", file=sys.stderr)
+
+    cursor = conn.cursor()
+    cursor.execute("SHOW server_version")
+    server_version = cursor.fetchone()[0]
+    cursor.close()
+    conn.rollback()
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'scale': args.scale,
+            'tenants': tenants,
+            'seed': args.seed,
+            'counts': gen.counts(),
+            'repeat': args.repeat,
+            'prepared': args.prepared,
+            'warmup': args.warmup,
+            'load_seconds': load_seconds,
+            'server_version': server_version,
+            'python': platform.python_version(),
+            'platform': platform.platform()
+        },
+        'results': {}
+    }
+
+    registry = StatementRegistry(TABLES) if args.prepared else None
+    for name, func in build_workload(conn, gen, registry).items():
+        if args.only and args.only not in name:
+            continue
+        results['results'][name] = run_case(conn, func, args.repeat, args.warmup)
+        r = results['results'][name]
+        print(f"{name:55} median {r['median_ms']:>10.2f} мс  rows {r['rows']}", file=sys.stderr)
+    conn.close()
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
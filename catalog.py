@@ -0,0 +1,186 @@
+# Метаданные таблиц из каталога PostgreSQL: порядок и типы колонок, NULL, ключи, ссылки, ограничения
+# и комментарии (подписи в интерфейсе). Хранятся в файле вместе с отпечатком схемы: при подключении
+# выполняется один запрос отпечатка, каталог перечитывается только после изменения схемы
+import json
+import os
+
+# Отпечаток схемы таблиц приложения: колонки, ограничения и комментарии (md5 по каталогу)
+SCHEMA_HASH_SQL = """
+    SELECT md5(string_agg(item, '|' ORDER BY item)) FROM (
+        SELECT c.relname || ':' || COALESCE(obj_description(c.oid, 'pg_class'), '') AS item
+        FROM pg_class c
+        WHERE c.relnamespace = current_schema()::regnamespace AND c.relname = ANY(%s)
+        UNION ALL
+        SELECT c.relname || '.' || a.attnum::text || '.' || a.attname || ':' || format_type(a.atttypid, a.atttypmod)
+               || ':' || a.attnotnull::text || ':' || a.atthasdef::text || ':' || a.attidentity::text
+               || ':' || a.attgenerated::text || ':' || COALESCE(col_description(c.oid, a.attnum), '')
+        FROM pg_class c
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        WHERE c.relnamespace = current_schema()::regnamespace AND c.relname = ANY(%s)
+        UNION ALL
+        SELECT c.relname || '#' || con.conname || ':' || pg_get_constraintdef(con.oid)
+        FROM pg_constraint con
+        JOIN pg_class c ON c.oid = con.conrelid
+        WHERE c.relnamespace = current_schema()::regnamespace AND c.relname = ANY(%s)
+        UNION ALL
+        SELECT c.relname || '!' || pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indrelid
+        WHERE c.relnamespace = current_schema()::regnamespace AND c.relname = ANY(%s) AND i.indisunique
+    ) items
+"""
+
+# Колонки в порядке таблицы: тип, допускает ли NULL, заполняется ли сервером (DEFAULT, IDENTITY, GENERATED),
+# генерируемая ли, точность, длина и комментарий
+COLUMNS_SQL = """
+    SELECT c.table_name, c.column_name, c.data_type, c.is_nullable = 'YES',
+           c.column_default IS NOT NULL OR c.is_identity = 'YES' OR c.is_generated = 'ALWAYS',
+           c.is_generated = 'ALWAYS',
+           c.numeric_precision, c.numeric_scale, c.character_maximum_length,
+           col_description(quote_ident(c.table_name)::regclass, c.ordinal_position)
+    FROM information_schema.columns c
+    WHERE c.table_schema = current_schema() AND c.table_name = ANY(%s)
+    ORDER BY c.table_name, c.ordinal_position
+"""
+
+# Ограничения: первичный ключ, CHECK, UNIQUE, внешние ключи (колонки в порядке ограничения)
+CONSTRAINTS_SQL = """
+    SELECT cl.relname, con.conname, con.contype,
+           ARRAY(SELECT a.attname FROM unnest(con.conkey) WITH ORDINALITY AS k(attnum, n)
+                 JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum ORDER BY k.n),
+           ref.relname,
+           ARRAY(SELECT a.attname FROM unnest(con.confkey) WITH ORDINALITY AS k(attnum, n)
+                 JOIN pg_attribute a ON a.attrelid = con.confrelid AND a.attnum = k.attnum ORDER BY k.n),
+           pg_get_constraintdef(con.oid)
+    FROM pg_constraint con
+    JOIN pg_class cl ON cl.oid = con.conrelid
+    LEFT JOIN pg_class ref ON ref.oid = con.confrelid
+    WHERE cl.relnamespace = current_schema()::regnamespace AND cl.relname = ANY(%s)
+      AND con.contype IN ('p', 'c', 'u', 'f')
+    ORDER BY cl.relname, con.conname
+"""
+
+# Уникальные индексы, не оформленные ограничением (частичные: уникальность среди строк с условием WHERE);
+# индексы по выражениям не читаются - их проверяет сервер
+UNIQUE_INDEXES_SQL = """
+    SELECT cl.relname, ic.relname,
+           ARRAY(SELECT a.attname FROM unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, n)
+                 JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                 WHERE k.n <= i.indnkeyatts ORDER BY k.n),
+           pg_get_expr(i.indpred, i.indrelid)
+    FROM pg_index i
+    JOIN pg_class cl ON cl.oid = i.indrelid
+    JOIN pg_class ic ON ic.oid = i.indexrelid
+    WHERE cl.relnamespace = current_schema()::regnamespace AND cl.relname = ANY(%s)
+      AND i.indisunique AND NOT i.indisprimary AND i.indexprs IS NULL
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint con
+                      WHERE con.conrelid = i.indrelid AND con.conindid = i.indexrelid)
+    ORDER BY cl.relname, ic.relname
+"""
+
+TABLE_COMMENTS_SQL = """
+    SELECT relname, obj_description(oid, 'pg_class') FROM pg_class
+    WHERE relnamespace = current_schema()::regnamespace AND relname = ANY(%s)
+"""
+
+
+def read_catalog(cursor, tables):
+    # Метаданные таблиц: {'tables': {таблица: {comment, columns, pk, checks, uniques, foreign}}}
+    # uniques - ограничения UNIQUE и уникальные индексы; where - условие частичного индекса (или None)
+    described = {table: {'comment': None, 'columns': [], 'pk': [], 'checks': [], 'uniques': [], 'foreign': []}
+                 for table in tables}
+    cursor.execute(TABLE_COMMENTS_SQL, (list(tables),))
+    for table, comment in cursor.fetchall():
+        described[table]['comment'] = comment
+    cursor.execute(COLUMNS_SQL, (list(tables),))
+    for table, name, data_type, nullable, server_default, generated, precision, scale, max_length, comment \
+            in cursor.fetchall():
+        described[table]['columns'].append({
+            'name': name, 'type': data_type, 'nullable': nullable, 'server_default': server_default,
+            'generated': generated, 'precision': precision, 'scale': scale, 'max_length': max_length,
+            'comment': comment
+        })
+    cursor.execute(CONSTRAINTS_SQL, (list(tables),))
+    for table, name, kind, columns, ref_table, ref_columns, definition in cursor.fetchall():
+        info = described[table]
+        if kind == 'p':
+            info['pk'] = list(columns)
+        elif kind == 'u':
+            info['uniques'].append({'name': name, 'columns': list(columns), 'where': None})
+        elif kind == 'f':
+            info['foreign'].append({'name': name, 'columns': list(columns), 'ref_table': ref_table,
+                                    'ref_columns': list(ref_columns)})
+        else:
+            info['checks'].append({'name': name, 'columns': list(columns), 'definition': definition})
+    cursor.execute(UNIQUE_INDEXES_SQL, (list(tables),))
+    for table, name, columns, where in cursor.fetchall():
+        described[table]['uniques'].append({'name': name, 'columns': list(columns), 'where': where})
+    return {'tables': {table: info for table, info in described.items() if info['columns']}}
+
+
+def apply_to_tables(tables, meta):
+    # Метаданные поверх описания TABLES: колонки в порядке таблицы, подписи из комментариев, ключ,
+    # типы (types) и ссылки (foreign: колонка -> таблица). Генерируемые колонки (ключи сортировки,
+    # период проживания) не показываются; редактируемыми остаются поля из TABLES, которые есть в таблице
+    for table, info in tables.items():
+        described = meta['tables'].get(table)
+        if not described:
+            continue
+        labels = dict(zip(info['columns'], info['column_names']))
+        columns = [col for col in described['columns'] if not col['generated']]
+        info['columns'] = [col['name'] for col in columns]
+        info['column_names'] = [col['comment'] or labels.get(col['name'], col['name']) for col in columns]
+        info['name'] = described['comment'] or info['name']
+        if len(described['pk']) == 1:
+            info['pk'] = described['pk'][0]
+        info['editable'] = [col for col in info['editable'] if col in info['columns']]
+        info['types'] = {col['name']: col['type'] for col in columns}
+        info['foreign'] = {fk['columns'][0]: fk['ref_table'] for fk in described['foreign'] if len(fk['columns']) == 1}
+
+
+class SchemaCatalog:
+    # Файл метаданных: {'database': ..., 'hash': отпечаток схемы, 'meta': метаданные}
+
+    def __init__(self, path, tables, database):
+        self.path = path
+        self.tables = list(tables)
+        self.database = database
+        self.hash = None
+        self.meta = None
+
+    def load_cached(self):
+        # Метаданные из файла (для той же базы) или None; запрос к серверу не нужен
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('database') != self.database or set(data.get('meta', {}).get('tables', {})) - set(self.tables):
+            return None
+        self.hash, self.meta = data.get('hash'), data.get('meta')
+        return self.meta
+
+    def refresh(self, conn):
+        # Сверить отпечаток схемы и при изменении перечитать каталог; True - метаданные изменились
+        cursor = conn.cursor()
+        try:
+            cursor.execute(SCHEMA_HASH_SQL, (self.tables, self.tables, self.tables, self.tables))
+            digest = cursor.fetchone()[0]
+            if self.meta is not None and digest == self.hash:
+                return False
+            meta = read_catalog(cursor, self.tables)
+        finally:
+            cursor.close()
+            conn.rollback()
+        self.hash, self.meta = digest, meta
+        self.save()
+        return True
+
+    def save(self):
+        try:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'database': self.database, 'hash': self.hash, 'meta': self.meta}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
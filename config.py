@@ -1,3 +1,5 @@
+import os
+
 DB_CONFIG = {
     'host': 'localhost',
     'port': 5432,
@@ -5,3 +7,86 @@ DB_CONFIG = {
     'user': 'postgres',
     'password': '1hmnxt'
 }
+
+# Сервер для чтения (реплика потоковой репликации): отчеты, выгрузки и загрузка таблиц идут на него,
+# запись - на DB_CONFIG. None - все запросы на DB_CONFIG. Например, реплика на том же компьютере:
+# READ_DB_CONFIG = dict(DB_CONFIG, port=5433)
+READ_DB_CONFIG = None
+
+# Допустимое отставание реплики, с (None - не проверять); при большем отставании чтение идет с основного сервера
+READ_MAX_LAG_S = 30
+
+# Как часто проверять отставание реплики, с
+READ_LAG_CHECK_S = 10
+
+# Журнал запросов в формате JSON Lines (None - не писать)
+PROFILE_LOG_PATH = None
+
+# Файл журнала, включаемого в окне профилирования, если PROFILE_LOG_PATH не задан
+QUERY_LOG_PATH = os.path.join(os.path.expanduser('~'), '.gzhu_query_log.jsonl')
+
+# Файл состояния интерфейса (последняя таблица и ее первая страница для быстрого запуска)
+STATE_PATH = os.path.join(os.path.expanduser('~'), '.gzhu_state.json')
+
+# Целевое время до готовности окна к работе, мс
+STARTUP_TARGET_MS = 500
+
+# Порог числа домов, до которого "Статистика жилфонда" загружается построчно и перегруппировывается в клиенте;
+# выше порога группировка выполняется на сервере
+REPORT_LOCAL_MAX_ROWS = 200000
+
+# Предварительная оценка результата: до PREFLIGHT_FULL_ROWS строк таблица загружается целиком, больше - потоком,
+# начиная с PREFLIGHT_WARN_ROWS спрашивается подтверждение (иначе показываются первые PREFLIGHT_PAGE_ROWS строк)
+PREFLIGHT_FULL_ROWS = 50000
+PREFLIGHT_WARN_ROWS = 1000000
+PREFLIGHT_PAGE_ROWS = 10000
+
+# Параметры сервера на время операции: загрузка таблиц ограничена по времени,
+# отчетам дается больше памяти для сортировок и группировок, подсказки должны отвечать быстро
+QUERY_PROFILES = {
+    'grid': {'statement_timeout': '30s', 'work_mem': '16MB'},
+    'report': {'statement_timeout': '10min', 'work_mem': '128MB'},
+    'lookup': {'statement_timeout': '3s', 'work_mem': '4MB'},
+}
+
+# Сколько значений (строк x колонок) результата держать в памяти; больше - колонки переносятся
+# во временные файлы, отображаемые в память
+SPILL_CELLS = 5000000
+
+# Сколько строк отчета получать с сервера за раз при потоковом показе
+REPORT_CHUNK_ROWS = 2000
+
+# Подсказки ссылочных полей: записей в подсказке, пауза после ввода, сколько последних поисков помнить
+FK_SEARCH_LIMIT = 30
+FK_SEARCH_DELAY_MS = 250
+FK_CACHE_SIZE = 200
+
+# Глобальный поиск: сколько записей показывать в каждой группе (жильцы, дома, участки, отделы)
+GLOBAL_SEARCH_LIMIT = 50
+
+# Число соединений асинхронного слоя чтения (psycopg 3), на которых параллельно выполняются операции
+ASYNC_POOL_SIZE = 2
+
+# Локальная очередь изменений на время недоступности БД (SQLite)
+OFFLINE_QUEUE_PATH = os.path.join(os.path.expanduser('~'), '.gzhu_offline.sqlite3')
+
+# Интервал попыток переподключения без связи, мс
+RECONNECT_INTERVAL_MS = 5000
+
+# Число отложенных изменений, отправляемых одной транзакцией
+REPLAY_BATCH_SIZE = 200
+
+# Файл локального снимка участка/отдела (SQLite) для работы только на чтение
+SNAPSHOT_PATH = os.path.join(os.path.expanduser('~'), '.gzhu_snapshot.sqlite3')
+
+# Кэш результатов отчетов (SQLite): отчет отдается из кэша, пока не изменились таблицы, из которых он строится
+# (версии в data_versions); при превышении размера удаляются давно не использованные результаты
+REPORT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.gzhu_report_cache.sqlite3')
+REPORT_CACHE_MAX_MB = 200
+
+# Результаты длиннее этого числа строк в кэш не сохраняются
+REPORT_CACHE_MAX_ROWS = 200000
+
+# Метаданные таблиц из каталога БД (колонки, типы, ключи, комментарии) с отпечатком схемы;
+# при подключении каталог перечитывается, только если схема изменилась
+CATALOG_PATH = os.path.join(os.path.expanduser('~'), '.gzhu_catalog.json')
@@ -0,0 +1,137 @@
+# Асинхронный слой доступа к данным: свой цикл asyncio в фоновом потоке и асинхронные соединения psycopg 3
+# Независимые запросы одной операции (строки и итоги отчета, списки выбора формы) отправляются
+# одним конвейером (pipeline mode) за один обмен с сервером; разные операции идут на разных соединениях.
+# Результаты передаются в поток Tk через потокобезопасную очередь и разбираются по таймеру (dispatch)
+import asyncio
+import queue
+import threading
+import time
+
+try:
+    import psycopg
+    from psycopg.conninfo import make_conninfo
+except ImportError:
+    psycopg = None
+
+import preflight
+from profiling import STATS
+
+
+def conninfo(config):
+    # Строка подключения libpq из DB_CONFIG: ключ psycopg2 'database' в libpq называется 'dbname'
+    params = dict(config)
+    if 'database' in params:
+        params['dbname'] = params.pop('database')
+    return make_conninfo(**params)
+
+
+class AsyncDataLayer:
+    # Чтение через psycopg 3 без блокировки окна; без пакета psycopg слой недоступен (available() -> False)
+
+    def __init__(self, config, pool_size=2):
+        self.config = config
+        self.pool_size = pool_size
+        self.loop = None
+        self.pool = None
+        self.opened = 0
+        self.results = queue.Queue()
+        self.pending = 0
+        # Соединение открыть не удалось: чтение переходит на psycopg2 (usable() -> False)
+        self.connect_failed = False
+
+    @staticmethod
+    def available():
+        return psycopg is not None
+
+    def usable(self):
+        return not self.connect_failed
+
+    def start(self):
+        # Запуск цикла событий в фоновом потоке (один раз); psycopg 3 не работает с ProactorEventLoop,
+        # который new_event_loop() создает в Windows, поэтому цикл создается явно на селекторе
+        if self.loop is None:
+            self.loop = asyncio.SelectorEventLoop()
+            threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    async def _acquire(self):
+        # Соединение из пула; новые открываются по мере надобности, но не больше pool_size
+        if self.pool is None:
+            self.pool = asyncio.Queue()
+        if self.pool.empty() and self.opened < self.pool_size:
+            self.opened += 1
+            try:
+                return await psycopg.AsyncConnection.connect(conninfo(self.config), autocommit=True)
+            except Exception:
+                self.opened -= 1
+                self.connect_failed = True
+                raise
+        return await self.pool.get()
+
+    def _release(self, conn):
+        if conn.closed:
+            self.opened -= 1
+        else:
+            self.pool.put_nowait(conn)
+
+    async def _fetch_all(self, requests, profile=None):
+        # Все запросы отправляются конвейером, затем читаются результаты: [строки запроса 1, ...]
+        # profile - профиль параметров сервера, устанавливается тем же конвейером перед запросами
+        # Запросы идут одной транзакцией: параметры профиля (set_config ... local) действуют только до ее конца
+        # и не достаются следующей операции на том же соединении пула
+        conn = await self._acquire()
+        try:
+            start = time.perf_counter()
+            async with conn.pipeline():
+                async with conn.transaction():
+                    if profile:
+                        await conn.execute(*preflight.profile_statement(profile))
+                    cursors = [await conn.execute(sql, params or None) for sql, params in requests]
+            results = []
+            for (sql, _), cursor in zip(requests, cursors):
+                rows = await cursor.fetchall()
+                STATS.record_query(sql, time.perf_counter() - start, len(rows))
+                results.append(rows)
+            return results
+        except Exception as e:
+            STATS.record_query(requests[0][0], time.perf_counter() - start, None, e)
+            raise
+        finally:
+            self._release(conn)
+
+    def submit(self, requests, callback, errback=None, profile=None):
+        # Выполнить независимые запросы [(sql, params)] одновременно; callback(results) вызывается в потоке Tk
+        self.start()
+        self.pending += 1
+        future = asyncio.run_coroutine_threadsafe(self._fetch_all(requests, profile), self.loop)
+        future.add_done_callback(lambda f: self.results.put((callback, errback, f)))
+
+    def dispatch(self):
+        # Вызвать обратные вызовы готовых операций (из потока Tk); возвращает, остались ли незавершенные
+        while True:
+            try:
+                callback, errback, future = self.results.get_nowait()
+            except queue.Empty:
+                return self.pending > 0
+            self.pending -= 1
+            try:
+                result = future.result()
+            except Exception as e:
+                if errback:
+                    errback(e)
+                continue
+            callback(result)
+
+    def close(self):
+        # Закрыть соединения и остановить цикл
+        if self.loop is None:
+            return
+
+        async def shutdown():
+            while self.pool is not None and not self.pool.empty():
+                await (await self.pool.get()).close()
+
+        try:
+            asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(timeout=2)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,214 @@
+# Советчик индексов по нагрузке бенчмарка
+#
+# Снимает тексты запросов, которые выполняют сценарии чтения benchmark.py (те же, что в интерфейсе),
+# и для каждого индекса-кандидата сравнивает планы этих запросов с индексом и без него.
+# Недостающий индекс создается, а существующий удаляется внутри транзакции, которая затем
+# откатывается, поэтому оценка базу не меняет. С --apply отобранные индексы создаются.
+#
+# Пример:
+#   python benchmark.py --scale 100k --output bench_100k.json
+#   python index_advisor.py --scale 100k --show-plans
+#   python index_advisor.py --scale 100k --apply
+import argparse
+import json
+import re
+import sys
+
+from psycopg2.extras import LoggingConnection
+
+from benchmark import FundGenerator, build_workload, connect, parse_scale
+from config import DB_CONFIG
+
+# Индексы-кандидаты для путей соединения отчетов: (имя, DDL)
+# INCLUDE-колонки - те, что отчеты читают из таблицы, чтобы соединение шло через index-only scan
+CANDIDATES = [
+    ('idx_apartments_house_cover',
+     "CREATE INDEX idx_apartments_house_cover ON apartments(house_id, apt_number_num, apt_number_suffix) "
+     "INCLUDE (apartment_id, apt_number, total_area, current_residents, cold_water, hot_water, elevator)"),
+    ('idx_tenants_active_cover',
+     "CREATE INDEX idx_tenants_active_cover ON tenants(apartment_id) "
+     "INCLUDE (full_name, birth_date, passport) WHERE moved_out IS NULL"),
+    ('idx_tenants_active_birth',
+     "CREATE INDEX idx_tenants_active_birth ON tenants(birth_date) "
+     "INCLUDE (apartment_id, full_name, passport) WHERE moved_out IS NULL"),
+    ('idx_houses_street_natural',
+     "CREATE INDEX idx_houses_street_natural ON houses(street, house_number_num, house_number_suffix, building) "
+     "INCLUDE (house_id, house_number)"),
+    ('idx_houses_section_cover',
+     "CREATE INDEX idx_houses_section_cover ON houses(section_id) "
+     "INCLUDE (house_id, street, house_number, building)"),
+    ('idx_houses_year_built',
+     "CREATE INDEX idx_houses_year_built ON houses(year_built) "
+     "INCLUDE (house_id, service_id, department_id, section_id)"),
+]
+
+# Таблицы, для которых перед оценкой обновляется карта видимости (без нее index-only scan не выбирается)
+VACUUM_TABLES = ['services', 'departments', 'sections', 'houses', 'apartments', 'tenants']
+
+# Минимальное снижение стоимости запроса, при котором индекс считается полезным
+MIN_GAIN = 0.10
+
+_COST_RE = re.compile(r'cost=[\d.]+\.\.([\d.]+)')
+
+
+class QueryLog:
+    # Приемник LoggingConnection: текст запроса -> сценарий, в котором он впервые выполнен
+    def __init__(self):
+        self.queries = {}
+        self.case = None
+
+    def write(self, text):
+        text = text.strip()
+        if text and text not in self.queries:
+            self.queries[text] = self.case
+
+
+def capture_workload(args):
+    # Тексты запросов сценариев чтения (с подставленными параметрами)
+    log = QueryLog()
+    conn = connect(args, connection_factory=LoggingConnection)
+    conn.initialize(log)
+    gen = FundGenerator(parse_scale(args.scale), seed=args.seed)
+    for name, func in build_workload(conn, gen).items():
+        if name.startswith('write:') or (args.only and args.only not in name):
+            continue
+        log.case = name
+        func(conn)
+        conn.rollback()
+    conn.close()
+    return log.queries
+
+
+def explain(cursor, query, analyze=False):
+    # План запроса: (полная стоимость, строки плана)
+    cursor.execute(("EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN ") + query)
+    lines = [r[0] for r in cursor.fetchall()]
+    return float(_COST_RE.search(lines[0]).group(1)), lines
+
+
+def explain_all(conn, queries, analyze=False):
+    cursor = conn.cursor()
+    try:
+        return {query: explain(cursor, query, analyze) for query in queries}
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+def existing_indexes(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()")
+    names = {r[0] for r in cursor.fetchall()}
+    cursor.close()
+    conn.rollback()
+    return names
+
+
+def evaluate(conn, queries, baseline, name, ddl, exists, analyze=False):
+    # Планы без индекса и с ним: недостающий индекс создается, существующий удаляется, затем откат
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DROP INDEX {name}" if exists else ddl)
+        what_if = {query: explain(cursor, query, analyze) for query in queries}
+    finally:
+        cursor.close()
+        conn.rollback()
+    without, with_index = (what_if, baseline) if exists else (baseline, what_if)
+
+    improved = []
+    for query in queries:
+        before, after = without[query][0], with_index[query][0]
+        if after < before * (1 - MIN_GAIN):
+            index_only = any(f"Index Only Scan using {name} " in line for line in with_index[query][1])
+            improved.append({'query': query, 'before': before, 'after': after, 'index_only': index_only,
+                             'plan_before': without[query][1], 'plan_after': with_index[query][1]})
+    return improved
+
+
+def print_plans(name, improved, queries):
+    for item in improved:
+        print(f"\n=== {name}: {queries[item['query']]} ({item['before']:.0f} -> {item['after']:.0f})")
+        print("--- без индекса")
+        print("\n".join(item['plan_before']))
+        print("--- с индексом")
+        print("\n".join(item['plan_after']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Подбор индексов по запросам отчетов ГЖУ")
+    parser.add_argument('--host', default=DB_CONFIG['host'])
+    parser.add_argument('--port', type=int, default=DB_CONFIG['port'])
+    parser.add_argument('--user', default=DB_CONFIG['user'])
+    parser.add_argument('--password', default=DB_CONFIG['password'])
+    parser.add_argument('--dbname', default='gomozov_bench', help="база с данными бенчмарка")
+    parser.add_argument('--scale', default='10k', help="масштаб, с которым заполнялась база бенчмарка")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--only', default=None, help="учитывать только сценарии с этой подстрокой")
+    parser.add_argument('--analyze', action='store_true', help="EXPLAIN ANALYZE вместо оценки планировщика")
+    parser.add_argument('--show-plans', action='store_true', help="показать планы до и после для улучшенных запросов")
+    parser.add_argument('--apply', action='store_true', help="создать отобранные индексы (CONCURRENTLY)")
+    parser.add_argument('--output', default=None, help="файл отчета JSON")
+    args = parser.parse_args()
+
+    queries = capture_workload(args)
+    print(f"Запросов в нагрузке: {len(queries)}", file=sys.stderr)
+
+    conn = connect(args)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    for table in VACUUM_TABLES:
+        cursor.execute(f"VACUUM ANALYZE {table}")
+    cursor.close()
+    conn.autocommit = False
+
+    present = existing_indexes(conn)
+    baseline = explain_all(conn, queries, args.analyze)
+
+    report = []
+    print(f"{'Индекс':32} {'в базе':>7} {'запросов':>9} {'index-only':>11} {'стоимость без -> с':>26}")
+    for name, ddl in CANDIDATES:
+        exists = name in present
+        improved = evaluate(conn, queries, baseline, name, ddl, exists, args.analyze)
+        before = sum(item['before'] for item in improved)
+        after = sum(item['after'] for item in improved)
+        index_only = sum(item['index_only'] for item in improved)
+        print(f"{name:32} {'да' if exists else 'нет':>7} {len(improved):>9} {index_only:>11} "
+              f"{before:>12.0f} -> {after:<12.0f}")
+        if args.show_plans:
+            print_plans(name, improved, queries)
+        report.append({'index': name, 'ddl': ddl, 'exists': exists,
+                       'cases': sorted({queries[item['query']] for item in improved}),
+                       'cost_before': round(before, 2), 'cost_after': round(after, 2), 'index_only': index_only})
+
+    proposed = [(item['index'], item['ddl']) for item in report if item['cases'] and not item['exists']]
+    if proposed:
+        print("\nПредлагаемые индексы:")
+        for _, ddl in proposed:
+            print(f"  {ddl};")
+    else:
+        print("\nНовых индексов не предлагается")
+
+    if args.apply and proposed:
+        conn.autocommit = True
+        cursor = conn.cursor()
+        for name, ddl in proposed:
+            print(f"Создается {name}...", file=sys.stderr)
+            cursor.execute(ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1))
+        cursor.close()
+        conn.autocommit = False
+
+        # Итог применения: стоимость запросов нагрузки до и после
+        after = explain_all(conn, queries, args.analyze)
+        print(f"\n{'Сценарий':55} {'было':>12} {'стало':>12}")
+        for query, case in queries.items():
+            if after[query][0] < baseline[query][0]:
+                print(f"{case:55} {baseline[query][0]:>12.0f} {after[query][0]:>12.0f}")
+    conn.close()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
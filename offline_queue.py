@@ -0,0 +1,72 @@
+# Локальная очередь записей на время недоступности БД
+# Изменения сохраняются в файл SQLite в порядке ввода и применяются к серверу после переподключения
+import json
+import sqlite3
+from datetime import datetime
+
+
+class OfflineQueue:
+    # Очередь отложенных записей: pending - ждут отправки, rejected - отклонены при применении (конфликт, ошибка)
+
+    def __init__(self, path):
+        self.path = path
+        self.db = None
+
+    def _connect(self):
+        # Файл открывается при первом обращении, чтобы не задерживать запуск
+        if self.db is None:
+            self.db = sqlite3.connect(self.path)
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS pending (
+                    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at TEXT NOT NULL,
+                    kind       TEXT NOT NULL,
+                    payload    TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS rejected (
+                    id         INTEGER PRIMARY KEY,
+                    created_at TEXT NOT NULL,
+                    kind       TEXT NOT NULL,
+                    payload    TEXT NOT NULL,
+                    reason     TEXT NOT NULL
+                );
+            """)
+        return self.db
+
+    def put(self, kind, payload):
+        # Добавить запись в конец очереди (фиксируется на диске сразу)
+        db = self._connect()
+        with db:
+            db.execute("INSERT INTO pending (created_at, kind, payload) VALUES (?, ?, ?)",
+                       (datetime.now().isoformat(timespec='seconds'), kind,
+                        json.dumps(payload, ensure_ascii=False, default=str)))
+
+    def pending(self, limit=None):
+        # Записи в порядке добавления: [(id, kind, payload)]
+        db = self._connect()
+        sql = "SELECT id, kind, payload FROM pending ORDER BY id"
+        rows = db.execute(sql + " LIMIT ?", (limit,)) if limit else db.execute(sql)
+        return [(entry_id, kind, json.loads(payload)) for entry_id, kind, payload in rows]
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def done(self, applied_ids, rejected):
+        # Убрать обработанные записи: примененные удаляются, отклоненные ({id: причина}) переносятся в rejected
+        db = self._connect()
+        with db:
+            for entry_id, reason in rejected.items():
+                db.execute("INSERT INTO rejected (id, created_at, kind, payload, reason) "
+                           "SELECT id, created_at, kind, payload, ? FROM pending WHERE id = ?", (reason, entry_id))
+            db.executemany("DELETE FROM pending WHERE id = ?", [(i,) for i in list(applied_ids) + list(rejected)])
+
+    def rejected(self):
+        # Отклоненные записи: [(id, created_at, kind, payload, reason)]
+        rows = self._connect().execute("SELECT id, created_at, kind, payload, reason FROM rejected ORDER BY id")
+        return [(entry_id, created_at, kind, json.loads(payload), reason)
+                for entry_id, created_at, kind, payload, reason in rows]
+
+    def clear_rejected(self):
+        db = self._connect()
+        with db:
+            db.execute("DELETE FROM rejected")
@@ -0,0 +1,54 @@
+# Предварительная оценка запроса до выполнения: сколько строк он вернет (статистика pg_class или EXPLAIN)
+# и как получать результат - целиком, первой страницей или потоком частей;
+# профили параметров сервера (statement_timeout, work_mem) для видов операций
+from collections import namedtuple
+
+import queries
+from config import PREFLIGHT_FULL_ROWS, PREFLIGHT_WARN_ROWS, QUERY_PROFILES
+
+# Способы получения результата
+FULL = 'full'
+STREAM = 'stream'
+PAGED = 'paged'
+# Результат слишком велик: выбор между STREAM и PAGED остается за пользователем
+ASK = 'ask'
+
+Estimate = namedtuple('Estimate', ['rows', 'cost', 'width'])
+
+
+def explain_estimate(cursor, sql, params=None):
+    # Оценка планировщика без выполнения запроса
+    cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params or None)
+    plan = cursor.fetchone()[0][0]['Plan']
+    return Estimate(int(plan['Plan Rows']), plan['Total Cost'], plan['Plan Width'])
+
+
+def table_estimate(cursor, table, sql, params=None, whole_table=False):
+    # Для всей таблицы хватает reltuples; для отбора или пока таблица не анализировалась - EXPLAIN
+    if whole_table:
+        cursor.execute(queries.TABLE_ESTIMATE_SQL, (table,))
+        row = cursor.fetchone()
+        if row and row[0] is not None and row[0] >= 0:
+            return Estimate(int(row[0]), None, None)
+    return explain_estimate(cursor, sql, params)
+
+
+def choose_strategy(rows):
+    # Небольшой результат - целиком, большой - потоком, очень большой - по решению пользователя
+    if rows <= PREFLIGHT_FULL_ROWS:
+        return FULL
+    if rows <= PREFLIGHT_WARN_ROWS:
+        return STREAM
+    return ASK
+
+
+def profile_statement(name, local=True):
+    # Запрос установки параметров профиля: (запрос, параметры); local - только до конца транзакции
+    settings = QUERY_PROFILES[name]
+    calls = ", ".join(f"set_config(%s, %s, {'true' if local else 'false'})" for _ in settings)
+    params = [value for item in settings.items() for value in item]
+    return f"SELECT {calls}", params
+
+
+def apply_profile(cursor, name, local=True):
+    cursor.execute(*profile_statement(name, local))
@@ -0,0 +1,163 @@
+# Инструментирование обращений к БД: время выполнения, число строк и отпечаток SQL
+import hashlib
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Регулярные выражения для нормализации текста запроса
+_COMMENT_RE = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAM_RE = re.compile(r'%s|%\(\w+\)s|\$\d+')
+_VALUES_RE = re.compile(r'(VALUES\s*\([^()]*\))(?:\s*,\s*\([^()]*\))+', re.I)
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    # Привести запрос к виду без литералов и параметров
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', errors='replace')
+    sql = _COMMENT_RE.sub(' ', sql)
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _PARAM_RE.sub('?', sql)
+    sql = _VALUES_RE.sub(r'\1, ...', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    # Короткий отпечаток формы запроса
+    normalized = normalize_sql(sql)
+    return hashlib.md5(normalized.encode('utf-8')).hexdigest()[:12], normalized
+
+
+class QueryStats:
+    # Накопитель статистики запросов и фаз интерфейса
+
+    MAX_ERRORS = 50
+
+    def __init__(self, log_path=None):
+        self.lock = threading.Lock()
+        self.log_path = log_path
+        self.queries = {}
+        self.phases = {}
+        self.errors = []
+
+    def record_query(self, sql, duration, rowcount, error=None):
+        # Учесть выполненный запрос
+        fp, normalized = fingerprint(sql)
+        ms = duration * 1000
+        with self.lock:
+            entry = self.queries.setdefault(fp, {
+                'fingerprint': fp, 'sql': normalized, 'calls': 0, 'total_ms': 0.0,
+                'max_ms': 0.0, 'rows': 0, 'errors': 0
+            })
+            entry['calls'] += 1
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            if rowcount and rowcount > 0:
+                entry['rows'] += rowcount
+            if error is not None:
+                entry['errors'] += 1
+                self.errors.append((datetime.now().strftime('%H:%M:%S'), fp, str(error).strip()))
+                del self.errors[:-self.MAX_ERRORS]
+        self._log({'event': 'query', 'fingerprint': fp, 'sql': normalized, 'ms': round(ms, 3),
+                   'rows': rowcount, 'error': str(error).strip() if error is not None else None})
+
+    def record_phase(self, name, duration, rows=None):
+        # Учесть фазу работы интерфейса (например, вставку строк в Treeview)
+        ms = duration * 1000
+        with self.lock:
+            entry = self.phases.setdefault(name, {'phase': name, 'calls': 0, 'total_ms': 0.0,
+                                                  'max_ms': 0.0, 'rows': 0})
+            entry['calls'] += 1
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            if rows:
+                entry['rows'] += rows
+        self._log({'event': 'phase', 'phase': name, 'ms': round(ms, 3), 'rows': rows})
+
+    @contextmanager
+    def phase(self, name, rows=None):
+        # Контекстный менеджер для замера фазы
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.perf_counter() - start, rows)
+
+    def query_snapshot(self):
+        # Статистика запросов, самые дорогие сверху
+        with self.lock:
+            return sorted((dict(e) for e in self.queries.values()), key=lambda e: e['total_ms'], reverse=True)
+
+    def phase_snapshot(self):
+        # Статистика фаз интерфейса
+        with self.lock:
+            return sorted((dict(e) for e in self.phases.values()), key=lambda e: e['total_ms'], reverse=True)
+
+    def error_snapshot(self):
+        with self.lock:
+            return list(self.errors)
+
+    def reset(self):
+        with self.lock:
+            self.queries.clear()
+            self.phases.clear()
+            self.errors.clear()
+
+    def _log(self, event):
+        # Запись события в структурированный журнал (JSON Lines)
+        if not self.log_path:
+            return
+        event['ts'] = datetime.now().isoformat(timespec='milliseconds')
+        try:
+            with self.lock, open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(event, ensure_ascii=False, default=str) + '\n')
+        except OSError:
+            pass
+
+
+# Общий накопитель статистики приложения
+STATS = QueryStats()
+
+
+_timed_cursor_class = None
+
+
+def timed_cursor():
+    # Класс курсора, замеряющего каждый execute/executemany
+    # psycopg2 импортируется только при первом подключении, чтобы не задерживать запуск окна
+    global _timed_cursor_class
+    if _timed_cursor_class is None:
+        import psycopg2.extensions
+
+        class TimedCursor(psycopg2.extensions.cursor):
+
+            def execute(self, query, vars=None):
+                start = time.perf_counter()
+                error = None
+                try:
+                    return super().execute(query, vars)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    STATS.record_query(query, time.perf_counter() - start, self.rowcount, error)
+
+            def executemany(self, query, vars_list):
+                start = time.perf_counter()
+                error = None
+                try:
+                    return super().executemany(query, vars_list)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    STATS.record_query(query, time.perf_counter() - start, self.rowcount, error)
+
+        _timed_cursor_class = TimedCursor
+    return _timed_cursor_class
@@ -0,0 +1,414 @@
+# Построение SQL-запросов приложения (таблицы, поиск, фильтр, отчеты)
+# Вынесено из интерфейса, чтобы те же запросы можно было выполнять в бенчмарке
+import re
+
+# Естественный порядок номеров домов и квартир ("2" < "10" < "10а"): сортировка идет по генерируемым колонкам
+# с числовой частью и остатком номера, проиндексированным вместе с улицей и домом
+NATURAL_KEYS = {
+    'house_number': ['house_number_num', 'house_number_suffix'],
+    'apt_number': ['apt_number_num', 'apt_number_suffix']
+}
+
+
+def order_by(columns, direction="ASC"):
+    # Список ORDER BY с направлением у каждой колонки; номера домов и квартир - в естественном порядке
+    # columns - имена колонок, возможно с псевдонимом таблицы ("h.house_number")
+    items = []
+    for column in columns:
+        alias, _, name = column.rpartition('.')
+        prefix = alias + '.' if alias else ''
+        items += [f"{prefix}{key} {direction}" for key in NATURAL_KEYS.get(name, [name])]
+    return ", ".join(items)
+
+
+# Полный адрес: улица, номер дома, корпус (и номер квартиры)
+HOUSE_ORDER = ['street', 'house_number', 'building']
+ADDRESS_ORDER = ['h.street', 'h.house_number', 'h.building', 'a.apt_number']
+
+# Список домов для выбора в формах и отчетах
+HOUSES_LIST_SQL = f"SELECT house_id, street, house_number, building FROM houses ORDER BY {order_by(HOUSE_ORDER)}"
+
+# Оценка числа строк таблицы по статистике планировщика (без полного подсчета)
+TABLE_ESTIMATE_SQL = "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass"
+
+# Версии данных таблиц (счетчики изменений, которые увеличивают триггеры) - отметка результата в кэше отчетов
+DATA_VERSIONS_SQL = "SELECT table_name, version FROM data_versions WHERE table_name = ANY(%s)"
+
+# Таблицы, из которых строятся отчеты: результат в кэше действителен, пока их версии не изменились
+REPORT_TABLES = {
+    'rent': ['apartments', 'houses'],
+    'housing': ['services', 'departments', 'sections', 'houses', 'apartments']
+}
+
+# Список участков для отчета по жильцам
+SECTIONS_LIST_SQL = "SELECT section_id, name FROM sections ORDER BY name"
+
+# Ссылочные поля форм: колонка -> источник, ключ, подпись записи и выражение, по которому ищется введенный текст;
+# order - порядок подсказок с одинаковым совпадением (по умолчанию - по подписи)
+# Выражения поиска домов совпадают с триграммным индексом idx_houses_address_trgm
+HOUSE_LABEL = "{h}street || ' ' || {h}house_number || COALESCE(' корп.' || {h}building, '')"
+HOUSE_SEARCH = "{h}street || ' ' || {h}house_number"
+FK_LOOKUPS = {
+    'service_id': {'source': 'services', 'key': 'service_id', 'label': 'name', 'search': 'name'},
+    'department_id': {'source': 'departments', 'key': 'department_id', 'label': 'name', 'search': 'name'},
+    'section_id': {'source': 'sections', 'key': 'section_id', 'label': 'name', 'search': 'name'},
+    'house_id': {'source': 'houses', 'key': 'house_id', 'label': HOUSE_LABEL.format(h=''),
+                 'search': HOUSE_SEARCH.format(h=''), 'order': order_by(HOUSE_ORDER)},
+    'apartment_id': {'source': 'apartments a JOIN houses h ON a.house_id = h.house_id', 'key': 'a.apartment_id',
+                     'label': HOUSE_LABEL.format(h='h.') + " || ', кв.' || a.apt_number",
+                     'search': HOUSE_SEARCH.format(h='h.'), 'order': order_by(ADDRESS_ORDER)},
+    'payer_code_id': {'source': 'payer_codes', 'key': 'payer_code_id', 'label': "code || ' ' || name",
+                      'search': "code || ' ' || name"},
+}
+
+# Таблицы, изменение которых делает подсказки устаревшими
+FK_SOURCE_TABLES = {lookup['source'].split()[0] for lookup in FK_LOOKUPS.values()}
+
+_APARTMENT_TEXT_RE = re.compile(r'^(.*?)[,\s]*кв\.?\s*(\S*)$', re.I)
+
+
+def build_fk_search(column, text, limit):
+    # Подсказки для ссылочного поля: (запрос, параметры), не больше limit записей [(id, подпись)]
+    # Число - номер записи или начало подписи; текст - подстрока подписи (для квартир "адрес, кв. N")
+    lookup = FK_LOOKUPS[column]
+    text = text.strip()
+    conditions = []
+    params = []
+    if text.isdigit():
+        conditions.append(f"({lookup['key']} = %s OR {lookup['search']} ILIKE %s)")
+        params += [int(text), text + '%']
+    elif text:
+        address, apt_number = text, None
+        match = _APARTMENT_TEXT_RE.match(text) if column == 'apartment_id' else None
+        if match:
+            address, apt_number = match.group(1).strip(), match.group(2)
+        if address:
+            conditions.append(f"{lookup['search']} ILIKE %s")
+            params.append(f"%{address}%")
+        if apt_number:
+            conditions.append("a.apt_number LIKE %s")
+            params.append(apt_number + '%')
+
+    query = f"SELECT {lookup['key']}, {lookup['label']} FROM {lookup['source']}"
+    if conditions:
+        # Сначала записи, подпись которых начинается с введенного текста
+        query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY ({lookup['search']} ILIKE %s) DESC, {lookup.get('order', lookup['label'])}"
+        params.append(text.split(',')[0].strip() + '%')
+    else:
+        query += f" ORDER BY {lookup['key']}"
+    return query + f" LIMIT {int(limit)}", params
+
+
+# Глобальный поиск по search_index: группы результатов (таблица, подпись) в порядке показа
+SEARCH_ENTITIES = [('tenants', 'Жильцы'), ('houses', 'Дома'), ('sections', 'Участки'), ('departments', 'Отделы')]
+
+# Найденные записи по убыванию релевантности, не больше заданного числа в каждой группе
+GLOBAL_SEARCH_SQL = """
+    SELECT entity, entity_id, title, detail FROM (
+        SELECT entity, entity_id, title, detail, ts_rank(document, q) AS rank,
+               row_number() OVER (PARTITION BY entity ORDER BY ts_rank(document, q) DESC, title) AS n
+        FROM search_index, to_tsquery('russian', %s) AS q
+        WHERE document @@ q
+    ) found
+    WHERE n <= %s
+    ORDER BY entity, rank DESC, title
+"""
+
+_SEARCH_WORD_RE = re.compile(r'[^\W_]+')
+
+# Служебные слова адреса: в записях их может не быть, поэтому они не требуются для совпадения
+SEARCH_SKIP_WORDS = {'ул', 'улица', 'пр', 'проспект', 'пер', 'переулок', 'д', 'дом', 'кв', 'квартира', 'корп', 'корпус'}
+
+
+def build_search_query(text, limit):
+    # Глобальный поиск: (запрос, параметры) или None, если в тексте нет слов
+    # Каждое слово ищется по началу ("Иван" находит "Иванов"), все слова должны встретиться в записи
+    words = [word for word in _SEARCH_WORD_RE.findall(text)
+             if word.lower() not in SEARCH_SKIP_WORDS and (len(word) > 1 or word.isdigit())]
+    if not words:
+        return None
+    return GLOBAL_SEARCH_SQL, [" & ".join(f"{word}:*" for word in words), int(limit)]
+
+
+def build_fk_labels(column, ids):
+    # Подписи записей по списку id одним запросом: (запрос, параметры)
+    lookup = FK_LOOKUPS[column]
+    placeholders = ", ".join(["%s"] * len(ids))
+    return (f"SELECT {lookup['key']}, {lookup['label']} FROM {lookup['source']} "
+            f"WHERE {lookup['key']} IN ({placeholders})", list(ids))
+
+
+# Список отделов для выбора части жилфонда в снимок
+DEPARTMENTS_LIST_SQL = "SELECT department_id, name FROM departments ORDER BY name"
+
+# Многострочная вставка жильцов (execute_values)
+INSERT_TENANTS_SQL = """
+    INSERT INTO tenants (apartment_id, full_name, passport, birth_date, is_responsible, moved_in)
+    VALUES %s
+"""
+INSERT_TENANTS_TEMPLATE = "(%s, %s, %s, %s::date, %s, %s::date)"
+
+# Колонки периода действия записи для выборки "на дату" (таблица -> колонка daterange)
+AS_OF_COLUMNS = {'tenants': 'residency'}
+
+# Представления "рабочая таблица + архив" для просмотра с архивом
+ARCHIVE_SOURCES = {'tenants': 'tenants_history'}
+
+# Перенос давно выселенных жильцов в архив
+ARCHIVE_TENANTS_SQL = "SELECT archive_moved_out_tenants(%s)"
+
+# Квартиры дома для плана переселения: номер, площадь, действующие жильцы и последняя дата вселения из них
+RESETTLEMENT_APARTMENTS_SQL = f"""
+    SELECT a.apartment_id, a.apt_number, a.total_area, a.current_residents, MAX(t.moved_in)
+    FROM apartments a
+    LEFT JOIN tenants t ON t.apartment_id = a.apartment_id AND t.moved_out IS NULL
+    WHERE a.house_id = %s
+    GROUP BY a.apartment_id
+    ORDER BY {order_by(['a.apt_number'])}
+"""
+
+# Переселение жильцов по плану (списки квартир "откуда" и "куда", дата) одним оператором на сервере
+RESETTLE_TENANTS_SQL = "SELECT resettle_tenants(%s::int[], %s::int[], %s)"
+
+# Сортировки отчетов (индекс соответствует пункту выпадающего списка)
+# Колонки сортировки - списки для order_by: направление применяется к каждой колонке
+RENT_SORT_COLUMNS = [ADDRESS_ORDER, ['a.apt_number'], ['a.total_area'], ['total_rent']]
+TENANTS_SORT_COLUMNS = [['t.full_name'], ADDRESS_ORDER[:3], ['t.birth_date'], ['age']]
+HOUSING_SORT_COLUMNS = ['group_name', 'houses_count', 'apartments_count', 'residents_count']
+
+# Группировки статистики жилфонда: (колонка, таблица, условие соединения)
+HOUSING_GROUPS = [
+    ('sv.name', 'services sv', 'h.service_id = sv.service_id'),
+    ('d.name', 'departments d', 'h.department_id = d.department_id'),
+    ('sec.name', 'sections sec', 'h.section_id = sec.section_id')
+]
+
+# Сумма квартплаты по квартире
+RENT_TOTAL_EXPR = """
+    a.total_area * 25.50 +
+    CASE WHEN a.cold_water THEN a.current_residents * 150.00 ELSE 0 END +
+    CASE WHEN a.hot_water THEN a.current_residents * 200.00 ELSE 0 END +
+    CASE WHEN a.elevator THEN a.total_area * 5.00 ELSE 0 END
+"""
+
+
+def table_query_params(current_filter=None, as_of=None):
+    # Параметры запроса загрузки таблицы для заданного фильтра и даты среза
+    params = [as_of] if as_of else []
+    if not current_filter:
+        return params
+    field, operator, value = current_filter
+    if operator in ('IS NULL', 'IS NOT NULL'):
+        return params
+    if operator in ('LIKE', 'NOT LIKE'):
+        return params + [f"%{value}%"]
+    return params + [value]
+
+
+def build_table_query(table, current_filter=None, sort_column=None, sort_reverse=False, columns=None, as_of=None,
+                      include_archive=False):
+    # Запрос загрузки таблицы с фильтром (поиск - это фильтр LIKE) и сортировкой
+    # columns - явный список колонок вместо SELECT *
+    # as_of - дата среза: только записи, действовавшие на эту дату (для таблиц из AS_OF_COLUMNS)
+    # include_archive - читать представление с архивом (для таблиц из ARCHIVE_SOURCES)
+    source = ARCHIVE_SOURCES[table] if include_archive else table
+    query = f"SELECT {', '.join(columns) if columns else '*'} FROM {source}"
+
+    conditions = []
+    if as_of:
+        conditions.append(f"{AS_OF_COLUMNS[table]} @> %s::date")
+
+    if current_filter:
+        field, operator, value = current_filter
+        if operator in ('IS NULL', 'IS NOT NULL'):
+            conditions.append(f"{field} {operator}")
+        elif operator in ('LIKE', 'NOT LIKE'):
+            conditions.append(f"CAST({field} AS TEXT) {operator} %s")
+        else:
+            conditions.append(f"{field} {operator} %s")
+
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+
+    if sort_column:
+        order = "DESC" if sort_reverse else "ASC"
+        query += f" ORDER BY {order_by([sort_column], order)}"
+
+    return query, table_query_params(current_filter, as_of)
+
+
+def build_rent_report(house_id=None, street_filter=None, sort_idx=0, sort_order="ASC"):
+    # Отчет "Квартплата": (запрос строк, запрос итогов, параметры)
+    query = f"""
+        SELECT
+            h.street || ' ' || h.house_number || COALESCE(' корп.' || h.building, '') AS address,
+            a.apt_number,
+            a.total_area,
+            a.current_residents,
+            CASE WHEN a.cold_water THEN 'Да' ELSE 'Нет' END AS cold_water,
+            CASE WHEN a.hot_water THEN 'Да' ELSE 'Нет' END AS hot_water,
+            CASE WHEN a.elevator THEN 'Да' ELSE 'Нет' END AS elevator,
+            ROUND(a.total_area * 25.50, 2) AS rent_base,
+            ROUND(CASE WHEN a.cold_water THEN a.current_residents * 150.00 ELSE 0 END, 2) AS cold_water_cost,
+            ROUND(CASE WHEN a.hot_water THEN a.current_residents * 200.00 ELSE 0 END, 2) AS hot_water_cost,
+            ROUND(CASE WHEN a.elevator THEN a.total_area * 5.00 ELSE 0 END, 2) AS elevator_cost,
+            ROUND({RENT_TOTAL_EXPR}, 2) AS total_rent
+        FROM apartments a
+        JOIN houses h ON a.house_id = h.house_id
+    """
+
+    params = []
+    where_conditions = []
+
+    if house_id:
+        where_conditions.append("h.house_id = %s")
+        params.append(house_id)
+    elif street_filter:
+        where_conditions.append("h.street ILIKE %s")
+        params.append(f"%{street_filter}%")
+
+    if where_conditions:
+        query += " WHERE " + " AND ".join(where_conditions)
+
+    query += f" ORDER BY {order_by(RENT_SORT_COLUMNS[sort_idx], sort_order)}"
+
+    totals_query = f"""
+        SELECT
+            COUNT(*) as cnt,
+            COALESCE(SUM(a.total_area), 0) as total_area,
+            COALESCE(SUM({RENT_TOTAL_EXPR}), 0) AS total_sum
+        FROM apartments a
+        JOIN houses h ON a.house_id = h.house_id
+    """
+    if where_conditions:
+        totals_query += " WHERE " + " AND ".join(where_conditions)
+
+    return query, totals_query, params
+
+
+def build_tenants_report(section_id=None, only_adults=True, only_active=True, sort_idx=0, sort_order="ASC",
+                         as_of=None, include_archive=False):
+    # Отчет "Жильцы по участкам": (запрос строк, запрос итогов по участкам, параметры)
+    # as_of - дата среза: жильцы, проживавшие на эту дату, возраст на эту дату (вместо "только проживающие")
+    # include_archive - учитывать архив выселенных жильцов
+    on_date = "p.on_date" if as_of else "CURRENT_DATE"
+    age_expr = "AGE(p.on_date, t.birth_date)" if as_of else "AGE(t.birth_date)"
+    conditions = ""
+    params = [as_of] if as_of else []
+    if section_id:
+        conditions += " AND s.section_id = %s"
+        params.append(section_id)
+    if only_adults:
+        conditions += f" AND t.birth_date IS NOT NULL AND t.birth_date <= {on_date} - INTERVAL '18 years'"
+    if as_of:
+        conditions += " AND t.residency @> p.on_date"
+    elif only_active:
+        conditions += " AND t.moved_out IS NULL"
+
+    joins = f"""
+        FROM {ARCHIVE_SOURCES['tenants'] if include_archive else 'tenants'} t
+        JOIN apartments a ON t.apartment_id = a.apartment_id
+        JOIN houses h ON a.house_id = h.house_id
+        JOIN sections s ON h.section_id = s.section_id
+    """
+    if as_of:
+        joins += " CROSS JOIN (SELECT %s::date AS on_date) p"
+    joins += " WHERE 1=1"
+
+    query = f"""
+        SELECT
+            s.name AS section_name,
+            t.full_name,
+            h.street || ' ' || h.house_number || COALESCE(' корп.' || h.building, '') || ', кв.' || a.apt_number AS address,
+            t.birth_date,
+            CASE WHEN t.birth_date IS NOT NULL
+                 THEN EXTRACT(YEAR FROM {age_expr})::int
+                 ELSE NULL END AS age,
+            t.passport
+    """ + joins + conditions + f" ORDER BY s.name, {order_by(TENANTS_SORT_COLUMNS[sort_idx], sort_order)}"
+
+    totals_query = "SELECT s.name, COUNT(*)" + joins + conditions + " GROUP BY s.name ORDER BY s.name"
+
+    return query, totals_query, params
+
+
+def build_housing_stats_report(group_idx=0, year_from=None, year_to=None, sort_idx=0, sort_order="ASC"):
+    # Отчет "Статистика жилфонда": (запрос строк, запрос итогов, параметры)
+    group_col, group_table, group_join = HOUSING_GROUPS[group_idx]
+
+    where_conditions = []
+    params = []
+
+    if year_from:
+        where_conditions.append("h.year_built >= %s")
+        params.append(int(year_from))
+    if year_to:
+        where_conditions.append("h.year_built <= %s")
+        params.append(int(year_to))
+
+    where_clause = (" WHERE " + " AND ".join(where_conditions)) if where_conditions else ""
+
+    query = f"""
+        SELECT
+            {group_col} AS group_name,
+            COUNT(DISTINCT h.house_id) AS houses_count,
+            COUNT(DISTINCT a.apartment_id) AS apartments_count,
+            COALESCE(SUM(a.current_residents), 0)::int AS residents_count,
+            COALESCE(ROUND(AVG(a.total_area), 2), 0) AS avg_area,
+            COALESCE(ROUND(SUM(a.total_area), 2), 0) AS total_area
+        FROM houses h
+        JOIN {group_table} ON {group_join}
+        LEFT JOIN apartments a ON h.house_id = a.house_id
+        {where_clause}
+        GROUP BY {group_col}
+        ORDER BY {HOUSING_SORT_COLUMNS[sort_idx]} {sort_order}
+    """
+
+    totals_query = f"""
+        SELECT
+            COUNT(DISTINCT h.house_id),
+            COUNT(DISTINCT a.apartment_id),
+            COALESCE(SUM(a.current_residents), 0)::int,
+            COALESCE(ROUND(SUM(a.total_area), 2), 0)
+        FROM houses h
+        LEFT JOIN apartments a ON h.house_id = a.house_id
+        {where_clause}
+    """
+
+    return query, totals_query, params
+
+
+def build_housing_detail_report(year_from=None, year_to=None):
+    # Детальные строки "Статистики жилфонда" по домам для клиентской перегруппировки: (запрос, параметры)
+    where_conditions = []
+    params = []
+
+    if year_from:
+        where_conditions.append("h.year_built >= %s")
+        params.append(int(year_from))
+    if year_to:
+        where_conditions.append("h.year_built <= %s")
+        params.append(int(year_to))
+
+    where_clause = (" WHERE " + " AND ".join(where_conditions)) if where_conditions else ""
+
+    query = f"""
+        SELECT
+            sv.name AS service_name,
+            d.name AS department_name,
+            sec.name AS section_name,
+            h.year_built,
+            COUNT(a.apartment_id) AS apartments_count,
+            COALESCE(SUM(a.current_residents), 0)::int AS residents_count,
+            COALESCE(SUM(a.total_area), 0) AS total_area
+        FROM houses h
+        JOIN services sv ON h.service_id = sv.service_id
+        JOIN departments d ON h.department_id = d.department_id
+        JOIN sections sec ON h.section_id = sec.section_id
+        LEFT JOIN apartments a ON h.house_id = a.house_id
+        {where_clause}
+        GROUP BY h.house_id, sv.name, d.name, sec.name, h.year_built
+    """
+
+    return query, params
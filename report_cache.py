@@ -0,0 +1,73 @@
+# Кэш результатов отчетов на диске: ключ - отчет и его параметры, отметка - версии данных таблиц,
+# из которых отчет строится (data_versions на сервере). Результат отдается из кэша, только если ни одна
+# из этих таблиц не менялась; при превышении размера вытесняются давно не использованные записи
+import json
+import pickle
+import sqlite3
+import zlib
+from datetime import datetime
+
+
+class ReportCache:
+    # Файл SQLite: entries(key, versions, payload, size, used_at); payload - сжатый список строк
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.db = None
+
+    def _connect(self):
+        # Файл открывается при первом обращении, чтобы не задерживать запуск
+        if self.db is None:
+            self.db = sqlite3.connect(self.path)
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key      TEXT PRIMARY KEY,
+                    versions TEXT NOT NULL,
+                    payload  BLOB NOT NULL,
+                    size     INTEGER NOT NULL,
+                    used_at  TEXT NOT NULL
+                )
+            """)
+        return self.db
+
+    @staticmethod
+    def make_key(*parts):
+        return json.dumps(parts, ensure_ascii=False, default=str)
+
+    def get(self, key, versions):
+        # Строки отчета, если они получены при тех же версиях данных; устаревшая запись удаляется
+        db = self._connect()
+        row = db.execute("SELECT versions, payload FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with db:
+            if json.loads(row[0]) != versions:
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            db.execute("UPDATE entries SET used_at = ? WHERE key = ?",
+                       (datetime.now().isoformat(timespec='milliseconds'), key))
+        return pickle.loads(zlib.decompress(row[1]))
+
+    def put(self, key, versions, rows):
+        # Сохранить результат и вытеснить давно не использованные записи сверх max_bytes
+        payload = zlib.compress(pickle.dumps(list(rows), protocol=pickle.HIGHEST_PROTOCOL))
+        if len(payload) > self.max_bytes:
+            return
+        db = self._connect()
+        with db:
+            db.execute("INSERT OR REPLACE INTO entries (key, versions, payload, size, used_at) VALUES (?, ?, ?, ?, ?)",
+                       (key, json.dumps(versions), payload, len(payload),
+                        datetime.now().isoformat(timespec='milliseconds')))
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            for old_key, size in db.execute("SELECT key, size FROM entries WHERE key != ? ORDER BY used_at",
+                                            (key,)).fetchall():
+                if total <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM entries WHERE key = ?", (old_key,))
+                total -= size
+
+    def clear(self):
+        db = self._connect()
+        with db:
+            db.execute("DELETE FROM entries")
@@ -0,0 +1,52 @@
+# Переселение жильцов между домами: план "квартира -> квартира" и его проверка до выполнения
+# Сам перенос выполняет функция resettle_tenants на сервере одним оператором (со счетчиками жильцов)
+from collections import namedtuple
+
+# Квартира в плане: id, номер, общая площадь, действующих жильцов, последняя дата вселения из них
+Apartment = namedtuple('Apartment', ['apartment_id', 'number', 'area', 'residents', 'last_moved_in'])
+
+# Замечание к строке плана; blocking - переселение с таким планом сервер не выполнит
+Problem = namedtuple('Problem', ['source_id', 'message', 'blocking'])
+
+
+def auto_assign(sources, targets):
+    # Подбор по площади: заселенные квартиры-источники и свободные квартиры назначения, каждые по убыванию
+    # площади, сопоставляются по порядку. {id источника: квартира назначения или None, если свободных не хватило}
+    source_ids = {apt.apartment_id for apt in sources}
+    occupied = sorted((apt for apt in sources if apt.residents), key=lambda apt: -(apt.area or 0))
+    free = sorted((apt for apt in targets if not apt.residents and apt.apartment_id not in source_ids),
+                  key=lambda apt: -(apt.area or 0))
+    plan = {apt.apartment_id: None for apt in sources if apt.residents}
+    for source, target in zip(occupied, free):
+        plan[source.apartment_id] = target
+    return plan
+
+
+def plan_problems(plan, sources, on_date):
+    # Замечания к плану [Problem]: нет квартиры назначения, она занята или выбрана дважды,
+    # жильцы вселены позже даты переселения (прежнюю запись нельзя закрыть раньше вселения)
+    by_id = {apt.apartment_id: apt for apt in sources}
+    vacated = {source_id for source_id, target in plan.items() if target is not None}
+    used = {}
+    for source_id, target in plan.items():
+        if target is not None:
+            used.setdefault(target.apartment_id, []).append(source_id)
+    problems = []
+    for source_id, target in plan.items():
+        source = by_id[source_id]
+        if target is None:
+            problems.append(Problem(source_id, "не выбрана квартира - жильцы останутся", False))
+            continue
+        if source.last_moved_in is not None and source.last_moved_in > on_date:
+            problems.append(Problem(source_id, f"есть жильцы, вселенные позже {on_date}", True))
+        if target.residents and target.apartment_id not in vacated:
+            problems.append(Problem(source_id, f"в кв. {target.number} уже живут: {target.residents}", False))
+        if len(used[target.apartment_id]) > 1:
+            problems.append(Problem(source_id, f"кв. {target.number} выбрана для нескольких квартир", False))
+    return problems
+
+
+def plan_arrays(plan):
+    # Параметры resettle_tenants: списки id квартир "откуда" и "куда" (строки без назначения пропускаются)
+    pairs = [(source_id, target.apartment_id) for source_id, target in plan.items() if target is not None]
+    return [source for source, _ in pairs], [target for _, target in pairs]
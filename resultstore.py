@@ -0,0 +1,281 @@
+# Колоночное хранение результатов запроса: значения лежат по колонкам,
+# форматирование для показа выполняется по колонке целиком и только для показываемых строк
+# Результат больше SPILL_CELLS значений переносится во временные файлы (spill.SpillColumn)
+import csv
+import locale
+import re
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from config import SPILL_CELLS
+from spill import SpillColumn, encoding_for
+
+BOOL_LABELS = {True: "Да", False: "Нет", None: ""}
+
+# Сколько строк форматировать за раз при выгрузке в CSV
+EXPORT_CHUNK = 5000
+
+# Сколько строк получать из курсора за раз (from_cursor)
+FETCH_CHUNK = 5000
+
+_NATURAL_RE = re.compile(r'^([0-9]{0,9})(.*)$', re.S)
+
+# Тип колонки хранилища по типу PostgreSQL (information_schema.columns.data_type)
+PG_KINDS = {
+    'smallint': 'int', 'integer': 'int', 'bigint': 'int',
+    'numeric': 'float', 'real': 'float', 'double precision': 'float',
+    'boolean': 'bool', 'date': 'date',
+    'timestamp with time zone': 'datetime', 'timestamp without time zone': 'datetime',
+    'text': 'text', 'character varying': 'text', 'character': 'text'
+}
+
+
+def _to_text(value):
+    return "" if value is None else str(value)
+
+
+def text_key(value):
+    # Ключ сравнения текста по правилам локали (LC_COLLATE), а не по кодам символов: так сортирует
+    # сервер с русской локалью ("а" < "Б" < "в", строчные и прописные вместе)
+    return locale.strxfrm(value)
+
+
+def natural_key(value):
+    # Ключ естественного порядка номера, как генерируемые колонки *_num и *_suffix на сервере:
+    # числовая часть, затем остаток (по правилам локали); номера без числовой части - после остальных
+    digits, suffix = _NATURAL_RE.match(str(value)).groups()
+    return (0, int(digits), text_key(suffix)) if digits else (1, 0, text_key(suffix))
+
+
+def _detect_kind(column):
+    # Тип колонки по первому непустому значению
+    for value in column:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            return 'bool'
+        if isinstance(value, int):
+            return 'int'
+        if isinstance(value, (float, Decimal)):
+            return 'float'
+        if isinstance(value, datetime):
+            return 'datetime'
+        if isinstance(value, date):
+            return 'date'
+        return 'text'
+    return 'text'
+
+
+class ColumnStore:
+    # Результат запроса в колоночном виде
+
+    def __init__(self, names, columns, kinds=None):
+        # kinds - известные типы колонок (из каталога); None - тип определяется по значениям
+        self.names = list(names)
+        self.columns = columns
+        kinds = kinds or [None] * len(columns)
+        self.declared = [kind is not None for kind in kinds]
+        self.kinds = [kind or _detect_kind(col) for kind, col in zip(kinds, columns)]
+        self.has_none = [None in col for col in columns]
+        self.length = len(columns[0]) if columns else 0
+        self._numeric = {}
+
+    @classmethod
+    def from_rows(cls, names, rows, kinds=None):
+        # Транспонирование строк курсора в колонки
+        if rows:
+            columns = [tuple(col) for col in zip(*rows)]
+        else:
+            columns = [() for _ in names]
+        store = cls(names, columns, kinds)
+        if store.length * len(store.columns) > SPILL_CELLS:
+            store.spill()
+        return store
+
+    @classmethod
+    def from_cursor(cls, names, cursor, kinds=None):
+        # Чтение курсора частями (fetchmany): большой результат переносится в файлы по ходу чтения,
+        # строки всего результата одновременно объектами Python не создаются
+        store = cls.empty(names, kinds)
+        while True:
+            rows = cursor.fetchmany(FETCH_CHUNK)
+            if not rows:
+                break
+            store.extend(rows)
+        return store
+
+    @classmethod
+    def empty(cls, names, kinds=None):
+        # Пустое хранилище, которое заполняется по частям через extend
+        return cls(names, [[] for _ in names], kinds)
+
+    def __len__(self):
+        return self.length
+
+    def extend(self, rows):
+        # Дописать строки в конец (отчет, получаемый частями)
+        if not rows:
+            return
+        for i, values in enumerate(zip(*rows)):
+            column = self.columns[i]
+            if isinstance(column, tuple):
+                column = self.columns[i] = list(column)
+            column.extend(values)
+            if self.kinds[i] == 'text' and not self.declared[i]:
+                # Колонка, в которой до сих пор были только пустые значения, получает тип по новым строкам
+                self.kinds[i] = _detect_kind(values)
+            self.has_none[i] = self.has_none[i] or None in values
+        self.length += len(rows)
+        self._numeric = {}
+        if not self.spilled() and self.length * len(self.columns) > SPILL_CELLS:
+            self.spill()
+
+    def spilled(self):
+        return any(isinstance(column, SpillColumn) for column in self.columns)
+
+    def spill(self):
+        # Перенести колонки во временные файлы (mmap): в памяти остаются только показываемые строки
+        for i, column in enumerate(self.columns):
+            spilled = SpillColumn(encoding_for(self.kinds[i], column))
+            for start in range(0, self.length, EXPORT_CHUNK):
+                spilled.extend(column[start:start + EXPORT_CHUNK])
+            self.columns[i] = spilled
+        self._numeric = {}
+
+    def _format_column(self, index, part):
+        # Форматирование среза колонки одной операцией над всем срезом
+        kind = self.kinds[index]
+        if kind == 'bool':
+            return list(map(BOOL_LABELS.__getitem__, part))
+        if self.has_none[index]:
+            return list(map(_to_text, part))
+        if np is not None and kind == 'int' and len(part) > 64:
+            return np.asarray(part, dtype=np.int64).astype(str).tolist()
+        return list(map(str, part))
+
+    def format_rows(self, start, stop, order=None):
+        # Строки для показа в диапазоне [start, stop) с учетом порядка order (список индексов)
+        if order is None:
+            parts = [col[start:stop] for col in self.columns]
+        else:
+            idx = order[start:stop]
+            parts = [[col[i] for i in idx] for col in self.columns]
+        formatted = [self._format_column(i, part) for i, part in enumerate(parts)]
+        return list(zip(*formatted))
+
+    def numeric(self, index):
+        # Числовое представление колонки (массив NumPy, если доступен), None -> NaN
+        cached = self._numeric.get(index)
+        if cached is None:
+            column = self.columns[index]
+            # Колонка в файле отдает массив прямо из отображения, без объектов Python
+            cached = column.numeric() if isinstance(column, SpillColumn) else None
+            if cached is None:
+                values = [float('nan') if v is None else float(v) for v in column]
+                cached = np.asarray(values, dtype=np.float64) if np is not None else values
+            self._numeric[index] = cached
+        return cached
+
+    def sort_order(self, index, reverse=False, indices=None, key=None):
+        # Порядок строк по колонке; пустые значения как в PostgreSQL: в конце при ASC, в начале при DESC
+        # key - ключ сравнения значений (например, natural_key для номеров домов и квартир);
+        # текст без ключа сравнивается по правилам локали (text_key)
+        column = self.columns[index]
+        if key is None and self.kinds[index] == 'text':
+            key = text_key
+        if indices is None and key is None and np is not None and self.kinds[index] in ('int', 'float') \
+                and not self.has_none[index]:
+            order = np.argsort(self.numeric(index), kind='stable')
+            return (order[::-1] if reverse else order).tolist()
+        if isinstance(column, SpillColumn):
+            # Колонка в файле читается один раз подряд: обращение по индексу разбирает каждое значение отдельно
+            column = column[:]
+        base = range(self.length) if indices is None else indices
+        nones = [i for i in base if column[i] is None]
+        values = [i for i in base if column[i] is not None]
+        values.sort(key=column.__getitem__ if key is None else lambda i: key(column[i]), reverse=reverse)
+        return nones + values if reverse else values + nones
+
+    def filter_indices(self, index, operator, value, indices=None):
+        # Индексы строк, удовлетворяющих фильтру; None, если фильтр нельзя выполнить так же, как на сервере
+        column = self.columns[index]
+        if isinstance(column, SpillColumn):
+            # Как в sort_order: колонка в файле читается один раз подряд, а не по значению на строку
+            column = column[:]
+        kind = self.kinds[index]
+        base = range(self.length) if indices is None else indices
+
+        if operator == 'IS NULL':
+            return [i for i in base if column[i] is None]
+        if operator == 'IS NOT NULL':
+            return [i for i in base if column[i] is not None]
+
+        if operator in ('LIKE', 'NOT LIKE'):
+            # CAST(... AS TEXT) LIKE '%v%' - подстрока с учетом регистра; шаблонные символы не поддерживаем
+            if kind == 'datetime' or '%' in value or '_' in value:
+                return None
+            if kind == 'bool':
+                texts = [None if v is None else ('true' if v else 'false') for v in column]
+            else:
+                texts = [None if v is None else str(v) for v in column]
+            if operator == 'LIKE':
+                return [i for i in base if texts[i] is not None and value in texts[i]]
+            return [i for i in base if texts[i] is not None and value not in texts[i]]
+
+        try:
+            if kind in ('int', 'float'):
+                target = Decimal(value)
+            elif kind == 'date':
+                target = date.fromisoformat(value)
+            elif kind == 'text' and operator in ('=', '!='):
+                # Упорядочивание строк зависит от правил сортировки сервера - только равенство
+                target = value
+            else:
+                return None
+        except (InvalidOperation, ValueError):
+            return None
+
+        compare = {
+            '=': lambda v: v == target,
+            '!=': lambda v: v != target,
+            '>': lambda v: v > target,
+            '<': lambda v: v < target,
+            '>=': lambda v: v >= target,
+            '<=': lambda v: v <= target
+        }.get(operator)
+        if compare is None:
+            return None
+        if kind == 'float':
+            return [i for i in base if column[i] is not None and compare(Decimal(str(column[i])))]
+        return [i for i in base if column[i] is not None and compare(column[i])]
+
+    def totals(self, indices=None):
+        # Суммы числовых колонок (для строк indices или всех строк)
+        result = {}
+        for i, kind in enumerate(self.kinds):
+            if kind not in ('int', 'float'):
+                continue
+            column = self.columns[i]
+            if indices is None and np is not None:
+                # Сумма целой колонки остается целой, как в ветке без NumPy ("1234", а не "1234.0")
+                total = np.nansum(self.numeric(i))
+                result[self.names[i]] = int(total) if kind == 'int' else float(total)
+            else:
+                if isinstance(column, SpillColumn):
+                    column = column[:]
+                base = range(self.length) if indices is None else indices
+                result[self.names[i]] = sum(column[j] for j in base if column[j] is not None)
+        return result
+
+    def write_csv(self, f, headers=None, order=None):
+        # Выгрузка в CSV (разделитель ";" для Excel) частями, в порядке order, если он задан
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(headers or self.names)
+        total = len(order) if order is not None else self.length
+        for start in range(0, total, EXPORT_CHUNK):
+            writer.writerows(self.format_rows(start, min(start + EXPORT_CHUNK, total), order))
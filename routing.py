@@ -0,0 +1,138 @@
+# Маршрутизация чтения: отчеты, выгрузки и загрузка таблиц идут на реплику (standby потоковой репликации),
+# запись - на основной сервер. Реплика используется, только если ее отставание не больше допустимого и она
+# уже применила последние записи этого приложения: после сохранения таблица не показывается без них
+import threading
+import time
+from contextlib import contextmanager
+
+# Состояние реплики: в режиме восстановления ли, отставание в секундах (0 - все полученное применено), позиция WAL
+LAG_SQL = """
+    SELECT pg_is_in_recovery(),
+           CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END,
+           pg_last_wal_replay_lsn()::text
+"""
+
+WRITE_LSN_SQL = "SELECT pg_current_wal_lsn()::text"
+
+
+def lsn_value(text):
+    # Позиция WAL 'XXXXXXXX/YYYYYYYY' как число для сравнения
+    if not text:
+        return 0
+    high, low = text.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+class ReadRouter:
+    # Соединение с репликой и проверка ее отставания; reader() - соединение для чтения или None (читать с основного)
+    # Подключение идет в фоновом потоке, проверка и чтение - в потоке Tk: соединение и состояние меняются под lock,
+    # а чтение с реплики выполняется внутри reading(), чтобы переподключение не закрыло ее посреди запроса
+
+    def __init__(self, config, max_lag=None, check_interval=10):
+        self.config = config
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.conn = None
+        self.checked_at = None
+        self.lag = None
+        self.standby = False
+        self.replay_lsn = 0
+        self.write_lsn = 0
+        self.lock = threading.RLock()
+
+    def configured(self):
+        return self.config is not None
+
+    def connect(self, connect):
+        # Подключиться к реплике (connect(config) -> соединение); False - реплика недоступна
+        # Новое соединение устанавливается без блокировки и подменяет прежнее под lock
+        if not self.configured():
+            self.close()
+            return False
+        try:
+            conn = connect(self.config)
+            conn.set_session(readonly=True)
+        except Exception:
+            conn = None
+        with self.lock:
+            self.close()
+            self.conn = conn
+        return conn is not None
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                try:
+                    self.conn.close()
+                except Exception:
+                    pass
+            self.conn = None
+            self.checked_at = None
+
+    def check(self):
+        # Состояние реплики: раз в check_interval секунд, а пока она не применила наши записи - при каждом чтении
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < self.check_interval \
+                and self.replay_lsn >= self.write_lsn:
+            return
+        cursor = self.conn.cursor()
+        cursor.execute(LAG_SQL)
+        self.standby, self.lag, replay_lsn = cursor.fetchone()
+        cursor.close()
+        self.conn.rollback()
+        self.replay_lsn = lsn_value(replay_lsn)
+        self.checked_at = now
+
+    def reader(self):
+        # Соединение с репликой, если она годится для чтения, иначе None
+        with self.lock:
+            if self.conn is None or self.conn.closed:
+                return None
+            try:
+                self.check()
+            except Exception:
+                self.close()
+                return None
+            if not self.standby or self.replay_lsn < self.write_lsn:
+                return None
+            if self.max_lag is not None and (self.lag is None or self.lag > self.max_lag):
+                return None
+            return self.conn
+
+    @contextmanager
+    def reading(self):
+        # Соединение с репликой (или None) на время всего чтения: lock удерживается до выхода из блока
+        with self.lock:
+            yield self.reader()
+
+    def note_write(self, conn):
+        # После фиксации на основном сервере: позиция WAL, которую реплика должна применить до следующего чтения
+        with self.lock:
+            if self.conn is None:
+                return
+        try:
+            cursor = conn.cursor()
+            cursor.execute(WRITE_LSN_SQL)
+            position = lsn_value(cursor.fetchone()[0])
+            cursor.close()
+            conn.rollback()
+        except Exception:
+            # Позиция неизвестна: чтение с основного, пока реплика не продвинется дальше уже известной
+            position = self.replay_lsn + 1
+        with self.lock:
+            self.write_lsn = max(self.write_lsn, position)
+
+    def status(self):
+        # Подпись источника чтения для строки состояния
+        if not self.configured():
+            return ""
+        with self.lock:
+            if self.conn is None or self.conn.closed:
+                return "Чтение: основной сервер (реплика недоступна)"
+            if not self.standby:
+                return "Чтение: основной сервер (сервер чтения не реплика)"
+            if self.max_lag is not None and (self.lag is None or self.lag > self.max_lag):
+                return "Чтение: основной сервер (реплика отстает)"
+            lag = f", отставание {float(self.lag):.0f} с" if self.lag else ""
+            return f"Чтение: реплика{lag}"
@@ -0,0 +1,212 @@
+# Локальный снимок части жилфонда (участок или отдел) в файле SQLite для работы только на чтение
+# Синхронизация инкрементальная: с сервера передаются отпечатки строк, полностью - только новые и измененные строки
+import json
+import re
+import sqlite3
+from datetime import date, datetime
+from decimal import Decimal
+
+import queries
+
+# Таблицы снимка: справочники целиком, дома/квартиры/жильцы - только выбранной части
+SNAPSHOT_TABLES = ['services', 'departments', 'sections', 'payer_codes', 'tariffs', 'houses', 'apartments', 'tenants']
+
+# Условия отбора части (%s - id участка или отдела)
+SCOPE_COLUMNS = {'section': 'section_id', 'department': 'department_id'}
+SCOPE_CONDITIONS = {
+    'houses': "{col} = %s",
+    'apartments': "house_id IN (SELECT house_id FROM houses WHERE {col} = %s)",
+    'tenants': """apartment_id IN (SELECT a.apartment_id FROM apartments a
+                  JOIN houses h ON a.house_id = h.house_id WHERE h.{col} = %s)"""
+}
+
+# Сколько строк запрашивать за раз при загрузке измененных строк
+FETCH_CHUNK = 1000
+
+_CAST_RE = re.compile(r'::\w+')
+_ILIKE_RE = re.compile(r'\bILIKE\b', re.I)
+# Генерируемых колонок естественного порядка в снимке нет: числовая часть - CAST (берет ведущие цифры),
+# остаток заменяется самим номером (при равной числовой части порядок тот же). Номер без ведущих цифр
+# (на сервере _num = NULL) получает наибольшее число: SQLite ставит NULL первым при ASC, а PostgreSQL - последним
+_NATURAL_NONE = 9223372036854775807
+_NATURAL_RE = re.compile(r'\b((?:\w+\.)?\w+_number)_(num|suffix)\b')
+
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, datetime.isoformat)
+sqlite3.register_converter('BOOLEAN', lambda b: b == b'1')
+sqlite3.register_converter('DATE', lambda b: date.fromisoformat(b.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda b: datetime.fromisoformat(b.decode()))
+# numeric(p, s) хранится с числовым типом SQLite, при чтении восстанавливается Decimal с тем же числом знаков
+for _scale in range(7):
+    sqlite3.register_converter(f'DEC{_scale}',
+                               lambda b, q=Decimal(1).scaleb(-_scale): Decimal(b.decode()).quantize(q))
+
+
+def sqlite_sql(sql):
+    # Запрос приложения в диалекте SQLite: параметры ?, ILIKE -> LIKE, без приведений ::тип,
+    # ключи естественного порядка номеров - выражениями над самим номером
+    sql = _CAST_RE.sub('', sql)
+    sql = _NATURAL_RE.sub(lambda m: f"CASE WHEN {m.group(1)} GLOB '[0-9]*' THEN CAST({m.group(1)} AS INTEGER) "
+                                    f"ELSE {_NATURAL_NONE} END" if m.group(2) == 'num' else m.group(1), sql)
+    sql = _ILIKE_RE.sub('LIKE', sql)
+    return sql.replace('%s', '?')
+
+
+def _column_type(data_type, scale):
+    # Объявленный тип колонки SQLite по типу PostgreSQL
+    if data_type in ('integer', 'bigint', 'smallint'):
+        return 'INTEGER'
+    if data_type == 'numeric':
+        return f'DEC{scale or 0}'
+    if data_type == 'boolean':
+        return 'BOOLEAN'
+    if data_type == 'date':
+        return 'DATE'
+    if data_type.startswith('timestamp'):
+        return 'TIMESTAMP'
+    return 'TEXT'
+
+
+class SnapshotStore:
+    # Файл снимка: таблицы с колонками TABLES, отпечаток каждой строки и сведения о выбранной части
+
+    def __init__(self, path, tables):
+        self.path = path
+        self.tables = tables
+        self.db = None
+
+    def _connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES)
+            self.db.execute("CREATE TABLE IF NOT EXISTS snapshot_meta (key TEXT PRIMARY KEY, value TEXT)")
+        return self.db
+
+    def meta(self):
+        # Сведения о снимке: scope_kind, scope_id, scope_name, synced_at
+        return dict(self._connect().execute("SELECT key, value FROM snapshot_meta"))
+
+    def exists(self):
+        return 'synced_at' in self.meta()
+
+    def query(self, sql, params=None):
+        # Выполнить запрос приложения над снимком
+        return self._connect().execute(sqlite_sql(sql), params or []).fetchall()
+
+    def table_rows(self, table, current_filter=None, sort_column=None, sort_reverse=False, as_of=None):
+        # Загрузка таблицы как load_data; срез на дату - по датам вселения/выселения
+        columns = self.tables[table]['columns']
+        query, params = queries.build_table_query(table, current_filter, sort_column, sort_reverse, columns)
+        rows = self.query(query, params)
+        if as_of and table in queries.AS_OF_COLUMNS:
+            moved_in, moved_out = columns.index('moved_in'), columns.index('moved_out')
+            rows = [r for r in rows if r[moved_in] <= as_of and (r[moved_out] is None or r[moved_out] > as_of)]
+        return rows
+
+    def _create_tables(self, cursor, db):
+        # Таблицы снимка по структуре таблиц сервера (только колонки из TABLES)
+        for table in SNAPSHOT_TABLES:
+            info = self.tables[table]
+            cursor.execute("""
+                SELECT column_name, data_type, numeric_scale FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = %s
+            """, (table,))
+            types = {name: _column_type(data_type, scale) for name, data_type, scale in cursor.fetchall()}
+            columns = ", ".join(f"{col} {types.get(col, 'TEXT')}" for col in info['columns'])
+            db.execute(f"DROP TABLE IF EXISTS {table}")
+            db.execute(f"CREATE TABLE {table} ({columns}, row_hash TEXT NOT NULL, PRIMARY KEY ({info['pk']}))")
+
+    def sync(self, conn, scope_kind, scope_id, scope_name):
+        # Обновить снимок с сервера; при смене части снимок строится заново. Возвращает {таблица: (загружено, удалено)}
+        db = self._connect()
+        meta = self.meta()
+        cursor = conn.cursor()
+        stats = {}
+        try:
+            # Состав колонок мог измениться вместе со схемой (метаданные из каталога) - тогда снимок строится заново
+            columns = json.dumps({table: self.tables[table]['columns'] for table in SNAPSHOT_TABLES})
+            with db:
+                if (meta.get('scope_kind'), meta.get('scope_id'), meta.get('columns')) != \
+                        (scope_kind, str(scope_id), columns):
+                    self._create_tables(cursor, db)
+                for table in SNAPSHOT_TABLES:
+                    stats[table] = self._sync_table(cursor, db, table, scope_kind, scope_id)
+                db.executemany("INSERT OR REPLACE INTO snapshot_meta (key, value) VALUES (?, ?)", [
+                    ('scope_kind', scope_kind), ('scope_id', str(scope_id)), ('scope_name', scope_name),
+                    ('columns', columns),
+                    ('synced_at', datetime.now().isoformat(timespec='seconds'))
+                ])
+        finally:
+            cursor.close()
+            conn.rollback()
+        return stats
+
+    def _sync_table(self, cursor, db, table, scope_kind, scope_id):
+        # Сравнение отпечатков строк сервера и снимка, загрузка только отличающихся строк
+        info = self.tables[table]
+        pk = info['pk']
+        columns = info['columns']
+        condition = SCOPE_CONDITIONS.get(table)
+        where = " WHERE " + condition.format(col=SCOPE_COLUMNS[scope_kind]) if condition else ""
+        params = [scope_id] if condition else []
+
+        cursor.execute(f"SELECT {pk}, md5(ROW({', '.join(columns)})::text) FROM {table}{where}", params)
+        server = dict(cursor.fetchall())
+        local = dict(db.execute(f"SELECT {pk}, row_hash FROM {table}"))
+
+        changed = [key for key, row_hash in server.items() if local.get(key) != row_hash]
+        deleted = [key for key in local if key not in server]
+
+        placeholders = ", ".join("?" * (len(columns) + 1))
+        for start in range(0, len(changed), FETCH_CHUNK):
+            chunk = changed[start:start + FETCH_CHUNK]
+            cursor.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE {pk} = ANY(%s)", (chunk,))
+            pk_index = columns.index(pk)
+            db.executemany(f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}, row_hash) VALUES ({placeholders})",
+                           [tuple(row) + (server[row[pk_index]],) for row in cursor.fetchall()])
+        db.executemany(f"DELETE FROM {table} WHERE {pk} = ?", [(key,) for key in deleted])
+        return len(changed), len(deleted)
+
+
+def build_tenants_report(section_id=None, only_adults=True, only_active=True, sort_idx=0, sort_order="ASC",
+                         as_of=None, include_archive=False):
+    # Отчет "Жильцы по участкам" над снимком (в SQLite нет AGE/INTERVAL); архив в снимок не входит
+    # as_of - объект date, подставляется в текст запроса литералом
+    on_date = f"'{as_of.isoformat()}'" if as_of else "date('now')"
+    conditions = ""
+    params = []
+    if section_id:
+        conditions += " AND s.section_id = ?"
+        params.append(section_id)
+    if only_adults:
+        conditions += f" AND t.birth_date IS NOT NULL AND t.birth_date <= date({on_date}, '-18 years')"
+    if as_of:
+        conditions += f" AND t.moved_in <= {on_date} AND (t.moved_out IS NULL OR t.moved_out > {on_date})"
+    elif only_active:
+        conditions += " AND t.moved_out IS NULL"
+
+    joins = """
+        FROM tenants t
+        JOIN apartments a ON t.apartment_id = a.apartment_id
+        JOIN houses h ON a.house_id = h.house_id
+        JOIN sections s ON h.section_id = s.section_id
+        WHERE 1=1
+    """
+
+    # Полных лет на дату: разница годов минус 1, если день рождения в этом году еще не наступил
+    age = f"""(CAST(strftime('%Y', {on_date}) AS INTEGER) - CAST(strftime('%Y', t.birth_date) AS INTEGER)
+               - (strftime('%m-%d', {on_date}) < strftime('%m-%d', t.birth_date)))"""
+
+    query = f"""
+        SELECT
+            s.name AS section_name,
+            t.full_name,
+            h.street || ' ' || h.house_number || COALESCE(' корп.' || h.building, '') || ', кв.' || a.apt_number AS address,
+            t.birth_date,
+            CASE WHEN t.birth_date IS NOT NULL THEN {age} ELSE NULL END AS age,
+            t.passport
+    """ + joins + conditions + f" ORDER BY s.name, {queries.order_by(queries.TENANTS_SORT_COLUMNS[sort_idx], sort_order)}"
+
+    totals_query = "SELECT s.name, COUNT(*)" + joins + conditions + " GROUP BY s.name ORDER BY s.name"
+
+    return query, totals_query, params
@@ -0,0 +1,157 @@
+# Колонки результата во временных файлах, отображаемых в память (mmap)
+# Большой результат не держится в памяти объектами Python: числа, даты и флаги хранятся массивами
+# фиксированной ширины, текст - концами строк (int64) и байтами UTF-8, пустые значения - байтовой маской.
+# Строка читается по номеру без чтения соседних, поэтому постраничный показ, сортировка и выгрузка
+# работают так же, как со списками в памяти
+import mmap
+import struct
+import tempfile
+from datetime import date, datetime
+from decimal import Decimal
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Кодировки фиксированной ширины (формат struct) и текстовые (функция восстановления значения)
+FIXED_FORMATS = {'int': 'q', 'float': 'd', 'bool': 'b', 'date': 'i'}
+TEXT_DECODERS = {'text': str, 'decimal': Decimal, 'datetime': datetime.fromisoformat}
+
+# Сколько строк разбирать за раз при переборе колонки
+ITER_CHUNK = 10000
+
+
+def encoding_for(kind, column):
+    # Кодировка колонки по типу ColumnStore; numeric хранится текстом, чтобы не терять точность Decimal
+    if kind == 'float':
+        first = next((v for v in column if v is not None), None)
+        return 'decimal' if isinstance(first, Decimal) else 'float'
+    if kind in FIXED_FORMATS or kind in TEXT_DECODERS:
+        return kind
+    return 'text'
+
+
+class MappedFile:
+    # Временный файл только на дозапись; чтение через mmap, который переоткрывается, когда файл вырос
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.size = 0
+        self.map = None
+        self.mapped = 0
+
+    def append(self, data):
+        self.file.write(data)
+        self.size += len(data)
+
+    def view(self):
+        # Пустой файл отобразить нельзя
+        if not self.size:
+            return b''
+        if self.mapped < self.size:
+            self.file.flush()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mapped = self.size
+        return self.map
+
+
+class SpillColumn:
+    # Колонка в файлах: поддерживает len, индекс, срез, перебор, "None in" и дозапись extend
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.length = 0
+        self.has_none = False
+        self.nulls = MappedFile()
+        self.data = MappedFile()
+        self.fmt = FIXED_FORMATS.get(encoding)
+        if self.fmt:
+            self.width = struct.calcsize('<' + self.fmt)
+        else:
+            self.decode = TEXT_DECODERS[encoding]
+            self.ends = MappedFile()
+            self.text_size = 0
+
+    def extend(self, values):
+        values = list(values)
+        count = len(values)
+        if not count:
+            return
+        nulls = bytes(v is None for v in values)
+        if self.fmt:
+            if self.encoding == 'date':
+                encoded = [0 if v is None else v.toordinal() for v in values]
+            elif self.encoding == 'float':
+                encoded = [0.0 if v is None else float(v) for v in values]
+            else:
+                encoded = [0 if v is None else int(v) for v in values]
+            self.data.append(struct.pack(f'<{count}{self.fmt}', *encoded))
+        else:
+            parts = [b'' if v is None else (v.isoformat() if isinstance(v, datetime) else str(v)).encode('utf-8')
+                     for v in values]
+            ends = []
+            position = self.text_size
+            for part in parts:
+                position += len(part)
+                ends.append(position)
+            self.ends.append(struct.pack(f'<{count}q', *ends))
+            self.data.append(b''.join(parts))
+            self.text_size = position
+        self.nulls.append(nulls)
+        self.has_none = self.has_none or 1 in nulls
+        self.length += count
+
+    def __len__(self):
+        return self.length
+
+    def _slice(self, start, stop):
+        # Значения строк [start, stop) одним чтением
+        count = stop - start
+        if count <= 0:
+            return []
+        nulls = self.nulls.view()[start:stop]
+        if self.fmt:
+            raw = struct.unpack_from(f'<{count}{self.fmt}', self.data.view(), start * self.width)
+            if self.encoding == 'date':
+                raw = [date.fromordinal(v) if v else None for v in raw]
+            elif self.encoding == 'bool':
+                raw = [bool(v) for v in raw]
+        else:
+            ends = struct.unpack_from(f'<{count}q', self.ends.view(), start * 8)
+            first = struct.unpack_from('<q', self.ends.view(), (start - 1) * 8)[0] if start else 0
+            data = self.data.view()
+            starts = (first,) + ends[:-1]
+            return [None if null else self.decode(data[s:e].decode('utf-8'))
+                    for null, s, e in zip(nulls, starts, ends)]
+        return [None if null else value for null, value in zip(nulls, raw)]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            values = self._slice(start, stop) if step == 1 else None
+            return values if values is not None else [self[i] for i in range(start, stop, step)]
+        if key < 0:
+            key += self.length
+        if not 0 <= key < self.length:
+            raise IndexError(key)
+        return self._slice(key, key + 1)[0]
+
+    def __iter__(self):
+        for start in range(0, self.length, ITER_CHUNK):
+            yield from self._slice(start, min(start + ITER_CHUNK, self.length))
+
+    def __contains__(self, value):
+        if value is None:
+            return self.has_none
+        return any(v == value for v in self)
+
+    def numeric(self):
+        # Колонка как массив float64 (None -> NaN) прямо из файла; None, если кодировка не числовая
+        if np is None or self.encoding not in ('int', 'float') or not self.length:
+            return None
+        dtype = np.int64 if self.encoding == 'int' else np.float64
+        values = np.array(np.frombuffer(self.data.view(), dtype=dtype, count=self.length), dtype=np.float64)
+        if self.has_none:
+            values[np.frombuffer(self.nulls.view(), dtype=np.uint8, count=self.length).astype(bool)] = np.nan
+        return values
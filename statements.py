@@ -0,0 +1,79 @@
+# Реестр подготовленных запросов: повторяющиеся формы запросов выполняются
+# через серверные PREPARE/EXECUTE, чтобы PostgreSQL не разбирал и не планировал их заново
+import hashlib
+import re
+import weakref
+from collections import namedtuple
+
+import queries
+
+_PLACEHOLDER_RE = re.compile(r'%s')
+
+# Форма запроса: исходный текст с %s, текст для PREPARE и готовая строка EXECUTE
+Statement = namedtuple('Statement', ['name', 'sql', 'param_count', 'prepare_sql', 'execute_sql'])
+
+
+class StatementRegistry:
+    # Формы строятся один раз (по метаданным TABLES), подготавливаются на каждом соединении при первом вызове
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.shapes = {}
+        # соединение -> имена уже подготовленных на нем запросов
+        self.prepared = weakref.WeakKeyDictionary()
+
+    def shape(self, key, sql):
+        # Регистрация формы запроса по ключу
+        statement = self.shapes.get(key)
+        if statement is None:
+            name = 'stmt_' + hashlib.md5(repr(key).encode('utf-8')).hexdigest()[:16]
+            numbers = iter(range(1, sql.count('%s') + 1))
+            pg_sql = _PLACEHOLDER_RE.sub(lambda m: f"${next(numbers)}", sql)
+            param_count = sql.count('%s')
+            args = f" ({', '.join(['%s'] * param_count)})" if param_count else ""
+            statement = Statement(name, sql, param_count, f"PREPARE {name} AS {pg_sql}", f"EXECUTE {name}{args}")
+            self.shapes[key] = statement
+        return statement
+
+    def reset(self):
+        # Забыть формы и подготовленные запросы (после изменения метаданных таблиц); на сервере
+        # старые подготовленные запросы остаются под прежними именами и новым формам не мешают
+        self.shapes = {}
+        self.prepared = weakref.WeakKeyDictionary()
+
+    def sql_statement(self, sql):
+        # Форма, заданная готовым текстом (справочники, отчеты)
+        return self.shapes.get(sql) or self.shape(sql, sql)
+
+    def table_statement(self, table, current_filter=None, sort_column=None, sort_reverse=False, as_of=None,
+                        include_archive=False):
+        # Форма загрузки таблицы: (форма, параметры); текст запроса собирается только при первом обращении
+        field, operator = current_filter[:2] if current_filter else (None, None)
+        as_of = as_of if table in queries.AS_OF_COLUMNS else None
+        include_archive = include_archive and table in queries.ARCHIVE_SOURCES
+        key = ('table', table, field, operator, sort_column, bool(sort_reverse), bool(as_of), include_archive)
+        statement = self.shapes.get(key)
+        if statement is None:
+            info = self.tables[table]
+            for col in (field, sort_column):
+                if col is not None and col not in info['columns']:
+                    raise ValueError(f"Неизвестная колонка {col} таблицы {table}")
+            sql, _ = queries.build_table_query(table, current_filter, sort_column, sort_reverse, info['columns'],
+                                               as_of, include_archive)
+            statement = self.shape(key, sql)
+        return statement, queries.table_query_params(current_filter, as_of)
+
+    def execute(self, cursor, statement, params=None):
+        # Выполнить форму на соединении курсора, подготовив ее при первом использовании
+        conn = cursor.connection
+        names = self.prepared.get(conn)
+        if names is None:
+            names = self.prepared[conn] = set()
+        if statement.name not in names:
+            cursor.execute(statement.prepare_sql)
+            names.add(statement.name)
+        cursor.execute(statement.execute_sql, params if statement.param_count else None)
+
+    def execute_sql(self, cursor, sql, params=None):
+        # Выполнить готовый текст запроса как подготовленный
+        self.execute(cursor, self.sql_statement(sql), params)
@@ -0,0 +1,503 @@
+# Проверка строк по ограничениям схемы до отправки на сервер
+# Типы и обязательность колонок, CHECK, UNIQUE и внешние ключи берутся из метаданных каталога (catalog.py);
+# условия CHECK переводятся в функции Python (неподдержанные выражения оставляются серверу),
+# уникальность и ссылки проверяются одним запросом на ограничение для всей пачки строк
+import re
+from collections import namedtuple
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+import catalog
+
+# Сколько строк проверять одним запросом уникальности или ссылок
+LOOKUP_CHUNK = 1000
+
+INT_TYPES = {'smallint': 2 ** 15, 'integer': 2 ** 31, 'bigint': 2 ** 63}
+
+Violation = namedtuple('Violation', ['row', 'column', 'message'])
+Column = namedtuple('Column', ['type', 'nullable', 'server_default', 'precision', 'scale', 'max_length'])
+
+
+class Pending:
+    # Значение, которое станет известно при сохранении (id нового дома или квартиры в той же транзакции)
+    # Равные ключи - одна и та же будущая запись; с записями в БД такое значение не совпадает
+
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return isinstance(other, Pending) and other.key == self.key
+
+    def __hash__(self):
+        return hash(('pending', self.key))
+
+
+class _Unknown(Exception):
+    # В строке нет колонки, от которой зависит условие: проверку выполнит сервер
+    pass
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def convert(value, column):
+    # Значение из формы (строка, bool или None) в тип колонки; ValueError с текстом для пользователя
+    if value is None or isinstance(value, Pending):
+        return value
+    kind = column.type
+    if kind in INT_TYPES:
+        try:
+            number = int(str(value).strip())
+        except ValueError:
+            raise ValueError("ожидается целое число")
+        if not -INT_TYPES[kind] <= number < INT_TYPES[kind]:
+            raise ValueError("число вне допустимого диапазона")
+        return number
+    if kind == 'numeric':
+        try:
+            number = Decimal(str(value).strip().replace(',', '.'))
+        except InvalidOperation:
+            raise ValueError("ожидается число")
+        if not number.is_finite():
+            raise ValueError("ожидается число")
+        if column.precision is not None:
+            integer_digits = column.precision - (column.scale or 0)
+            if abs(number) >= Decimal(10) ** integer_digits:
+                raise ValueError(f"не больше {integer_digits} знаков до запятой")
+        return number
+    if kind in ('real', 'double precision'):
+        try:
+            return float(str(value).strip().replace(',', '.'))
+        except ValueError:
+            raise ValueError("ожидается число")
+    if kind == 'date':
+        if isinstance(value, date):
+            return value
+        try:
+            return date.fromisoformat(str(value).strip())
+        except ValueError:
+            raise ValueError("ожидается дата в формате ГГГГ-ММ-ДД")
+    if kind == 'boolean':
+        if isinstance(value, bool):
+            return value
+        text = str(value).strip().lower()
+        if text in ('true', 't', 'да', '1'):
+            return True
+        if text in ('false', 'f', 'нет', '0'):
+            return False
+        raise ValueError("ожидается Да или Нет")
+    if kind in ('text', 'character varying', 'character'):
+        text = str(value)
+        if column.max_length is not None and len(text) > column.max_length:
+            raise ValueError(f"не длиннее {column.max_length} символов")
+        return text
+    return value
+
+
+# ==================== CHECK: перевод выражения в функцию ====================
+
+_TOKEN_RE = re.compile(r"""\s*(?:
+    (?P<number>\d+(?:\.\d+)?)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<cast>::\s*(?:"?[a-z_]+"?)(?:\s+(?:precision|varying|without\s+time\s+zone|with\s+time\s+zone))?(?:\(\d+(?:,\d+)?\))?)
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<op>>=|<=|<>|!=|=|<|>|\(|\)|,|-|\+)
+)""", re.X)
+
+
+def _tokenize(text):
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = _TOKEN_RE.match(text, position)
+        if not match or match.end() == position:
+            raise _Unsupported(text[position:])
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'cast':
+            value = re.sub(r'\(.*\)|"', '', value[2:]).strip().lower()
+        elif kind == 'name':
+            value = value.lower()
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+def _cast(value, type_name):
+    if value is None:
+        return None
+    if type_name in INT_TYPES or type_name in ('int', 'int4', 'int8', 'int2'):
+        return int(value)
+    if type_name == 'numeric':
+        return Decimal(str(value))
+    if type_name in ('real', 'double precision'):
+        return float(value)
+    if type_name == 'date':
+        if isinstance(value, datetime):
+            return value.date()
+        return value if isinstance(value, date) else date.fromisoformat(str(value))
+    if type_name in ('text', 'character varying', 'varchar'):
+        return str(value)
+    return value
+
+
+def _compare(op, left, right):
+    if left is None or right is None:
+        return None
+    if op == '=':
+        return left == right
+    if op in ('<>', '!='):
+        return left != right
+    if op == '<':
+        return left < right
+    if op == '>':
+        return left > right
+    if op == '<=':
+        return left <= right
+    return left >= right
+
+
+def _and(values):
+    if any(v is False for v in values):
+        return False
+    return None if any(v is None for v in values) else True
+
+
+def _or(values):
+    if any(v is True for v in values):
+        return True
+    return None if any(v is None for v in values) else False
+
+
+class _CheckParser:
+    # Разбор выражения CHECK в виде pg_get_constraintdef: сравнения, AND/OR/NOT, IS [NOT] NULL,
+    # + и -, приведения ::тип, now(), CURRENT_DATE и EXTRACT(поле FROM ...). Результат - функция f(row)
+
+    def __init__(self, text):
+        self.tokens = _tokenize(text)
+        self.position = 0
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if (kind and token[0] != kind) or (value and token[1] != value):
+            raise _Unsupported(f"ожидалось {value or kind}")
+        self.position += 1
+        return token
+
+    def accept(self, kind, value):
+        if self.peek() == (kind, value):
+            self.position += 1
+            return True
+        return False
+
+    def parse(self):
+        self.take('name', 'check')
+        predicate = self.expression()
+        if self.peek()[0] is not None:
+            raise _Unsupported("лишние символы")
+        return predicate
+
+    def expression(self):
+        parts = [self.conjunction()]
+        while self.accept('name', 'or'):
+            parts.append(self.conjunction())
+        if len(parts) == 1:
+            return parts[0]
+        return lambda row: _or([part(row) for part in parts])
+
+    def conjunction(self):
+        parts = [self.negation()]
+        while self.accept('name', 'and'):
+            parts.append(self.negation())
+        if len(parts) == 1:
+            return parts[0]
+        return lambda row: _and([part(row) for part in parts])
+
+    def negation(self):
+        if self.accept('name', 'not'):
+            inner = self.negation()
+            return lambda row: None if inner(row) is None else not inner(row)
+        return self.comparison()
+
+    def comparison(self):
+        left = self.additive()
+        if self.accept('name', 'is'):
+            negate = self.accept('name', 'not')
+            self.take('name', 'null')
+            return lambda row: (left(row) is None) != negate
+        kind, value = self.peek()
+        if kind == 'op' and value in ('=', '<>', '!=', '<', '>', '<=', '>='):
+            self.position += 1
+            right = self.additive()
+            return lambda row: _compare(value, left(row), right(row))
+        return left
+
+    def additive(self):
+        result = self.unary()
+        while self.peek() in (('op', '+'), ('op', '-')):
+            sign = self.take()[1]
+            left, right = result, self.unary()
+
+            def result(row, left=left, right=right, sign=sign):
+                a, b = left(row), right(row)
+                if a is None or b is None:
+                    return None
+                return a + b if sign == '+' else a - b
+        return result
+
+    def unary(self):
+        if self.accept('op', '-'):
+            inner = self.unary()
+            return lambda row: None if inner(row) is None else -inner(row)
+        return self.casts(self.primary())
+
+    def casts(self, term):
+        while self.peek()[0] == 'cast':
+            type_name = self.take()[1]
+            term = (lambda inner, t: lambda row: _cast(inner(row), t))(term, type_name)
+        return term
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == 'number':
+            number = Decimal(value) if '.' in value else int(value)
+            return lambda row: number
+        if kind == 'string':
+            text = value[1:-1].replace("''", "'")
+            # Отрицательные числа приходят из каталога строкой с приведением: '-1'::integer
+            return lambda row: text
+        if (kind, value) == ('op', '('):
+            inner = self.expression()
+            self.take('op', ')')
+            return inner
+        if kind != 'name':
+            raise _Unsupported(value)
+        if value in ('current_date', 'current_timestamp') or self.peek() == ('op', '('):
+            return self.function(value)
+        if value in ('true', 'false'):
+            flag = value == 'true'
+            return lambda row: flag
+        if value == 'null':
+            return lambda row: None
+        return self.column(value)
+
+    def function(self, name):
+        if name == 'current_date':
+            return lambda row: date.today()
+        if name == 'current_timestamp':
+            return lambda row: datetime.now()
+        self.take('op', '(')
+        if name == 'now':
+            self.take('op', ')')
+            return lambda row: datetime.now()
+        if name == 'extract':
+            field = self.take('name')[1]
+            self.take('name', 'from')
+            source = self.expression()
+            self.take('op', ')')
+            if field not in ('year', 'month', 'day'):
+                raise _Unsupported(field)
+            return lambda row: None if source(row) is None else Decimal(getattr(source(row), field))
+        raise _Unsupported(name)
+
+    @staticmethod
+    def column(name):
+        def value(row):
+            if name not in row:
+                raise _Unknown(name)
+            return row[name]
+        return value
+
+
+def compile_check(definition):
+    # Функция f(row) -> True/False/None для определения CHECK; None, если выражение не поддерживается
+    try:
+        return _CheckParser(definition).parse()
+    except (_Unsupported, ValueError, IndexError):
+        return None
+
+
+# ==================== Проверка строк ====================
+
+class ConstraintValidator:
+    # Ограничения таблиц TABLES из каталога; check() возвращает нарушения для пачки строк
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.labels = {}
+        self.columns = None
+        self.primary = {}
+        self.checks = {}
+        self.uniques = {}
+        self.foreign = {}
+
+    def loaded(self):
+        return self.columns is not None
+
+    def load(self, cursor):
+        # Прочитать ограничения из каталога (запросами на все таблицы сразу)
+        self.apply(catalog.read_catalog(cursor, list(self.tables)))
+
+    def apply(self, meta):
+        # Ограничения из метаданных каталога (прочитанных или сохраненных в файле)
+        self.labels = {(table, col): name for table, info in self.tables.items()
+                       for col, name in zip(info['columns'], info['column_names'])}
+        columns, primary, checks, uniques, foreign = {}, {}, {}, {}, {}
+        for table, described in meta['tables'].items():
+            columns[table] = {col['name']: Column(col['type'], col['nullable'], col['server_default'],
+                                                  col['precision'], col['scale'], col['max_length'])
+                              for col in described['columns']}
+            if described['pk']:
+                primary[table] = list(described['pk'])
+            for unique in described['uniques']:
+                # Частичный индекс: условие WHERE переводится как CHECK; неподдержанное оставляется серверу
+                where = unique.get('where')
+                predicate = compile_check(f"CHECK ({where})") if where else None
+                if where and predicate is None:
+                    continue
+                uniques.setdefault(table, []).append((unique['name'], unique['columns'], where, predicate))
+            for fk in described['foreign']:
+                foreign.setdefault(table, []).append((fk['name'], fk['columns'], fk['ref_table'], fk['ref_columns']))
+            for constraint in described['checks']:
+                predicate = compile_check(constraint['definition'])
+                if predicate is not None:
+                    checks.setdefault(table, []).append((constraint['name'], constraint['columns'],
+                                                         constraint['definition'], predicate))
+        self.columns, self.primary, self.checks, self.uniques, self.foreign = columns, primary, checks, uniques, foreign
+
+    def label(self, table, columns):
+        return ", ".join(self.labels.get((table, col), col) for col in columns)
+
+    def check(self, table, rows, cursor=None, pks=None, required=True):
+        # Нарушения ограничений [Violation] для строк [{колонка: значение}]
+        # pks - ключи изменяемых строк (UPDATE): строка не конфликтует по уникальности сама с собой
+        # required - проверять, что заполнены обязательные колонки (вставка новой строки)
+        # cursor - для проверок уникальности и ссылок в БД; без него проверяются только типы и условия
+        table_columns = self.columns.get(table, {})
+        violations = []
+        converted = []
+        for index, row in enumerate(rows):
+            values = {}
+            for col, value in row.items():
+                info = table_columns.get(col)
+                if info is None:
+                    continue
+                if isinstance(value, str) and value.strip() == "" and info.type not in ('text', 'character varying'):
+                    value = None
+                try:
+                    values[col] = convert(value, info)
+                except ValueError as e:
+                    violations.append(Violation(index, col, f"{self.label(table, [col])}: {e}"))
+            if required:
+                for col, info in table_columns.items():
+                    if not info.nullable and not info.server_default and values.get(col) is None \
+                            and col not in [v.column for v in violations if v.row == index]:
+                        violations.append(Violation(index, col, f"{self.label(table, [col])}: обязательное поле"))
+            else:
+                for col, value in values.items():
+                    if value is None and not table_columns[col].nullable:
+                        violations.append(Violation(index, col, f"{self.label(table, [col])}: обязательное поле"))
+            for name, cols, definition, predicate in self.checks.get(table, []):
+                try:
+                    if predicate(values) is False:
+                        violations.append(Violation(index, cols[0] if cols else None,
+                                                    f"{self.label(table, cols)}: нарушено условие "
+                                                    f"{definition[len('CHECK ('):-1]}"))
+                except (_Unknown, TypeError, ValueError, ArithmeticError):
+                    pass
+            converted.append(values)
+
+        bad = {v.row for v in violations}
+        candidates = [(i, values) for i, values in enumerate(converted) if i not in bad]
+        for name, cols, where, predicate in self.uniques.get(table, []):
+            violations += self._check_unique(table, cols, candidates, cursor, pks, where, predicate)
+        if cursor is not None:
+            for name, cols, ref_table, ref_cols in self.foreign.get(table, []):
+                violations += self._check_foreign(table, cols, ref_table, ref_cols, candidates, cursor)
+        violations.sort(key=lambda v: v.row)
+        return violations
+
+    def _check_unique(self, table, cols, candidates, cursor, pks, where=None, predicate=None):
+        # Повтор внутри пачки и совпадение с записями в БД; строки с NULL в ключе не сравниваются
+        # where/predicate - условие частичного индекса: сравниваются только строки, для которых оно истинно
+        violations = []
+        label = self.label(table, cols)
+        seen = {}
+        lookup = []
+        for index, values in candidates:
+            if not all(col in values for col in cols):
+                continue
+            if predicate is not None:
+                try:
+                    if predicate(values) is not True:
+                        continue
+                except (_Unknown, TypeError, ValueError, ArithmeticError):
+                    continue
+            key = tuple(values[col] for col in cols)
+            if any(v is None for v in key):
+                continue
+            if key in seen:
+                violations.append(Violation(index, cols[0], f"{label}: повторяет строку {seen[key] + 1}"))
+                continue
+            seen[key] = index
+            if not any(isinstance(v, Pending) for v in key):
+                lookup.append((index, key))
+        if cursor is None or not lookup:
+            return violations
+        pk_cols = self.primary.get(table, [])
+        for found in self._lookup(cursor, table, cols, [key for _, key in lookup], pk_cols, where):
+            key, pk = found[:len(cols)], found[len(cols):]
+            for index, row_key in lookup:
+                own = pks is not None and len(pk) == 1 and str(pk[0]) == str(pks[index])
+                if row_key == key and not own:
+                    violations.append(Violation(index, cols[0], f"{label}: такое значение уже есть в БД"))
+        return violations
+
+    def _check_foreign(self, table, cols, ref_table, ref_cols, candidates, cursor):
+        # Ссылки на несуществующие записи; одна выборка на ограничение для всех строк пачки
+        keys = {}
+        for index, values in candidates:
+            if not all(col in values for col in cols):
+                continue
+            key = tuple(values[col] for col in cols)
+            if any(v is None or isinstance(v, Pending) for v in key):
+                continue
+            keys.setdefault(key, []).append(index)
+        if not keys:
+            return []
+        existing = set(self._lookup(cursor, ref_table, ref_cols, list(keys)))
+        label = self.label(table, cols)
+        ref_name = self.tables.get(ref_table, {}).get('name', ref_table)
+        return [Violation(index, cols[0], f"{label}: нет записи {', '.join(map(str, key))} в таблице \"{ref_name}\"")
+                for key, indices in keys.items() if key not in existing for index in indices]
+
+    @staticmethod
+    def _lookup(cursor, table, cols, keys, extra=(), where=None):
+        # Строки table с ключами cols из keys: [(значения cols..., значения extra...)]; where - доп. условие
+        found = []
+        row_template = "(" + ", ".join(["%s"] * len(cols)) + ")"
+        for start in range(0, len(keys), LOOKUP_CHUNK):
+            chunk = keys[start:start + LOOKUP_CHUNK]
+            cursor.execute(f"SELECT {', '.join(list(cols) + list(extra))} FROM {table} "
+                           f"WHERE ({', '.join(cols)}) IN ({', '.join([row_template] * len(chunk))})"
+                           + (f" AND ({where})" if where else ""),
+                           [value for key in chunk for value in key])
+            found += [tuple(row) for row in cursor.fetchall()]
+        return found
+
+
+def format_violations(violations, row_names=None, limit=20):
+    # Текст для окна сообщения: не больше limit нарушений, строки подписаны row_names
+    lines = []
+    for v in violations[:limit]:
+        prefix = f"{row_names[v.row]}: " if row_names else ""
+        lines.append(prefix + v.message)
+    if len(violations) > limit:
+        lines.append(f"... и еще {len(violations) - limit}")
+    return "\n".join(lines)
@@ -1,3 +1,6 @@
+-- триграммы для поиска по подстроке (подсказки ссылочных полей)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- таблица services (службы)
 CREATE TABLE services (
     service_id   int GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
@@ -40,6 +43,9 @@ CREATE TABLE houses (
     street           text NOT NULL,
     house_number     text NOT NULL,
     building         text, -- корпус
+    -- ключ естественного порядка номера ("2" < "10" < "10а"): числовая часть и остаток
+    house_number_num    int GENERATED ALWAYS AS (NULLIF(substring(house_number from '^[0-9]{0,9}'), '')::int) STORED,
+    house_number_suffix text GENERATED ALWAYS AS (substring(house_number from '^[0-9]{0,9}(.*)$')) STORED,
     year_built       int CHECK (year_built >= 1800 AND year_built <= extract(year from now())::int),
     total_apartments int NOT NULL DEFAULT 0 CHECK (total_apartments >= 0),
     resident_count   int NOT NULL DEFAULT 0 CHECK (resident_count >= 0), -- число проживающих, будем поддерживать триггером
@@ -56,6 +62,9 @@ CREATE TABLE apartments (
     apartment_id     int GENERATED ALWAYS AS IDENTITY,
     house_id         int NOT NULL,
     apt_number       text NOT NULL,
+    -- ключ естественного порядка номера квартиры, как у домов
+    apt_number_num    int GENERATED ALWAYS AS (NULLIF(substring(apt_number from '^[0-9]{0,9}'), '')::int) STORED,
+    apt_number_suffix text GENERATED ALWAYS AS (substring(apt_number from '^[0-9]{0,9}(.*)$')) STORED,
     floor            int CHECK (floor >= -1 AND floor <= 100),
     living_area      numeric(8,2) NOT NULL CHECK (living_area >= 0),
     total_area       numeric(8,2) NOT NULL CHECK (total_area >= living_area),
@@ -92,15 +101,38 @@ CREATE TABLE tenants (
     payer_code_id  int,
     moved_in     date NOT NULL DEFAULT current_date,
     moved_out    date, -- NULL = действующий жилец
+    residency    daterange GENERATED ALWAYS AS (daterange(moved_in, moved_out, '[)')) STORED, -- период проживания
     created_at    timestamptz NOT NULL DEFAULT now(),
     PRIMARY KEY (tenant_id),
     UNIQUE (apartment_id, full_name, moved_in), 
-    UNIQUE (inn),
     FOREIGN KEY (apartment_id) REFERENCES apartments(apartment_id) ON DELETE CASCADE,
     FOREIGN KEY (payer_code_id) REFERENCES payer_codes(payer_code_id) ON DELETE SET NULL,
     CHECK (moved_out IS NULL OR moved_out >= moved_in)
 );
 
+-- таблица tenants_archive (архив выселенных жильцов)
+-- выселенные давно жильцы переносятся сюда функцией archive_moved_out_tenants,
+-- чтобы tenants и ее индексы содержали только рабочую часть
+CREATE TABLE tenants_archive (
+    tenant_id    int NOT NULL,
+    apartment_id int NOT NULL,
+    full_name    text NOT NULL,
+    inn          text,
+    passport     text,
+    birth_date   date,
+    is_responsible boolean NOT NULL DEFAULT false,
+    payer_code_id  int,
+    moved_in     date NOT NULL,
+    moved_out    date NOT NULL,
+    residency    daterange GENERATED ALWAYS AS (daterange(moved_in, moved_out, '[)')) STORED,
+    created_at    timestamptz NOT NULL,
+    archived_at   timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (tenant_id),
+    FOREIGN KEY (apartment_id) REFERENCES apartments(apartment_id) ON DELETE CASCADE,
+    FOREIGN KEY (payer_code_id) REFERENCES payer_codes(payer_code_id) ON DELETE SET NULL,
+    CHECK (moved_out >= moved_in)
+);
+
 -- таблица tariffs (тарифы)
 CREATE TABLE tariffs (
     tariff_id   int GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
@@ -124,11 +156,18 @@ CREATE INDEX idx_sections_department ON sections(department_id);
 -- индекс для поиска домов по участку
 CREATE INDEX idx_houses_section ON houses(section_id);
 
--- индекс для поиска домов по улице
-CREATE INDEX idx_houses_street ON houses(street);
+-- индекс для поиска домов по улице; адреса по нему идут в естественном порядке номеров,
+-- покрывает список домов и порядок адресов в отчетах
+CREATE INDEX idx_houses_street_natural ON houses(street, house_number_num, house_number_suffix, building)
+    INCLUDE (house_id, house_number);
+
+-- индекс для поиска домов по подстроке адреса (подсказки выбора дома и квартиры)
+CREATE INDEX idx_houses_address_trgm ON houses USING gin ((street || ' ' || house_number) gin_trgm_ops);
 
--- индекс для поиска квартир по дому
-CREATE INDEX idx_apartments_house ON apartments(house_id);
+-- индекс для поиска квартир по дому; квартиры дома идут в естественном порядке номеров,
+-- покрывает колонки квартир в отчетах (index-only scan)
+CREATE INDEX idx_apartments_house_cover ON apartments(house_id, apt_number_num, apt_number_suffix)
+    INCLUDE (apartment_id, apt_number, total_area, current_residents, cold_water, hot_water, elevator);
 
 -- индекс для поиска жильцов по квартире
 CREATE INDEX idx_tenants_apartment ON tenants(apartment_id);
@@ -136,12 +175,106 @@ CREATE INDEX idx_tenants_apartment ON tenants(apartment_id);
 -- индекс для поиска жильцов по ФИО
 CREATE INDEX idx_tenants_fullname ON tenants(full_name);
 
--- индекс для поиска действующих жильцов
-CREATE INDEX idx_tenants_active ON tenants(apartment_id) WHERE moved_out IS NULL;
+-- индекс для поиска действующих жильцов; покрывает колонки отчета "Жильцы по участкам"
+CREATE INDEX idx_tenants_active_cover ON tenants(apartment_id)
+    INCLUDE (full_name, birth_date, passport) WHERE moved_out IS NULL;
+
+-- ИНН уникален среди действующих жильцов; у выселенных (и в архиве) он остается как был
+CREATE UNIQUE INDEX idx_tenants_inn_active ON tenants(inn) WHERE moved_out IS NULL;
+
+-- индекс для поиска жильцов, проживавших на дату (residency @> дата)
+CREATE INDEX idx_tenants_residency ON tenants USING gist (residency);
+
+-- индексы архива жильцов: по квартире, по ФИО и по периоду проживания
+CREATE INDEX idx_tenants_archive_apartment ON tenants_archive(apartment_id);
+CREATE INDEX idx_tenants_archive_fullname ON tenants_archive(full_name);
+CREATE INDEX idx_tenants_archive_residency ON tenants_archive USING gist (residency);
 
 -- индекс для поиска тарифов по типу услуги
 CREATE INDEX idx_tariffs_service_type ON tariffs(service_type);
 
+-- ==================== КОММЕНТАРИИ ====================
+
+-- Названия таблиц и колонок для интерфейса: приложение берет подписи из каталога
+
+COMMENT ON TABLE services IS 'Службы';
+COMMENT ON COLUMN services.service_id IS 'ID';
+COMMENT ON COLUMN services.name IS 'Название';
+COMMENT ON COLUMN services.phone IS 'Телефон';
+COMMENT ON COLUMN services.created_at IS 'Дата создания';
+
+COMMENT ON TABLE departments IS 'Отделы';
+COMMENT ON COLUMN departments.department_id IS 'ID';
+COMMENT ON COLUMN departments.service_id IS 'ID службы';
+COMMENT ON COLUMN departments.name IS 'Название';
+COMMENT ON COLUMN departments.address IS 'Адрес';
+COMMENT ON COLUMN departments.phone IS 'Телефон';
+COMMENT ON COLUMN departments.created_at IS 'Дата создания';
+
+COMMENT ON TABLE sections IS 'Участки';
+COMMENT ON COLUMN sections.section_id IS 'ID';
+COMMENT ON COLUMN sections.department_id IS 'ID отдела';
+COMMENT ON COLUMN sections.name IS 'Название';
+COMMENT ON COLUMN sections.manager IS 'Управляющий';
+COMMENT ON COLUMN sections.created_at IS 'Дата создания';
+
+COMMENT ON TABLE houses IS 'Дома';
+COMMENT ON COLUMN houses.house_id IS 'ID';
+COMMENT ON COLUMN houses.service_id IS 'ID службы';
+COMMENT ON COLUMN houses.department_id IS 'ID отдела';
+COMMENT ON COLUMN houses.section_id IS 'ID участка';
+COMMENT ON COLUMN houses.street IS 'Улица';
+COMMENT ON COLUMN houses.house_number IS 'Номер дома';
+COMMENT ON COLUMN houses.building IS 'Корпус';
+COMMENT ON COLUMN houses.year_built IS 'Год постройки';
+COMMENT ON COLUMN houses.total_apartments IS 'Всего квартир';
+COMMENT ON COLUMN houses.resident_count IS 'Жильцов';
+COMMENT ON COLUMN houses.created_at IS 'Дата создания';
+
+COMMENT ON TABLE apartments IS 'Квартиры';
+COMMENT ON COLUMN apartments.apartment_id IS 'ID';
+COMMENT ON COLUMN apartments.house_id IS 'ID дома';
+COMMENT ON COLUMN apartments.apt_number IS 'Номер кв.';
+COMMENT ON COLUMN apartments.floor IS 'Этаж';
+COMMENT ON COLUMN apartments.living_area IS 'Жилая пл.';
+COMMENT ON COLUMN apartments.total_area IS 'Общая пл.';
+COMMENT ON COLUMN apartments.privatized IS 'Приватиз.';
+COMMENT ON COLUMN apartments.cold_water IS 'Хол. вода';
+COMMENT ON COLUMN apartments.hot_water IS 'Гор. вода';
+COMMENT ON COLUMN apartments.garbage_chute IS 'Мусоропровод';
+COMMENT ON COLUMN apartments.elevator IS 'Лифт';
+COMMENT ON COLUMN apartments.current_residents IS 'Жильцов';
+COMMENT ON COLUMN apartments.created_at IS 'Дата создания';
+
+COMMENT ON TABLE tenants IS 'Жильцы';
+COMMENT ON COLUMN tenants.tenant_id IS 'ID';
+COMMENT ON COLUMN tenants.apartment_id IS 'ID квартиры';
+COMMENT ON COLUMN tenants.full_name IS 'ФИО';
+COMMENT ON COLUMN tenants.inn IS 'ИНН';
+COMMENT ON COLUMN tenants.passport IS 'Паспорт';
+COMMENT ON COLUMN tenants.birth_date IS 'Дата рожд.';
+COMMENT ON COLUMN tenants.is_responsible IS 'Ответственный';
+COMMENT ON COLUMN tenants.payer_code_id IS 'ID шифра';
+COMMENT ON COLUMN tenants.moved_in IS 'Дата вселения';
+COMMENT ON COLUMN tenants.moved_out IS 'Дата выселения';
+COMMENT ON COLUMN tenants.created_at IS 'Дата создания';
+
+COMMENT ON TABLE payer_codes IS 'Шифры плательщиков';
+COMMENT ON COLUMN payer_codes.payer_code_id IS 'ID';
+COMMENT ON COLUMN payer_codes.code IS 'Код';
+COMMENT ON COLUMN payer_codes.name IS 'Название';
+COMMENT ON COLUMN payer_codes.percent_share IS 'Процент';
+COMMENT ON COLUMN payer_codes.created_at IS 'Дата создания';
+
+COMMENT ON TABLE tariffs IS 'Тарифы';
+COMMENT ON COLUMN tariffs.tariff_id IS 'ID';
+COMMENT ON COLUMN tariffs.service_type IS 'Тип услуги';
+COMMENT ON COLUMN tariffs.has_service IS 'Есть услуга';
+COMMENT ON COLUMN tariffs.tariff IS 'Тариф';
+COMMENT ON COLUMN tariffs.valid_from IS 'Действует с';
+COMMENT ON COLUMN tariffs.valid_to IS 'Действует до';
+COMMENT ON COLUMN tariffs.created_at IS 'Дата создания';
+
 -- ==================== ПРЕДСТАВЛЕНИЯ (VIEW) ====================
 
 -- Представление 1: по одной таблице - список всех квартир с удобствами
@@ -230,94 +363,123 @@ JOIN services sv ON h.service_id = sv.service_id
 JOIN departments d ON h.department_id = d.department_id
 JOIN sections s ON h.section_id = s.section_id;
 
+-- Представление 5: вся история жильцов - рабочая таблица и архив
+CREATE VIEW tenants_history AS
+SELECT tenant_id, apartment_id, full_name, inn, passport, birth_date, is_responsible,
+       payer_code_id, moved_in, moved_out, residency, created_at
+FROM tenants
+UNION ALL
+SELECT tenant_id, apartment_id, full_name, inn, passport, birth_date, is_responsible,
+       payer_code_id, moved_in, moved_out, residency, created_at
+FROM tenants_archive;
+
 -- ==================== ТРИГГЕРЫ ====================
 
--- Функция для обновления current_residents в apartments
+-- Функция для обновления current_residents при изменении и удалении жильцов:
+-- один UPDATE на оператор по переходным таблицам (выселение, возврат, смена квартиры, удаление),
+-- в том числе для переселения resettle_tenants - отключать подсчет для него не нужно
 CREATE OR REPLACE FUNCTION update_apartment_residents()
 RETURNS TRIGGER AS $$
 BEGIN
-    IF TG_OP = 'INSERT' THEN
-        -- при добавлении жильца увеличиваем счетчик если он активный
-        IF NEW.moved_out IS NULL THEN
-            UPDATE apartments 
-            SET current_residents = current_residents + 1 
-            WHERE apartment_id = NEW.apartment_id;
-        END IF;
-        RETURN NEW;
-    ELSIF TG_OP = 'UPDATE' THEN
-        -- если жилец переехал (moved_out стал не NULL)
-        IF OLD.moved_out IS NULL AND NEW.moved_out IS NOT NULL THEN
-            UPDATE apartments 
-            SET current_residents = current_residents - 1 
-            WHERE apartment_id = NEW.apartment_id;
-        -- если жилец вернулся (moved_out стал NULL)
-        ELSIF OLD.moved_out IS NOT NULL AND NEW.moved_out IS NULL THEN
-            UPDATE apartments 
-            SET current_residents = current_residents + 1 
-            WHERE apartment_id = NEW.apartment_id;
-        END IF;
-        -- если сменилась квартира
-        IF OLD.apartment_id != NEW.apartment_id THEN
-            IF OLD.moved_out IS NULL THEN
-                UPDATE apartments 
-                SET current_residents = current_residents - 1 
-                WHERE apartment_id = OLD.apartment_id;
-            END IF;
-            IF NEW.moved_out IS NULL THEN
-                UPDATE apartments 
-                SET current_residents = current_residents + 1 
-                WHERE apartment_id = NEW.apartment_id;
-            END IF;
-        END IF;
-        RETURN NEW;
+    -- вставка обрабатывается триггером update_apartment_residents_bulk
+    IF TG_OP = 'UPDATE' THEN
+        UPDATE apartments a
+        SET current_residents = a.current_residents + d.delta
+        FROM (
+            SELECT apartment_id, SUM(delta)::int AS delta
+            FROM (
+                SELECT apartment_id, -1 AS delta FROM old_tenants WHERE moved_out IS NULL
+                UNION ALL
+                SELECT apartment_id, 1 FROM new_tenants WHERE moved_out IS NULL
+            ) moves
+            GROUP BY apartment_id
+            HAVING SUM(delta) <> 0
+        ) d
+        WHERE a.apartment_id = d.apartment_id;
     ELSIF TG_OP = 'DELETE' THEN
-        -- при удалении уменьшаем если был активный
-        IF OLD.moved_out IS NULL THEN
-            UPDATE apartments 
-            SET current_residents = current_residents - 1 
-            WHERE apartment_id = OLD.apartment_id;
-        END IF;
-        RETURN OLD;
+        -- при удалении уменьшаем на число действующих
+        UPDATE apartments a
+        SET current_residents = a.current_residents - d.cnt
+        FROM (
+            SELECT apartment_id, COUNT(*) AS cnt
+            FROM old_tenants
+            WHERE moved_out IS NULL
+            GROUP BY apartment_id
+        ) d
+        WHERE a.apartment_id = d.apartment_id;
     END IF;
     RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
--- Триггер на таблицу tenants для обновления current_residents
+-- Триггеры уровня оператора на tenants для обновления current_residents
+-- (переходные таблицы допускаются только у триггера на одно событие - UPDATE и DELETE раздельно)
 CREATE TRIGGER trg_update_apartment_residents
-AFTER INSERT OR UPDATE OR DELETE ON tenants
-FOR EACH ROW EXECUTE FUNCTION update_apartment_residents();
+AFTER UPDATE ON tenants
+REFERENCING OLD TABLE AS old_tenants NEW TABLE AS new_tenants
+FOR EACH STATEMENT EXECUTE FUNCTION update_apartment_residents();
+
+CREATE TRIGGER trg_delete_apartment_residents
+AFTER DELETE ON tenants
+REFERENCING OLD TABLE AS old_tenants
+FOR EACH STATEMENT EXECUTE FUNCTION update_apartment_residents();
+
+-- Функция для обновления current_residents при вставке жильцов:
+-- один UPDATE на оператор INSERT, а не на каждую строку
+CREATE OR REPLACE FUNCTION update_apartment_residents_bulk()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE apartments a
+    SET current_residents = a.current_residents + n.cnt
+    FROM (
+        SELECT apartment_id, COUNT(*) AS cnt
+        FROM new_tenants
+        WHERE moved_out IS NULL
+        GROUP BY apartment_id
+    ) n
+    WHERE a.apartment_id = n.apartment_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггер уровня оператора для многострочной вставки жильцов
+CREATE TRIGGER trg_insert_apartment_residents
+AFTER INSERT ON tenants
+REFERENCING NEW TABLE AS new_tenants
+FOR EACH STATEMENT EXECUTE FUNCTION update_apartment_residents_bulk();
 
--- Функция для обновления resident_count в houses
+-- Функция для обновления resident_count в houses: один UPDATE на оператор, изменивший счетчики квартир
 CREATE OR REPLACE FUNCTION update_house_residents()
 RETURNS TRIGGER AS $$
 BEGIN
-    IF TG_OP = 'UPDATE' THEN
-        -- обновляем счетчик в доме
-        UPDATE houses 
-        SET resident_count = resident_count + (NEW.current_residents - OLD.current_residents)
-        WHERE house_id = NEW.house_id;
-        RETURN NEW;
-    END IF;
+    UPDATE houses h
+    SET resident_count = h.resident_count + d.delta
+    FROM (
+        SELECT n.house_id, SUM(n.current_residents - o.current_residents)::int AS delta
+        FROM new_apartments n
+        JOIN old_apartments o ON o.apartment_id = n.apartment_id
+        GROUP BY n.house_id
+        HAVING SUM(n.current_residents - o.current_residents) <> 0
+    ) d
+    WHERE h.house_id = d.house_id;
     RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
--- Триггер на таблицу apartments для обновления resident_count в houses
+-- Триггер уровня оператора на apartments для обновления resident_count в houses
+-- (с переходными таблицами список колонок UPDATE OF не допускается - операторы без изменения счетчиков
+-- дают пустую выборку)
 CREATE TRIGGER trg_update_house_residents
-AFTER UPDATE OF current_residents ON apartments
-FOR EACH ROW EXECUTE FUNCTION update_house_residents();
+AFTER UPDATE ON apartments
+REFERENCING OLD TABLE AS old_apartments NEW TABLE AS new_apartments
+FOR EACH STATEMENT EXECUTE FUNCTION update_house_residents();
 
 -- Функция для обновления total_apartments в houses при добавлении/удалении квартир
 CREATE OR REPLACE FUNCTION update_house_apartments_count()
 RETURNS TRIGGER AS $$
 BEGIN
-    IF TG_OP = 'INSERT' THEN
-        UPDATE houses 
-        SET total_apartments = total_apartments + 1 
-        WHERE house_id = NEW.house_id;
-        RETURN NEW;
-    ELSIF TG_OP = 'DELETE' THEN
+    -- вставка обрабатывается триггером уровня оператора (update_house_apartments_bulk)
+    IF TG_OP = 'DELETE' THEN
         UPDATE houses 
         SET total_apartments = total_apartments - 1 
         WHERE house_id = OLD.house_id;
@@ -329,5 +491,362 @@ $$ LANGUAGE plpgsql;
 
 -- Триггер для подсчета квартир в доме
 CREATE TRIGGER trg_update_house_apartments
-AFTER INSERT OR DELETE ON apartments
-FOR EACH ROW EXECUTE FUNCTION update_house_apartments_count();
\ No newline at end of file
+AFTER DELETE ON apartments
+FOR EACH ROW EXECUTE FUNCTION update_house_apartments_count();
+
+-- Функция для обновления total_apartments при вставке квартир (один UPDATE на оператор)
+CREATE OR REPLACE FUNCTION update_house_apartments_bulk()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE houses h
+    SET total_apartments = h.total_apartments + n.cnt
+    FROM (
+        SELECT house_id, COUNT(*) AS cnt
+        FROM new_apartments
+        GROUP BY house_id
+    ) n
+    WHERE h.house_id = n.house_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггер уровня оператора для многострочной вставки квартир
+CREATE TRIGGER trg_insert_house_apartments
+AFTER INSERT ON apartments
+REFERENCING NEW TABLE AS new_apartments
+FOR EACH STATEMENT EXECUTE FUNCTION update_house_apartments_bulk();
+
+-- ==================== ВЕРСИИ ДАННЫХ ====================
+
+-- Счетчик изменений каждой таблицы: увеличивается любым изменяющим оператором.
+-- Клиент сохраняет версии вместе с результатом отчета и берет его из кэша, пока версии те же
+CREATE TABLE data_versions (
+    table_name VARCHAR(63) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO data_versions (table_name) VALUES
+    ('services'),
+    ('departments'),
+    ('sections'),
+    ('houses'),
+    ('apartments'),
+    ('payer_codes'),
+    ('tenants'),
+    ('tenants_archive'),
+    ('tariffs');
+
+-- Триггер уровня оператора: одно обновление счетчика на оператор, а не на каждую строку
+CREATE OR REPLACE FUNCTION bump_data_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO data_versions (table_name, version, changed_at)
+    VALUES (TG_TABLE_NAME, 1, CURRENT_TIMESTAMP)
+    ON CONFLICT (table_name) DO UPDATE
+    SET version = data_versions.version + 1, changed_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_data_version_services
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON services
+FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+
+CREATE TRIGGER trg_data_version_departments
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON departments
+FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+
+CREATE TRIGGER trg_data_version_sections
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON sections
+FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+
+CREATE TRIGGER trg_data_version_houses
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON houses
+FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+
+CREATE TRIGGER trg_data_version_apartments
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON apartments
+FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+
+CREATE TRIGGER trg_data_version_payer_codes
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON payer_codes
+FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+
+CREATE TRIGGER trg_data_version_tenants
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON tenants
+FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+
+CREATE TRIGGER trg_data_version_tenants_archive
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON tenants_archive
+FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+
+CREATE TRIGGER trg_data_version_tariffs
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON tariffs
+FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+
+-- ==================== АРХИВАЦИЯ ====================
+
+-- Перенос жильцов, выселенных раньше p_before, из tenants в tenants_archive одним оператором;
+-- счетчики жильцов не меняются (выселенные в них не учитываются). Возвращает число перенесенных строк
+CREATE OR REPLACE FUNCTION archive_moved_out_tenants(p_before date)
+RETURNS int AS $$
+DECLARE
+    moved_count int;
+BEGIN
+    WITH moved AS (
+        DELETE FROM tenants
+        WHERE moved_out IS NOT NULL AND moved_out < p_before
+        RETURNING tenant_id, apartment_id, full_name, inn, passport, birth_date, is_responsible,
+                  payer_code_id, moved_in, moved_out, created_at
+    )
+    INSERT INTO tenants_archive (tenant_id, apartment_id, full_name, inn, passport, birth_date, is_responsible,
+                                 payer_code_id, moved_in, moved_out, created_at)
+    SELECT * FROM moved;
+    GET DIAGNOSTICS moved_count = ROW_COUNT;
+    RETURN moved_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ==================== ПЕРЕСЕЛЕНИЕ ====================
+
+-- Переселение действующих жильцов квартир p_from[i] в квартиры p_to[i] с даты p_date одним оператором:
+-- прежние записи закрываются (moved_out = p_date), в новых квартирах открываются новые с moved_in = p_date.
+-- ИНН остается и в закрытой записи (уникален только среди действующих). Счетчики current_residents
+-- и resident_count пересчитывают триггеры уровня оператора: по одному UPDATE на закрытие и на вставку.
+-- Возвращает число переселенных жильцов
+CREATE OR REPLACE FUNCTION resettle_tenants(p_from int[], p_to int[], p_date date)
+RETURNS int AS $$
+DECLARE
+    moved_count int;
+BEGIN
+    IF cardinality(p_from) IS DISTINCT FROM cardinality(p_to) THEN
+        RAISE EXCEPTION 'Списки квартир "откуда" и "куда" разной длины';
+    END IF;
+    IF (SELECT count(DISTINCT f) FROM unnest(p_from) AS f) <> cardinality(p_from) THEN
+        RAISE EXCEPTION 'Квартира-источник указана несколько раз';
+    END IF;
+
+    WITH plan AS (
+        SELECT from_id, to_id FROM unnest(p_from, p_to) AS m(from_id, to_id)
+    ), moving AS (
+        SELECT t.tenant_id, p.to_id
+        FROM tenants t
+        JOIN plan p ON p.from_id = t.apartment_id
+        WHERE t.moved_out IS NULL
+    ), closed AS (
+        UPDATE tenants t
+        SET moved_out = p_date
+        FROM moving m
+        WHERE t.tenant_id = m.tenant_id
+        RETURNING t.apartment_id AS from_id, m.to_id, t.full_name, t.inn, t.passport, t.birth_date,
+                  t.is_responsible, t.payer_code_id
+    ), opened AS (
+        INSERT INTO tenants (apartment_id, full_name, inn, passport, birth_date, is_responsible, payer_code_id, moved_in)
+        SELECT to_id, full_name, inn, passport, birth_date, is_responsible, payer_code_id, p_date
+        FROM closed
+    )
+    SELECT count(*) INTO moved_count FROM closed;
+    RETURN moved_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ==================== ГЛОБАЛЬНЫЙ ПОИСК ====================
+
+-- Единый полнотекстовый индекс жильцов, домов, отделов и участков (конфигурация russian):
+-- строка на запись, подпись и пояснение для списка результатов, документ tsvector с весами
+-- (A - имя или адрес, B - документы и реквизиты, C - адрес жильца). Поддерживается триггерами при записи.
+-- Жильцы индексируются вместе с архивом выселенных (tenants_history): перенос в архив строку не удаляет
+CREATE TABLE search_index (
+    entity    text NOT NULL, -- таблица записи
+    entity_id int NOT NULL,
+    title     text NOT NULL,
+    detail    text,
+    document  tsvector NOT NULL,
+    PRIMARY KEY (entity, entity_id)
+);
+
+CREATE INDEX idx_search_index_document ON search_index USING gin (document);
+
+-- Пересчет строк индекса для записей p_ids таблицы p_entity (новые добавляются, существующие заменяются)
+CREATE OR REPLACE FUNCTION search_index_refresh(p_entity text, p_ids int[])
+RETURNS void AS $$
+BEGIN
+    IF p_entity = 'tenants' THEN
+        DELETE FROM search_index
+        WHERE entity = 'tenants' AND entity_id = ANY(p_ids)
+          AND NOT EXISTS (SELECT 1 FROM tenants_history t WHERE t.tenant_id = search_index.entity_id);
+        INSERT INTO search_index (entity, entity_id, title, detail, document)
+        SELECT 'tenants', t.tenant_id, t.full_name,
+               h.street || ' ' || h.house_number || COALESCE(' корп.' || h.building, '') || ', кв. ' || a.apt_number
+                   || COALESCE(' (выселен ' || t.moved_out || ')', ''),
+               setweight(to_tsvector('russian', t.full_name), 'A')
+               || setweight(to_tsvector('russian', COALESCE(t.passport, '') || ' ' || COALESCE(t.inn, '')), 'B')
+               || setweight(to_tsvector('russian', h.street || ' ' || h.house_number || ' ' || a.apt_number), 'C')
+        FROM tenants_history t
+        JOIN apartments a ON a.apartment_id = t.apartment_id
+        JOIN houses h ON h.house_id = a.house_id
+        WHERE t.tenant_id = ANY(p_ids)
+        ON CONFLICT (entity, entity_id) DO UPDATE
+        SET title = EXCLUDED.title, detail = EXCLUDED.detail, document = EXCLUDED.document;
+    ELSIF p_entity = 'houses' THEN
+        INSERT INTO search_index (entity, entity_id, title, detail, document)
+        SELECT 'houses', h.house_id, h.street || ' ' || h.house_number || COALESCE(' корп.' || h.building, ''),
+               s.name,
+               setweight(to_tsvector('russian', h.street || ' ' || h.house_number || ' ' || COALESCE(h.building, '')), 'A')
+        FROM houses h
+        JOIN sections s ON s.section_id = h.section_id
+        WHERE h.house_id = ANY(p_ids)
+        ON CONFLICT (entity, entity_id) DO UPDATE
+        SET title = EXCLUDED.title, detail = EXCLUDED.detail, document = EXCLUDED.document;
+    ELSIF p_entity = 'departments' THEN
+        INSERT INTO search_index (entity, entity_id, title, detail, document)
+        SELECT 'departments', d.department_id, d.name, d.address,
+               setweight(to_tsvector('russian', d.name), 'A')
+               || setweight(to_tsvector('russian', COALESCE(d.address, '')), 'B')
+        FROM departments d
+        WHERE d.department_id = ANY(p_ids)
+        ON CONFLICT (entity, entity_id) DO UPDATE
+        SET title = EXCLUDED.title, detail = EXCLUDED.detail, document = EXCLUDED.document;
+    ELSIF p_entity = 'sections' THEN
+        INSERT INTO search_index (entity, entity_id, title, detail, document)
+        SELECT 'sections', s.section_id, s.name, s.manager,
+               setweight(to_tsvector('russian', s.name), 'A')
+               || setweight(to_tsvector('russian', COALESCE(s.manager, '')), 'B')
+        FROM sections s
+        WHERE s.section_id = ANY(p_ids)
+        ON CONFLICT (entity, entity_id) DO UPDATE
+        SET title = EXCLUDED.title, detail = EXCLUDED.detail, document = EXCLUDED.document;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггер уровня оператора: строки индекса пересчитываются одним запросом на оператор, а не на каждую строку
+-- TG_ARGV[0] - первичный ключ таблицы; переходные таблицы называются new_rows (вставка, изменение) и old_rows (удаление)
+-- Строки жильцов (tenants и tenants_archive) всегда пересчитываются: при переносе в архив запись остается в индексе
+CREATE OR REPLACE FUNCTION search_index_sync()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME IN ('tenants', 'tenants_archive') THEN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM search_index_refresh('tenants', ARRAY(SELECT (to_jsonb(o) ->> TG_ARGV[0])::int FROM old_rows o));
+        ELSE
+            PERFORM search_index_refresh('tenants', ARRAY(SELECT (to_jsonb(n) ->> TG_ARGV[0])::int FROM new_rows n));
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        DELETE FROM search_index
+        WHERE entity = TG_TABLE_NAME
+          AND entity_id IN (SELECT (to_jsonb(o) ->> TG_ARGV[0])::int FROM old_rows o);
+    ELSE
+        PERFORM search_index_refresh(TG_TABLE_NAME,
+                                     ARRAY(SELECT (to_jsonb(n) ->> TG_ARGV[0])::int FROM new_rows n));
+        -- название участка показывается в пояснении к его домам
+        IF TG_TABLE_NAME = 'sections' AND TG_OP = 'UPDATE' THEN
+            PERFORM search_index_refresh('houses', ARRAY(
+                SELECT h.house_id FROM houses h WHERE h.section_id IN (SELECT section_id FROM new_rows)));
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Смена адреса дома или номера квартиры меняет пояснение и адрес в документах жильцов
+-- (построчный триггер только на колонки адреса: обновления счетчиков его не вызывают)
+CREATE OR REPLACE FUNCTION search_index_address_sync()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'houses' THEN
+        PERFORM search_index_refresh('houses', ARRAY[NEW.house_id]);
+        PERFORM search_index_refresh('tenants', ARRAY(
+            SELECT t.tenant_id FROM tenants_history t
+            JOIN apartments a ON a.apartment_id = t.apartment_id
+            WHERE a.house_id = NEW.house_id));
+    ELSE
+        PERFORM search_index_refresh('tenants', ARRAY(
+            SELECT tenant_id FROM tenants_history WHERE apartment_id = NEW.apartment_id));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_search_tenants_insert
+AFTER INSERT ON tenants
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION search_index_sync('tenant_id');
+
+CREATE TRIGGER trg_search_tenants_update
+AFTER UPDATE ON tenants
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION search_index_sync('tenant_id');
+
+CREATE TRIGGER trg_search_tenants_delete
+AFTER DELETE ON tenants
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION search_index_sync('tenant_id');
+
+CREATE TRIGGER trg_search_tenants_archive_insert
+AFTER INSERT ON tenants_archive
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION search_index_sync('tenant_id');
+
+CREATE TRIGGER trg_search_tenants_archive_delete
+AFTER DELETE ON tenants_archive
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION search_index_sync('tenant_id');
+
+CREATE TRIGGER trg_search_houses_insert
+AFTER INSERT ON houses
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION search_index_sync('house_id');
+
+CREATE TRIGGER trg_search_houses_address
+AFTER UPDATE OF street, house_number, building, section_id ON houses
+FOR EACH ROW WHEN (OLD.street IS DISTINCT FROM NEW.street OR OLD.house_number IS DISTINCT FROM NEW.house_number
+                   OR OLD.building IS DISTINCT FROM NEW.building OR OLD.section_id IS DISTINCT FROM NEW.section_id)
+EXECUTE FUNCTION search_index_address_sync();
+
+CREATE TRIGGER trg_search_houses_delete
+AFTER DELETE ON houses
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION search_index_sync('house_id');
+
+CREATE TRIGGER trg_search_apartments_address
+AFTER UPDATE OF apt_number, house_id ON apartments
+FOR EACH ROW WHEN (OLD.apt_number IS DISTINCT FROM NEW.apt_number OR OLD.house_id IS DISTINCT FROM NEW.house_id)
+EXECUTE FUNCTION search_index_address_sync();
+
+CREATE TRIGGER trg_search_departments_insert
+AFTER INSERT ON departments
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION search_index_sync('department_id');
+
+CREATE TRIGGER trg_search_departments_update
+AFTER UPDATE ON departments
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION search_index_sync('department_id');
+
+CREATE TRIGGER trg_search_departments_delete
+AFTER DELETE ON departments
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION search_index_sync('department_id');
+
+CREATE TRIGGER trg_search_sections_insert
+AFTER INSERT ON sections
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION search_index_sync('section_id');
+
+CREATE TRIGGER trg_search_sections_update
+AFTER UPDATE ON sections
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION search_index_sync('section_id');
+
+CREATE TRIGGER trg_search_sections_delete
+AFTER DELETE ON sections
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION search_index_sync('section_id');
+
+-- Заполнение индекса по уже существующим данным (при создании схемы на пустой базе ничего не делает)
+SELECT search_index_refresh('sections', ARRAY(SELECT section_id FROM sections));
+SELECT search_index_refresh('departments', ARRAY(SELECT department_id FROM departments));
+SELECT search_index_refresh('houses', ARRAY(SELECT house_id FROM houses));
+SELECT search_index_refresh('tenants', ARRAY(SELECT tenant_id FROM tenants_history));